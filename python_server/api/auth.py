@@ -1,26 +1,53 @@
 from flask import Blueprint, request, jsonify, session
 from datetime import timedelta
+import asyncio
+import logging
 import uuid
 
-from ..models.repositories import UserRepository
+from ..models.repositories import UserRepository, UserAlreadyExistsError, get_repository
+from ..models.async_repositories import AsyncUserRepository
 from ..models.models import UserCreate, User, UserLogin, Token
-from ..utils.auth import get_password_hash, verify_password, create_access_token, login_required
+from ..utils.auth import (
+    get_password_hash_async, verify_password_async, password_needs_rehash, create_access_token, login_required
+)
+from ..utils.password_pool import PasswordPoolFull
 from ..config.settings import JWT_ACCESS_TOKEN_EXPIRES, SECRET_KEY #Import SECRET_KEY
 
 auth_bp = Blueprint("auth", __name__)
-user_repo = UserRepository()
+user_repo = get_repository(UserRepository)
+async_user_repo = get_repository(AsyncUserRepository)
+
+logger = logging.getLogger(__name__)
+
+# Rehash in corso dopo il login (riferimenti forti finché i task non terminano)
+_rehash_tasks = set()
+
+
+def _busy_response():
+    """Pool delle password saturo: rifiuto immediato, il client può riprovare."""
+    response = jsonify({"success": False, "message": "Authentication service busy, retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+async def _rehash_password(user_id: str, password: str):
+    """Sostituisce un hash legacy (scrypt) o con costo superato con un hash bcrypt corrente."""
+    try:
+        hashed_password = await get_password_hash_async(password)
+        await async_user_repo.update(user_id, {"password": hashed_password})
+        logger.info(f"Password dell'utente {user_id} riconvertita in bcrypt")
+    except PasswordPoolFull:
+        logger.info(f"Pool password saturo: rehash dell'utente {user_id} rimandato al prossimo login")
+    except Exception as e:
+        logger.error(f"Errore nel rehash della password dell'utente {user_id}: {str(e)}")
+
 
 @auth_bp.route("/register", methods=["POST"])
 @auth_bp.route("/api/register", methods=["POST"])
-def register():
+async def register():
     """Registra un nuovo utente."""
     data = request.json
 
-    # Verifica se l'utente esiste già
-    existing_user = user_repo.get_by_username(data.get("username"))
-    if existing_user:
-        return jsonify({"success": False, "message": "Username already exists"}), 400
-
     # Crea un nuovo utente
     user_create = UserCreate(
         username=data.get("username"),
@@ -29,11 +56,17 @@ def register():
         password=data.get("password")
     )
 
-    # Hash della password
-    hashed_password = get_password_hash(user_create.password)
+    # Hash della password (nel pool dedicato)
+    try:
+        hashed_password = await get_password_hash_async(user_create.password)
+    except PasswordPoolFull:
+        return _busy_response()
 
-    # Salva l'utente
-    user = user_repo.create_user(user_create, hashed_password)
+    # Salva l'utente: l'unicità dello username è garantita dalla create (op_type=create)
+    try:
+        user = await async_user_repo.create_user(user_create, hashed_password)
+    except UserAlreadyExistsError:
+        return jsonify({"success": False, "message": "Username already exists"}), 400
 
     # Crea un token di accesso
     access_token_expires = timedelta(minutes=JWT_ACCESS_TOKEN_EXPIRES)
@@ -56,7 +89,7 @@ def register():
 
 @auth_bp.route("/login", methods=["POST"])
 @auth_bp.route("/api/login", methods=["POST"])
-def login():
+async def login():
     """Effettua il login di un utente."""
     data = request.json
     if not data:
@@ -65,33 +98,36 @@ def login():
     username = data.get("username")
     password = data.get("password")
 
-    print(f"Login attempt for user: {username}")
+    logger.info(f"Login attempt for user: {username}")
 
     if not username or not password:
         return jsonify({"success": False, "message": "Invalid username or password"}), 400
 
     # Verifica le credenziali
-    user = user_repo.get_by_username(username)
+    user = await async_user_repo.get_by_username(username)
 
     # Se l'utente non esiste
     if not user:
-        print(f"User not found: {username}")
+        logger.info(f"User not found: {username}")
         return jsonify({"success": False, "message": "Invalid username or password"}), 401
 
-    print(f"User found: {user.username}, checking password")
-
-    # Verifica la password
-    password_valid = False
+    # Verifica la password (nel pool dedicato: il thread della richiesta non esegue bcrypt/scrypt)
     try:
-        password_valid = verify_password(password, user.password)
-        if not password_valid:
-            print(f"Password mismatch for user: {username}")
-            return jsonify({"success": False, "message": "Invalid username or password"}), 401
+        password_valid = await verify_password_async(password, user.password)
+    except PasswordPoolFull:
+        return _busy_response()
     except Exception as e:
-        print(f"Errore nella verifica della password: {str(e)}")
+        logger.error(f"Errore nella verifica della password: {str(e)}")
         return jsonify({"success": False, "message": "Authentication error"}), 500
+    if not password_valid:
+        logger.info(f"Password mismatch for user: {username}")
+        return jsonify({"success": False, "message": "Invalid username or password"}), 401
 
-    print(f"Password valid for user: {username}, generating token")
+    # Hash legacy: rigenerato in bcrypt in background, la risposta non lo attende
+    if password_needs_rehash(user.password):
+        task = asyncio.create_task(_rehash_password(user.id, password))
+        _rehash_tasks.add(task)
+        task.add_done_callback(_rehash_tasks.discard)
 
     # Crea un token di accesso
     access_token_expires = timedelta(minutes=JWT_ACCESS_TOKEN_EXPIRES)
@@ -102,7 +138,7 @@ def login():
 
     # Imposta la sessione
     session["user_id"] = user.id
-    print(f"Session set for user_id: {user.id}")
+    logger.info(f"Login riuscito per l'utente {user.id}")
 
     # Rimuovi la password dal risultato
     user_data = user.dict(exclude={"password"})
@@ -1,8 +1,10 @@
+import asyncio
 from flask import Blueprint, jsonify, request, session
 import stripe
 import logging
 from ..config.settings import STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET
-from ..models.repositories import BookingRepository
+from ..models.repositories import get_repository, WRITE_ASYNC
+from ..models.async_repositories import AsyncBookingRepository
 from ..models.models import BookingCreate, Booking
 from ..utils.auth import login_required
 from ..middleware import log_request
@@ -25,7 +27,7 @@ async def get_user_bookings(current_user):
     """Recupera tutte le prenotazioni dell'utente corrente."""
     try:
         user_id = session.get("user_id")
-        booking_repo = BookingRepository()
+        booking_repo = get_repository(AsyncBookingRepository)
         bookings = await booking_repo.get_by_user_id(user_id)
         if isinstance(bookings, list):
             return jsonify([booking.dict() for booking in bookings])
@@ -37,32 +39,21 @@ async def get_user_bookings(current_user):
 @booking_bp.route("/<booking_id>", methods=["GET"])
 @login_required
 @log_request()
-def get_booking_by_id(booking_id, current_user):
+async def get_booking_by_id(booking_id, current_user):
     """Recupera una prenotazione specifica."""
     try:
         user_id = session.get("user_id")
-        booking_repo = BookingRepository()
+        booking_repo = get_repository(AsyncBookingRepository)
+        booking = await booking_repo.get_by_id(booking_id)
         
-        # Creiamo una funzione asincrona interna per gestire l'operazione async
-        async def fetch_booking():
-            try:
-                booking = await booking_repo.get_by_id(booking_id)
-                
-                if not booking:
-                    return jsonify({"message": "Prenotazione non trovata"}), 404
-                
-                # Verifica che l'utente sia il proprietario della prenotazione
-                if booking.userId != user_id:
-                    return jsonify({"message": "Non autorizzato"}), 403
-                
-                return jsonify(booking.dict())
-            except Exception as e:
-                logger.error(f"Errore nel recupero della prenotazione {booking_id}: {str(e)}")
-                return jsonify({"message": f"Errore nel recupero della prenotazione: {str(e)}"}), 500
+        if not booking:
+            return jsonify({"message": "Prenotazione non trovata"}), 404
         
-        # Eseguiamo la funzione asincrona e restituiamo il risultato
-        import asyncio
-        return asyncio.run(fetch_booking())
+        # Verifica che l'utente sia il proprietario della prenotazione
+        if booking.userId != user_id:
+            return jsonify({"message": "Non autorizzato"}), 403
+        
+        return jsonify(booking.dict())
     except Exception as e:
         logger.error(f"Errore nel recupero della prenotazione {booking_id}: {str(e)}")
         return jsonify({"message": f"Errore nel recupero della prenotazione: {str(e)}"}), 500
@@ -82,8 +73,9 @@ async def create_new_booking(current_user):
     
     try:
         booking_data = BookingCreate(**data)
-        booking_repo = BookingRepository()
-        booking = await booking_repo.create(booking_data)
+        booking_repo = get_repository(AsyncBookingRepository)
+        # Le GET per ID sono realtime: non serve attendere il refresh dell'indice
+        booking = await booking_repo.create(booking_data, consistency=WRITE_ASYNC)
         return jsonify(booking.dict()), 201
     except Exception as e:
         logger.error(f"Errore nella creazione della prenotazione: {str(e)}")
@@ -101,7 +93,7 @@ async def update_booking_status_route(booking_id, current_user):
     if not status or status not in ["pending", "confirmed", "cancelled"]:
         return jsonify({"message": "Stato non valido"}), 400
     
-    booking_repo = BookingRepository()
+    booking_repo = get_repository(AsyncBookingRepository)
     booking = await booking_repo.get_by_id(booking_id)
     
     if not booking:
@@ -129,7 +121,7 @@ async def create_payment_intent_handler(current_user):
     if not booking_id:
         return jsonify({"message": "ID prenotazione mancante"}), 400
     
-    booking_repo = BookingRepository()
+    booking_repo = get_repository(AsyncBookingRepository)
     booking = await booking_repo.get_by_id(booking_id)
     
     if not booking:
@@ -140,8 +132,10 @@ async def create_payment_intent_handler(current_user):
         return jsonify({"message": "Non autorizzato"}), 403
     
     try:
-        # Crea il payment intent con Stripe
-        payment_intent = stripe_client.PaymentIntent.create(
+        # Crea il payment intent con Stripe: chiamata HTTP bloccante, eseguita
+        # in un thread per non fermare l'event loop condiviso dalle route async
+        payment_intent = await asyncio.to_thread(
+            stripe_client.PaymentIntent.create,
             amount=int(booking.totalPrice * 100),  # Converti in centesimi
             currency="eur",
             metadata={
@@ -172,7 +166,7 @@ async def webhook_handler():
             
             # Aggiorna lo stato di pagamento della prenotazione
             if booking_id:
-                booking_repo = BookingRepository()
+                booking_repo = get_repository(AsyncBookingRepository)
                 await booking_repo.update_payment_status(booking_id, "paid")
                 await booking_repo.update_status(booking_id, "confirmed")
         
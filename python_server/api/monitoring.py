@@ -0,0 +1,57 @@
+import logging
+from flask import Blueprint, jsonify
+
+from ..config.opensearch_client import get_pool_stats, get_index_check_stats
+from ..models.repositories import TravelPackageRepository, get_repository
+from ..utils.travel_api_client import get_connection_stats, get_singleflight_stats, get_circuit_breaker_stats
+from ..utils.search_jobs import get_search_job_manager
+from ..utils.auth import get_token_cache_stats
+from ..utils.password_pool import get_password_pool
+
+monitoring_bp = Blueprint("monitoring", __name__)
+logger = logging.getLogger(__name__)
+
+
+@monitoring_bp.route("/opensearch-pool", methods=["GET"])
+def opensearch_pool_stats():
+    """Statistiche del pool di connessioni OpenSearch del processo."""
+    return jsonify(get_pool_stats())
+
+
+@monitoring_bp.route("/index-checks", methods=["GET"])
+def index_check_stats():
+    """Chiamate indices.exists eseguite all'avvio e durante le richieste (deve restare a zero)."""
+    return jsonify(get_index_check_stats())
+
+
+@monitoring_bp.route("/cache", methods=["GET"])
+def cache_stats():
+    """Hit, miss ed evizioni delle cache in memoria del processo."""
+    return jsonify({
+        "travel_packages": get_repository(TravelPackageRepository).cache_stats(),
+        "auth_tokens": get_token_cache_stats(),
+    })
+
+
+@monitoring_bp.route("/travel-api", methods=["GET"])
+def travel_api_stats():
+    """Riuso delle connessioni keep-alive e chiamate unite (single-flight) verso l'API di viaggio esterna."""
+    return jsonify({"connections": get_connection_stats(), "singleflight": get_singleflight_stats()})
+
+
+@monitoring_bp.route("/circuit-breakers", methods=["GET"])
+def circuit_breaker_stats():
+    """Stato dei circuit breaker per endpoint dell'API esterna e timeout adattivi correnti."""
+    return jsonify(get_circuit_breaker_stats())
+
+
+@monitoring_bp.route("/search-jobs", methods=["GET"])
+def search_job_stats():
+    """Job di ricerca in background e poll eseguiti verso l'API esterna."""
+    return jsonify(get_search_job_manager().stats())
+
+
+@monitoring_bp.route("/password-pool", methods=["GET"])
+def password_pool_stats():
+    """Operazioni di hashing in corso nel pool delle password e richieste rifiutate per saturazione."""
+    return jsonify(get_password_pool().stats())
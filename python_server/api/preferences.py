@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify, session
 
-from ..models.repositories import PreferenceRepository
+from ..models.repositories import get_repository
+from ..models.async_repositories import AsyncPreferenceRepository
 from ..models.models import PreferenceCreate
 from ..utils.travel_api_client import TravelApiClient
 
 pref_bp = Blueprint("preferences", __name__)
-pref_repo = PreferenceRepository()
+pref_repo = get_repository(AsyncPreferenceRepository)
 
 travel_api_client = TravelApiClient()
 
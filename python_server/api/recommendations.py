@@ -1,9 +1,13 @@
 import logging
 import os
 import json
-from flask import Blueprint, jsonify, request, g, session
-from ..utils.travel_api_client import TravelApiClient
-from ..models.repositories import TravelPackageRepository, PreferenceRepository
+import time
+from flask import Blueprint, Response, jsonify, request, g, session
+from ..utils.travel_api_client import AsyncTravelApiClient
+from ..utils.search_jobs import get_search_job_manager, JOB_COMPLETED, JOB_FAILED
+from ..config.settings import SEARCH_JOB_SSE_HEARTBEAT, SEARCH_JOB_SSE_REMOTE_POLL
+from ..models.repositories import get_repository
+from ..models.async_repositories import AsyncTravelPackageRepository, AsyncPreferenceRepository
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
@@ -11,15 +15,57 @@ logger = logging.getLogger(__name__)
 
 # Create blueprint
 reco_bp = Blueprint('recommendations', __name__)
-package_repo = TravelPackageRepository()
-pref_repo = PreferenceRepository()
+package_repo = get_repository(AsyncTravelPackageRepository)
+pref_repo = get_repository(AsyncPreferenceRepository)
+
+# Client asincrono: le route async attendono l'API esterna senza occupare un thread
+travel_api_client = AsyncTravelApiClient()
+search_jobs = get_search_job_manager()
+
+def _to_recommended_packages(packages):
+    """Converte i pacchetti dell'API esterna nel formato delle card del frontend."""
+    recommended_packages = []
+    for pkg in packages:
+        recommended_packages.append({
+            "id": pkg.get("id", ""),
+            "title": pkg.get("title", ""),
+            "description": pkg.get("description", ""),
+            "destination": pkg.get("destination", ""),
+            "imageUrl": pkg.get("imageUrl", ""),
+            "price": pkg.get("price", 0),
+            "rating": pkg.get("rating", ""),
+            "durationDays": pkg.get("durationDays", 0) or (int(pkg.get("duration", "0").split()[0]) if pkg.get("duration") else 0),
+            "durationNights": pkg.get("durationNights", 0) or (int(pkg.get("duration", "0").split()[0])-1 if pkg.get("duration") else 0),
+            "isRecommended": True
+        })
+    return recommended_packages
+
+
+def _job_response(job):
+    """Risposta di un job di ricerca letta dallo stato locale (nessuna chiamata all'API esterna)."""
+    if job.status == JOB_FAILED:
+        return jsonify({"job_id": job.job_id, "status": job.status, "success": False,
+                        "message": job.error or "Ricerca non riuscita", "packages": []}), 502
+    if job.status != JOB_COMPLETED:
+        return jsonify({
+            "job_id": job.job_id,
+            "status": job.upstream_status,
+            "message": "Elaborazione in corso",
+            "packages": []
+        }), 200
+    result = job.result
+    if isinstance(result, dict) and "packages" in result:
+        return jsonify(_to_recommended_packages(result["packages"])), 200
+    return jsonify({"success": False, "message": "Formato dati non valido dal server esterno"}), 500
 
-travel_api_client = TravelApiClient()
 
 @reco_bp.route('/', methods=['GET']) # Changed to GET
 async def get_recommendations():
     """
     Get travel recommendations based on user preferences
+
+    Senza job_id avvia una ricerca in background; con job_id restituisce lo
+    stato del job (o i pacchetti, se completato) senza interrogare l'API esterna.
     """
     logger.info("Ricevuta richiesta per raccomandazioni")
     user_id = session.get("user_id")
@@ -27,6 +73,13 @@ async def get_recommendations():
         return jsonify({"success": False, "message": "Non autenticato"}), 401
 
     try:
+        job_id = request.args.get("job_id")
+        if job_id:
+            job = await search_jobs.track(job_id, user_id)
+            if job is None or not job.allows(user_id):
+                return jsonify({"success": False, "message": "Job non trovato"}), 404
+            return _job_response(job)
+
         # Ottieni le preferenze dell'utente
         preferences = await pref_repo.get_by_user_id(user_id)
         if not preferences or len(preferences) == 0:
@@ -34,59 +87,106 @@ async def get_recommendations():
 
         # Usa la preferenza più recente
         latest_preference = preferences[-1]
-
-        # Ottieni raccomandazioni basate su questa preferenza  -  Modified to handle job_id and polling
-        job_id = request.args.get("job_id")
-        if job_id:
-            recommendations = travel_api_client.get_recommendations_from_api(latest_preference, job_id=job_id) # Pass job_id if available
-            if recommendations and "status" in recommendations and recommendations["status"] != "COMPLETED":
-                return jsonify({
-                    "job_id": recommendations.get("job_id"),
-                    "status": recommendations.get("status"),
-                    "message": recommendations.get("message", "Elaborazione in corso"),
-                    "packages": []
-                })
-            elif recommendations and "packages" in recommendations:
-                recommended_packages = []
-                for pkg in recommendations["packages"]:
-                    recommended_packages.append({
-                        "id": pkg.get("id", ""),
-                        "title": pkg.get("title", ""),
-                        "description": pkg.get("description", ""),
-                        "destination": pkg.get("destination", ""),
-                        "imageUrl": pkg.get("imageUrl", ""),
-                        "price": pkg.get("price", 0),
-                        "rating": pkg.get("rating", ""),
-                        "durationDays": pkg.get("durationDays", 0) or (int(pkg.get("duration", "0").split()[0]) if pkg.get("duration") else 0),
-                        "durationNights": pkg.get("durationNights", 0) or (int(pkg.get("duration", "0").split()[0])-1 if pkg.get("duration") else 0),
-                        "isRecommended": True
-                    })
-                return jsonify(recommended_packages), 200
-            else:
-                return jsonify({"success": False, "message": "Formato dati non valido dal server esterno"}), 500
-        else:
-            external_recommendations = travel_api_client.get_recommendations_from_api(latest_preference)
-            recommended_packages = []
-            if external_recommendations and "packages" in external_recommendations:
-                for pkg in external_recommendations["packages"]:
-                    recommended_packages.append({
-                        "id": pkg.get("id", ""),
-                        "title": pkg.get("title", ""),
-                        "description": pkg.get("description", ""),
-                        "destination": pkg.get("destination", ""),
-                        "imageUrl": pkg.get("imageUrl", ""),
-                        "price": pkg.get("price", 0),
-                        "rating": pkg.get("rating", ""),
-                        "durationDays": pkg.get("durationDays", 0) or (int(pkg.get("duration", "0").split()[0]) if pkg.get("duration") else 0),
-                        "durationNights": pkg.get("durationNights", 0) or (int(pkg.get("duration", "0").split()[0])-1 if pkg.get("duration") else 0),
-                        "isRecommended": True
-                    })
-
-            return jsonify(recommended_packages), 200
+        job = await search_jobs.start(user_id, latest_preference)
+        return _job_response(job)
     except Exception as e:
         logger.error(f"Errore nel recuperare le raccomandazioni: {str(e)}")
         return jsonify({"success": False, "message": f"Errore: {str(e)}"}), 500
 
+
+@reco_bp.route('/jobs', methods=['POST'])
+async def start_search_job():
+    """Avvia una ricerca in background con la preferenza più recente dell'utente."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"success": False, "message": "Non autenticato"}), 401
+    try:
+        preferences = await pref_repo.get_by_user_id(user_id)
+        if not preferences:
+            return jsonify({"success": False, "message": "Nessuna preferenza trovata"}), 404
+        job = await search_jobs.start(user_id, preferences[-1])
+        return jsonify({"job_id": job.job_id, "status": job.status}), 202
+    except Exception as e:
+        logger.error(f"Errore nell'avvio della ricerca: {str(e)}")
+        return jsonify({"success": False, "message": f"Errore: {str(e)}"}), 502
+
+
+@reco_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_search_job(job_id):
+    """Stato di un job di ricerca, letto dallo stato locale."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"success": False, "message": "Non autenticato"}), 401
+    job = search_jobs.get(job_id)
+    if job is None or not job.allows(user_id):
+        return jsonify({"success": False, "message": "Job non trovato"}), 404
+    data = job.to_dict()
+    data.pop("user_id")
+    data.pop("user_ids")
+    return jsonify(data)
+
+def _sse(event, data, event_id=None):
+    """Un evento Server-Sent Events."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _job_events(job_id, last_version):
+    """Stream degli stati di un job fino al completamento (o al fallimento)."""
+    # Suggerisce al browser un'attesa breve prima di riconnettersi
+    yield "retry: 2000\n\n"
+    job = search_jobs.get(job_id)
+    last_heartbeat = time.monotonic()
+    while job is not None:
+        # L'evento finale viene sempre inviato, anche a chi si riconnette dopo averlo perso
+        if job.status == JOB_COMPLETED:
+            result = job.result
+            packages = _to_recommended_packages(result["packages"]) if isinstance(result, dict) and "packages" in result else []
+            yield _sse("completed", {"job_id": job.job_id, "status": job.status, "packages": packages}, job.version)
+            return
+        if job.status == JOB_FAILED:
+            yield _sse("failed", {"job_id": job.job_id, "status": job.status, "message": job.error}, job.version)
+            return
+        if job.version > last_version:
+            last_version = job.version
+            yield _sse("status", {"job_id": job.job_id, "status": job.upstream_status, "polls": job.polls}, job.version)
+        elif time.monotonic() - last_heartbeat >= SEARCH_JOB_SSE_HEARTBEAT:
+            # Commento SSE: tiene aperta la connessione attraverso proxy e load balancer
+            yield ": keep-alive\n\n"
+            last_heartbeat = time.monotonic()
+        local = search_jobs.is_local(job_id)
+        job = search_jobs.wait_for_change(
+            job_id, last_version, SEARCH_JOB_SSE_HEARTBEAT if local else SEARCH_JOB_SSE_REMOTE_POLL
+        )
+
+
+@reco_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def search_job_events(job_id):
+    """
+    Stream SSE dei cambi di stato di un job di ricerca, chiuso dopo l'evento finale
+    (completed con i pacchetti, oppure failed). Sostituisce il polling con job_id.
+
+    È un generatore sincrono: con i worker sync occupa un thread per
+    connessione, con i worker gevent/eventlet l'attesa è cooperativa.
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"success": False, "message": "Non autenticato"}), 401
+    job = search_jobs.get(job_id)
+    if job is None or not job.allows(user_id):
+        return jsonify({"success": False, "message": "Job non trovato"}), 404
+
+    # Alla riconnessione il browser invia l'ultimo id ricevuto: si riparte da lì
+    last_version = request.headers.get("Last-Event-ID", type=int) or 0
+    return Response(_job_events(job_id, last_version), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # niente buffering su nginx
+    })
+
+
 import json
 from datetime import datetime
 
@@ -110,7 +210,7 @@ async def get_city_packages():
         latest_preference = preferences[-1]
 
         # Ottieni raccomandazioni basate su questa preferenza
-        external_recommendations = travel_api_client.get_recommendations_from_api(latest_preference)
+        external_recommendations = await travel_api_client.get_recommendations_from_api(latest_preference)
 
         # Se abbiamo ricevuto dati formattati con accomodation e esperienze, restituiscili
         if external_recommendations and "accomodation" in external_recommendations and "esperienze" in external_recommendations:
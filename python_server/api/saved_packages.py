@@ -1,13 +1,17 @@
-from flask import Blueprint, jsonify, request, session
-from ..models.repositories import SavedPackageRepository, TravelPackageRepository
-from ..models.models import SavedPackage
+from flask import Blueprint, Response, jsonify, request, session
+from ..models.repositories import SavedPackageRepository, TravelPackageRepository, get_repository, WRITE_ASYNC
+from ..models.models import SavedPackage, resolve_projection
 from ..utils.auth import login_required as verify_token
+from ..utils.search_jobs import get_search_job_manager, JOB_COMPLETED, JOB_FAILED
+from ..utils.travel_api_mocks import mock_payload_json
+from ..utils.travel_api_client import TravelApiClient
 from ..middleware import log_request
 import logging
 
 saved_packages_bp = Blueprint("saved_packages", __name__)
-saved_repo = SavedPackageRepository()
-travel_repo = TravelPackageRepository() 
+saved_repo = get_repository(SavedPackageRepository)
+travel_repo = get_repository(TravelPackageRepository) 
+search_jobs = get_search_job_manager()
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +26,8 @@ def get_saved_packages(current_user=None):
         if not user_id:
             return jsonify({"success": False, "message": "User not authenticated"}), 401
 
-        # Get saved packages
-        saved_packages = saved_repo.get_by_user_id(user_id)
+        # Get saved packages (?fields=card per i soli campi delle card)
+        saved_packages = saved_repo.get_by_user_id(user_id, source=resolve_projection(request.args.get("fields")))
 
         # Return packages
         return jsonify({"success": True, "data": saved_packages}), 200
@@ -53,11 +57,11 @@ def save_package(current_user=None):
         # Create saved package
         saved_package = SavedPackage(**package_data)
 
-        # Save package
-        result = saved_repo.create(saved_package)
+        # Save package (senza attendere il refresh: il modello arriva dalla risposta dell'indicizzazione)
+        result = saved_repo.create(saved_package, consistency=WRITE_ASYNC)
 
         # Return result
-        return jsonify({"success": True, "data": result}), 201
+        return jsonify({"success": True, "data": result.dict()}), 201
     except Exception as e:
         logger.error(f"Error saving package: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
@@ -73,8 +77,8 @@ def get_my_packages(current_user=None):
         if not user_id:
             return jsonify({"success": False, "message": "User not authenticated"}), 401
 
-        # Get saved packages
-        saved_packages = saved_repo.get_by_user_id(user_id)
+        # Get saved packages (?fields=card per i soli campi delle card)
+        saved_packages = saved_repo.get_by_user_id(user_id, source=resolve_projection(request.args.get("fields")))
 
         # Return packages
         return jsonify({"success": True, "data": saved_packages}), 200
@@ -85,8 +89,8 @@ def get_my_packages(current_user=None):
 @saved_packages_bp.route("/itinerary", methods=["GET"])
 @verify_token
 @log_request()
-def get_detailed_itinerary(current_user=None):
-    """Get packages from external API directly without detailed itinerary"""
+async def get_detailed_itinerary(current_user=None):
+    """Get packages from external API directly without detailed itinerary (?format=itinerary per l'itinerario in streaming)"""
     try:
         # Get user ID from session
         user_id = session.get("user_id")
@@ -98,28 +102,29 @@ def get_detailed_itinerary(current_user=None):
         if not job_id:
             return jsonify({"success": False, "message": "Job ID is required"}), 400
 
-        # Get package data directly from the recommendations endpoint
-        from ..utils.travel_api_client import get_recommendations_from_api
-        from ..models.repositories import PreferenceRepository
-
-        pref_repo = PreferenceRepository()
-        preferences = pref_repo.get_by_user_id(user_id)
-
-        if not preferences or len(preferences) == 0:
-            return jsonify({"success": False, "message": "Nessuna preferenza trovata"}), 404
-
-        # Usa la preferenza più recente
-        latest_preference = preferences[-1]
-
-        # Get packages directly (not as itinerary)
-        packages = get_recommendations_from_api(latest_preference, job_id=job_id, itinerary=False)
-
-        if not packages or "status" in packages and packages["status"] != "COMPLETED":
+        # Stato del job dal gestore dei job in background (nessun poll verso l'API esterna)
+        job = await search_jobs.track(job_id, user_id)
+        if job is None or not job.allows(user_id):
+            return jsonify({"success": False, "message": "Job not found"}), 404
+        if job.status == JOB_FAILED:
+            return jsonify({"job_id": job.job_id, "status": job.status, "success": False,
+                            "message": job.error or "Ricerca non riuscita"}), 502
+        if job.status != JOB_COMPLETED:
             return jsonify({
-                "job_id": packages.get("job_id"),
-                "status": packages.get("status", "PROCESSING"),
-                "message": packages.get("message", "Elaborazione in corso"),
+                "job_id": job.job_id,
+                "status": job.upstream_status,
+                "message": "Elaborazione in corso",
             }), 200
+        packages = job.result
+
+        # ?format=itinerary: itinerario generato e inviato a pezzi, senza costruirlo in memoria
+        if request.args.get("format") == "itinerary" and isinstance(packages, dict):
+            return Response(TravelApiClient.iter_itinerary_json(packages), status=200, mimetype="application/json")
+
+        # Payload di fallback: già serializzato, nessun passaggio da jsonify
+        fallback = mock_payload_json(packages)
+        if fallback is not None:
+            return Response(b'{"success":true,"data":' + fallback + b'}', status=200, mimetype="application/json")
 
         # Return packages directly
         return jsonify({
@@ -1,76 +1,43 @@
-from flask import Blueprint, request, jsonify, session
-
-from ..models.repositories import TravelPackageRepository
-from ..models.models import TravelPackageCreate
-
-travel_bp = Blueprint("travel", __name__)
-travel_repo = TravelPackageRepository()
-
-@travel_bp.route("", methods=["GET"])
-async def get_all_packages():
-    """Ottiene tutti i pacchetti di viaggio."""
-    packages = await travel_repo.get_all()
-    return jsonify(packages)
-
-@travel_bp.route("/<id>", methods=["GET"])
-async def get_package(id):
-    """Ottiene un pacchetto di viaggio per ID."""
-    package = await travel_repo.get_by_id(id)
-    if not package:
-        return jsonify({"success": False, "message": "Pacchetto di viaggio non trovato"}), 404
-    
-    return jsonify(package)
-
-@travel_bp.route("/category/<category>", methods=["GET"])
-async def get_packages_by_category(category):
-    """Ottiene i pacchetti di viaggio per categoria."""
-    packages = await travel_repo.get_by_category(category)
-    return jsonify(packages)
-
-@travel_bp.route("", methods=["POST"])
-async def create_package():
-    """Crea un nuovo pacchetto di viaggio."""
-    # Verifica la sessione
-    user_id = session.get("user_id")
-    if not user_id:
-        return jsonify({"success": False, "message": "Non autenticato"}), 401
-    
-    try:
-        data = request.json
-        package_create = TravelPackageCreate(**data)
-        package = await travel_repo.create(package_create)
-        return jsonify(package), 201
-    except Exception as e:
-        return jsonify({"success": False, "message": str(e)}), 400
 import logging
 from flask import Blueprint, jsonify, request
-from ..models.repositories import TravelPackageRepository
+from ..models.repositories import TravelPackageRepository, get_repository
+from ..models.models import resolve_projection
+from ..config.settings import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
 from ..middleware import log_request
 
 travel_bp = Blueprint("travel_packages", __name__)
 logger = logging.getLogger(__name__)
 
+
+def _page_args():
+    """Legge limit, cursor, track_total_hits e fields (proiezione) dalla query string."""
+    limit = request.args.get("limit", type=int) or PAGE_SIZE_DEFAULT
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    cursor = request.args.get("cursor") or None
+    track_total_hits = request.args.get("track_total_hits", "false").lower() in ("true", "1")
+    source = resolve_projection(request.args.get("fields"))
+    return {"size": limit, "cursor": cursor, "track_total_hits": track_total_hits, "source": source}
+
+
+def _page_response(page):
+    """Restituisce gli elementi della pagina; cursore e totale viaggiano negli header."""
+    response = jsonify(page.items)
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+    return response
+
 @travel_bp.route("/", methods=["GET"])
 @log_request()
 def get_all_packages():
-    """Recupera tutti i pacchetti di viaggio."""
+    """Recupera i pacchetti di viaggio, una pagina alla volta (?limit=&cursor=&fields=)."""
     try:
-        travel_repo = TravelPackageRepository()
-        
-        # Utilizziamo una query diretta al posto del metodo asincrono
-        response = travel_repo.client.search(
-            index=travel_repo.index_name,
-            body={"query": {"match_all": {}}},
-            size=100
-        )
-        
-        results = []
-        for hit in response["hits"]["hits"]:
-            data = hit["_source"]
-            data["id"] = hit["_id"]
-            results.append(data)
-            
-        return jsonify(results)
+        travel_repo = get_repository(TravelPackageRepository)
+        page = travel_repo.search_page(raw=True, **_page_args())
+        return _page_response(page)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         logger.error(f"Errore nel recupero dei pacchetti di viaggio: {str(e)}")
         return jsonify({"message": str(e)}), 500
@@ -78,10 +45,9 @@ def get_all_packages():
 @travel_bp.route("/category/<category>", methods=["GET"])
 @log_request()
 def get_packages_by_category(category):
-    """Recupera i pacchetti di viaggio per categoria."""
+    """Recupera i pacchetti di viaggio per categoria, una pagina alla volta."""
     try:
-        travel_repo = TravelPackageRepository()
-        # Utilizziamo una query diretta al posto del metodo asincrono
+        travel_repo = get_repository(TravelPackageRepository)
         query = {
             "query": {
                 "match": {
@@ -89,20 +55,10 @@ def get_packages_by_category(category):
                 }
             }
         }
-        
-        response = travel_repo.client.search(
-            index=travel_repo.index_name,
-            body=query,
-            size=100
-        )
-        
-        results = []
-        for hit in response["hits"]["hits"]:
-            data = hit["_source"]
-            data["id"] = hit["_id"]
-            results.append(data)
-        
-        return jsonify(results)
+        page = travel_repo.search_page(query, raw=True, **_page_args())
+        return _page_response(page)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         logger.error(f"Errore nel recupero dei pacchetti per categoria {category}: {str(e)}")
         return jsonify({"message": str(e)}), 500
@@ -110,28 +66,14 @@ def get_packages_by_category(category):
 @travel_bp.route("/<package_id>", methods=["GET"])
 @log_request()
 def get_package_by_id(package_id):
-    """Recupera un pacchetto di viaggio per ID."""
+    """Recupera un pacchetto di viaggio per ID (servito dalla cache del repository)."""
     try:
-        travel_repo = TravelPackageRepository()
-        
-        # Utilizziamo il metodo get diretto di OpenSearch
-        try:
-            response = travel_repo.client.get(
-                index=travel_repo.index_name,
-                id=package_id
-            )
-            
-            if response["found"]:
-                data = response["_source"]
-                data["id"] = response["_id"]
-                return jsonify(data)
-            else:
-                return jsonify({"message": "Pacchetto non trovato"}), 404
-                
-        except Exception as e:
-            logger.error(f"Errore nel recupero del pacchetto {package_id}: {str(e)}")
+        travel_repo = get_repository(TravelPackageRepository)
+        package = travel_repo.get_by_id(package_id)
+        if package is None:
             return jsonify({"message": "Pacchetto non trovato"}), 404
-            
+        return jsonify(package)
+
     except Exception as e:
         logger.error(f"Errore nel recupero del pacchetto {package_id}: {str(e)}")
         return jsonify({"message": str(e)}), 500
@@ -226,20 +168,11 @@ def search_packages():
         if not must_clauses and not should_clauses and not filter_clauses:
             es_query["query"] = {"match_all": {}}
         
-        travel_repo = TravelPackageRepository()
-        response = travel_repo.client.search(
-            index=travel_repo.index_name,
-            body=es_query,
-            size=100
-        )
-        
-        results = []
-        for hit in response["hits"]["hits"]:
-            data = hit["_source"]
-            data["id"] = hit["_id"]
-            results.append(data)
-            
-        return jsonify(results)
+        travel_repo = get_repository(TravelPackageRepository)
+        page = travel_repo.search_page(es_query, raw=True, **_page_args())
+        return _page_response(page)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         logger.error(f"Errore nella ricerca dei pacchetti: {str(e)}")
         return jsonify({"message": str(e)}), 500
@@ -1,28 +1,76 @@
 import os
 import logging
-from flask import Flask, jsonify, request, render_template, send_from_directory
+from functools import wraps
+from flask import Flask, Response, jsonify, request, render_template, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from pydantic import BaseModel
 from .config.settings import SECRET_KEY, CORS_ORIGINS, PORT, DEBUG
+from .config.opensearch_client import init_indices
 from .api.auth import auth_bp
 from .api.travel_packages import travel_bp as travel_package_bp
 from .api.preferences import pref_bp
 from .api.recommendations import reco_bp
 from .api.bookings import booking_bp
 from .api.saved_packages import saved_packages_bp # Import the new blueprint
-from .middleware import log_request
+from .api.monitoring import monitoring_bp
+from .middleware import log_request, init_request_timing
+from .utils.async_loop import run_sync
+from .utils.timing import span, SPAN_JSON
+from .utils.metrics import init_metrics, render_metrics
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class YookveJSONProvider(DefaultJSONProvider):
+    """JSON di Flask che serializza anche i modelli pydantic.
+
+    I modelli costruiti da una proiezione (_partial) contengono solo i campi
+    letti da OpenSearch: gli altri non vengono riempiti con i default.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, BaseModel):
+            return o.model_dump(mode="json", exclude_unset=getattr(o, "_partial", False))
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args, **kwargs):
+        with span(SPAN_JSON):
+            return super().response(*args, **kwargs)
+
+
+class YookveFlask(Flask):
+    """Flask con le view async eseguite sull'event loop condiviso."""
+
+    json_provider_class = YookveJSONProvider
+
+    def async_to_sync(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return run_sync(func(*args, **kwargs))
+        return wrapper
+
+
 def init_app():
     """Inizializza l'applicazione Flask."""
-    app = Flask(__name__, static_folder=None)
+    app = YookveFlask(__name__, static_folder=None)
     app.config['SECRET_KEY'] = SECRET_KEY
 
+    # Verifica indici e mapping una sola volta, fuori dal percorso delle richieste
+    init_indices()
+
     # Configura CORS
-    CORS(app, resources={r"/api/*": {"origins": CORS_ORIGINS}})
+    CORS(app, resources={r"/api/*": {"origins": CORS_ORIGINS}},
+         expose_headers=["X-Next-Cursor", "X-Total-Count", "Server-Timing"])
+
+    # Span per richiesta: header Server-Timing e log strutturato per tutte le route
+    init_request_timing(app)
+
+    # Conteggi e latenze per route, richieste in corso (esposti su /metrics)
+    init_metrics(app)
 
     # Registra i blueprint
     app.register_blueprint(auth_bp, url_prefix='/api')
@@ -33,12 +81,22 @@ def init_app():
     app.register_blueprint(reco_bp, url_prefix='/api/recommendations')
     app.register_blueprint(booking_bp, url_prefix='/api/bookings')
     app.register_blueprint(saved_packages_bp, url_prefix='/api/saved-packages') # Register the new blueprint
+    app.register_blueprint(monitoring_bp, url_prefix='/api/monitoring')
 
     # Versione della API
     @app.route('/api/version')
     def version():
         return jsonify({"version": "1.0.0"})
 
+    # Metriche Prometheus (aggregate tra i worker con PROMETHEUS_MULTIPROC_DIR)
+    @app.route('/metrics')
+    def metrics():
+        rendered = render_metrics()
+        if rendered is None:
+            return jsonify({"error": "Metriche non disponibili"}), 503
+        body, content_type = rendered
+        return Response(body, content_type=content_type)
+
     # Percorso della cartella dist, una directory sopra la directory python_server
     dist_dir = os.path.join(
         os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dist',
@@ -73,9 +131,9 @@ def init_app():
         return create_payment_intent_handler()
 
     @app.route("/api/webhook", methods=["POST"])
-    def stripe_webhook():
+    async def stripe_webhook():
         from .api.bookings import webhook_handler
-        return webhook_handler()
+        return await webhook_handler()
 
     # Gestore degli errori
     @app.errorhandler(404)
@@ -1,4 +1,8 @@
-from opensearchpy import OpenSearch
+import socket
+import threading
+import time
+from opensearchpy import OpenSearch, AsyncOpenSearch, Urllib3HttpConnection, AIOHttpConnection
+from urllib3.connection import HTTPConnection
 from .settings import (
     OPENSEARCH_HOST, 
     OPENSEARCH_PORT, 
@@ -6,6 +10,16 @@ from .settings import (
     OPENSEARCH_PASSWORD,
     OPENSEARCH_USE_SSL,
     OPENSEARCH_VERIFY_CERTS,
+    OPENSEARCH_POOL_MAXSIZE,
+    OPENSEARCH_POOL_BLOCK,
+    OPENSEARCH_TCP_KEEPALIVE,
+    OPENSEARCH_TCP_KEEPALIVE_IDLE,
+    OPENSEARCH_TIMEOUT,
+    OPENSEARCH_MAX_RETRIES,
+    OPENSEARCH_RETRY_ON_TIMEOUT,
+    OPENSEARCH_SNIFF_ON_START,
+    OPENSEARCH_SNIFF_ON_CONNECTION_FAIL,
+    OPENSEARCH_SNIFFER_TIMEOUT,
     MAPPINGS,
     INDEX_USERS,
     INDEX_PREFERENCES,
@@ -14,41 +28,261 @@ from .settings import (
     INDEX_SAVED_PACKAGES # Import the new index name
 )
 import logging
+from ..utils.timing import record, SPAN_OPENSEARCH
+from ..utils.metrics import observe_opensearch
 
 logger = logging.getLogger(__name__)
 
-def get_opensearch_client():
-    """Crea e restituisce un client OpenSearch."""
+# Client condiviso dal processo, creato alla prima richiesta
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def _keepalive_socket_options():
+    """Opzioni socket per il TCP keep-alive delle connessioni del pool."""
+    options = list(HTTPConnection.default_socket_options)
+    if not OPENSEARCH_TCP_KEEPALIVE:
+        return options
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # TCP_KEEPIDLE/TCP_KEEPINTVL non sono disponibili su tutte le piattaforme
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, OPENSEARCH_TCP_KEEPALIVE_IDLE))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, OPENSEARCH_TCP_KEEPALIVE_IDLE // 4)))
+    return options
+
+
+class PooledHttpConnection(Urllib3HttpConnection):
+    """Connessione urllib3 con pool bloccante, TCP keep-alive e statistiche di utilizzo."""
+
+    def __init__(self, *args, pool_block=False, **kwargs):
+        self._pool_block = pool_block
+        self._stats_lock = threading.Lock()
+        self.pool_waits = 0
+        super().__init__(*args, **kwargs)
+
+    def _create_urllib3_pool(self):
+        super()._create_urllib3_pool()
+        # Con block=True le richieste attendono una connessione libera invece di
+        # aprirne una nuova (e scartarla) quando il pool è pieno
+        self.pool.block = self._pool_block
+        self.pool.conn_kw["socket_options"] = _keepalive_socket_options()
+
+    def perform_request(self, method, url, *args, **kwargs):
+        pool = self.pool
+        # Nessuna connessione libera: la richiesta attende (o apre una connessione extra)
+        if pool is not None and pool.pool is not None and pool.pool.empty():
+            with self._stats_lock:
+                self.pool_waits += 1
+        started = time.perf_counter()
+        try:
+            return super().perform_request(method, url, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            record(SPAN_OPENSEARCH, elapsed)
+            observe_opensearch(method, url, elapsed)
+
+    def pool_stats(self):
+        """Statistiche del pool urllib3 associato a questa connessione."""
+        pool = self.pool
+        if pool is None or pool.pool is None:
+            return {"host": self.host, "open_connections": 0, "idle_connections": 0,
+                    "in_use_connections": 0, "maxsize": 0, "created_connections": 0,
+                    "requests": 0, "waits": self.pool_waits, "reuse_ratio": 0.0}
+        queue = list(pool.pool.queue)
+        idle = sum(1 for conn in queue if conn is not None)
+        in_use = max(0, pool.pool.maxsize - len(queue))
+        requests = pool.num_requests
+        created = pool.num_connections
+        reuse_ratio = (1 - created / requests) if requests else 0.0
+        return {
+            "host": self.host,
+            "open_connections": idle + in_use,
+            "idle_connections": idle,
+            "in_use_connections": in_use,
+            "maxsize": pool.pool.maxsize,
+            "created_connections": created,
+            "requests": requests,
+            "waits": self.pool_waits,
+            "reuse_ratio": round(max(0.0, reuse_ratio), 4),
+        }
+
+
+class TimedAIOHttpConnection(AIOHttpConnection):
+    """Connessione del client asincrono che registra la durata delle chiamate (span opensearch e metriche)."""
+
+    async def perform_request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().perform_request(method, url, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            record(SPAN_OPENSEARCH, elapsed)
+            observe_opensearch(method, url, elapsed)
+
+
+def _build_client():
+    """Crea il client OpenSearch con la configurazione del pool."""
     auth = None
     if OPENSEARCH_USER and OPENSEARCH_PASSWORD:
         auth = (OPENSEARCH_USER, OPENSEARCH_PASSWORD)
-        
-    client = OpenSearch(
+
+    return OpenSearch(
         hosts=[{"host": OPENSEARCH_HOST, "port": OPENSEARCH_PORT}],
         http_auth=auth,
         use_ssl=OPENSEARCH_USE_SSL,
         verify_certs=OPENSEARCH_VERIFY_CERTS,
-        ssl_show_warn=False
+        ssl_show_warn=False,
+        connection_class=PooledHttpConnection,
+        pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+        pool_block=OPENSEARCH_POOL_BLOCK,
+        timeout=OPENSEARCH_TIMEOUT,
+        max_retries=OPENSEARCH_MAX_RETRIES,
+        retry_on_timeout=OPENSEARCH_RETRY_ON_TIMEOUT,
+        sniff_on_start=OPENSEARCH_SNIFF_ON_START,
+        sniff_on_connection_fail=OPENSEARCH_SNIFF_ON_CONNECTION_FAIL,
+        sniffer_timeout=OPENSEARCH_SNIFFER_TIMEOUT,
     )
-    return client
+
+
+def get_opensearch_client():
+    """Restituisce il client OpenSearch condiviso dal processo (thread-safe)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+                logger.info(f"Client OpenSearch creato (pool maxsize={OPENSEARCH_POOL_MAXSIZE}, block={OPENSEARCH_POOL_BLOCK})")
+    return _client
+
+
+def get_async_opensearch_client():
+    """Restituisce il client AsyncOpenSearch condiviso dal processo.
+
+    Il client va usato solo dall'event loop condiviso (utils.async_loop):
+    la sessione aiohttp e il suo pool di connessioni sono legati a quel loop.
+    """
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                auth = None
+                if OPENSEARCH_USER and OPENSEARCH_PASSWORD:
+                    auth = (OPENSEARCH_USER, OPENSEARCH_PASSWORD)
+                _async_client = AsyncOpenSearch(
+                    hosts=[{"host": OPENSEARCH_HOST, "port": OPENSEARCH_PORT}],
+                    http_auth=auth,
+                    use_ssl=OPENSEARCH_USE_SSL,
+                    verify_certs=OPENSEARCH_VERIFY_CERTS,
+                    ssl_show_warn=False,
+                    connection_class=TimedAIOHttpConnection,
+                    pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+                    timeout=OPENSEARCH_TIMEOUT,
+                    max_retries=OPENSEARCH_MAX_RETRIES,
+                    retry_on_timeout=OPENSEARCH_RETRY_ON_TIMEOUT,
+                    sniff_on_start=OPENSEARCH_SNIFF_ON_START,
+                    sniff_on_connection_fail=OPENSEARCH_SNIFF_ON_CONNECTION_FAIL,
+                    sniffer_timeout=OPENSEARCH_SNIFFER_TIMEOUT,
+                )
+                logger.info(f"Client AsyncOpenSearch creato (pool maxsize={OPENSEARCH_POOL_MAXSIZE})")
+    return _async_client
+
+
+def get_pool_stats():
+    """Restituisce le statistiche aggregate del pool di connessioni OpenSearch."""
+    if _client is None:
+        return {"initialized": False, "connections": [], "open_connections": 0,
+                "waits": 0, "requests": 0, "reuse_ratio": 0.0}
+
+    connections = [
+        conn.pool_stats()
+        for conn in _client.transport.connection_pool.connections
+        if isinstance(conn, PooledHttpConnection)
+    ]
+    requests = sum(c["requests"] for c in connections)
+    created = sum(c["created_connections"] for c in connections)
+    return {
+        "initialized": True,
+        "connections": connections,
+        "open_connections": sum(c["open_connections"] for c in connections),
+        "waits": sum(c["waits"] for c in connections),
+        "requests": requests,
+        "reuse_ratio": round(max(0.0, 1 - created / requests), 4) if requests else 0.0,
+    }
+
+# Contatori delle chiamate indices.exists: dopo l'avvio devono restare a zero
+_index_exists_calls = {"startup": 0, "runtime": 0}
+_index_checks_lock = threading.Lock()
+_indices_initialized = False
+
+
+def _index_exists(client, index_name):
+    """Esegue indices.exists tenendo traccia della fase in cui viene chiamato."""
+    with _index_checks_lock:
+        _index_exists_calls["runtime" if _indices_initialized else "startup"] += 1
+    return client.indices.exists(index=index_name)
+
+
+def get_index_check_stats():
+    """Restituisce il numero di chiamate indices.exists all'avvio e a regime."""
+    with _index_checks_lock:
+        return {
+            "initialized": _indices_initialized,
+            "startup_exists_calls": _index_exists_calls["startup"],
+            "runtime_exists_calls": _index_exists_calls["runtime"],
+        }
+
+
+def _check_mapping(client, index_name, mapping):
+    """Confronta il mapping dell'indice con MAPPINGS e aggiunge i campi mancanti."""
+    expected = mapping.get("mappings", {}).get("properties", {})
+    response = client.indices.get_mapping(index=index_name)
+    current = response.get(index_name, {}).get("mappings", {}).get("properties", {})
+
+    missing = {}
+    for field, field_mapping in expected.items():
+        if field not in current:
+            missing[field] = field_mapping
+        elif current[field].get("type") != field_mapping.get("type"):
+            # I tipi non si possono cambiare senza reindicizzare: lo segnaliamo soltanto
+            logger.warning(f"Mapping del campo '{field}' nell'indice '{index_name}' diverso da quello atteso: "
+                           f"{current[field].get('type')} invece di {field_mapping.get('type')}")
+
+    if missing:
+        client.indices.put_mapping(index=index_name, body={"properties": missing})
+        logger.info(f"Aggiunti {len(missing)} campi al mapping dell'indice '{index_name}': {sorted(missing)}")
+
 
 def init_indices():
-    """Inizializza gli indici di OpenSearch se non esistono già."""
+    """Inizializza gli indici di OpenSearch se non esistono già.
+
+    Va chiamata una sola volta all'avvio (da init_app): i repository non
+    verificano più l'esistenza degli indici durante le richieste.
+    """
+    global _indices_initialized
+    if _indices_initialized:
+        return
+
     client = get_opensearch_client()
     
     # Now includes INDEX_SAVED_PACKAGES from MAPPINGS
     for index_name, mapping in MAPPINGS.items():
         try:
             # Verifica se l'indice esiste
-            if not client.indices.exists(index=index_name):
+            if not _index_exists(client, index_name):
                 # Crea l'indice con il mapping specificato
                 client.indices.create(index=index_name, body=mapping)
                 logger.info(f"Indice '{index_name}' creato con successo")
             else:
                 logger.info(f"Indice '{index_name}' esiste già")
+                _check_mapping(client, index_name, mapping)
         except Exception as e:
             logger.error(f"Errore nella creazione dell'indice '{index_name}': {str(e)}")
 
+    with _index_checks_lock:
+        _indices_initialized = True
+
 def seed_travel_packages():
     """Seed dei pacchetti di viaggio demo se non ci sono dati."""
     client = get_opensearch_client()
@@ -7,6 +7,12 @@ load_dotenv()
 # Configurazioni del server
 PORT = int(os.getenv("PORT", 5000))
 DEBUG = os.getenv("DEBUG", "True").lower() in ("true", "1", "t")
+# Span per richiesta (OpenSearch, API esterna, pydantic, password, JSON): header Server-Timing e log
+REQUEST_TIMING_ENABLED = os.getenv("REQUEST_TIMING_ENABLED", "true").lower() == "true"
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "true").lower() == "true"  # una riga di log strutturata per richiesta
+# Metriche Prometheus su /metrics (richiede prometheus-client; con più worker
+# gunicorn impostare PROMETHEUS_MULTIPROC_DIR, vedi utils.metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
 
 # Configurazioni di sicurezza
 SECRET_KEY = os.getenv("SECRET_KEY", "chiave_segreta_di_default")
@@ -20,10 +26,61 @@ OPENSEARCH_PASSWORD = os.getenv("OPENSEARCH_PASSWORD", "admin")
 OPENSEARCH_USE_SSL = os.getenv("OPENSEARCH_USE_SSL", "false").lower() == "true"
 OPENSEARCH_VERIFY_CERTS = os.getenv("OPENSEARCH_VERIFY_CERTS", "false").lower() == "true"
 
+# Pool di connessioni OpenSearch (un solo client condiviso per processo)
+OPENSEARCH_POOL_MAXSIZE = int(os.getenv("OPENSEARCH_POOL_MAXSIZE", "25"))
+OPENSEARCH_POOL_BLOCK = os.getenv("OPENSEARCH_POOL_BLOCK", "true").lower() == "true"
+OPENSEARCH_TCP_KEEPALIVE = os.getenv("OPENSEARCH_TCP_KEEPALIVE", "true").lower() == "true"
+OPENSEARCH_TCP_KEEPALIVE_IDLE = int(os.getenv("OPENSEARCH_TCP_KEEPALIVE_IDLE", "60"))  # secondi
+OPENSEARCH_TIMEOUT = float(os.getenv("OPENSEARCH_TIMEOUT", "10"))  # secondi
+OPENSEARCH_MAX_RETRIES = int(os.getenv("OPENSEARCH_MAX_RETRIES", "3"))
+OPENSEARCH_RETRY_ON_TIMEOUT = os.getenv("OPENSEARCH_RETRY_ON_TIMEOUT", "true").lower() == "true"
+OPENSEARCH_SNIFF_ON_START = os.getenv("OPENSEARCH_SNIFF_ON_START", "false").lower() == "true"
+OPENSEARCH_SNIFF_ON_CONNECTION_FAIL = os.getenv("OPENSEARCH_SNIFF_ON_CONNECTION_FAIL", "false").lower() == "true"
+OPENSEARCH_SNIFFER_TIMEOUT = float(os.getenv("OPENSEARCH_SNIFFER_TIMEOUT", "0")) or None  # secondi, 0 = disabilitato
+
+# Scritture bulk (BaseRepository.bulk_*)
+BULK_CHUNK_DOCS = int(os.getenv("BULK_CHUNK_DOCS", "500"))
+BULK_CHUNK_BYTES = int(os.getenv("BULK_CHUNK_BYTES", str(5 * 1024 * 1024)))
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "2"))  # richieste bulk parallele
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "3"))  # tentativi extra per gli elementi rifiutati con 429/503
+BULK_BACKOFF_INITIAL = float(os.getenv("BULK_BACKOFF_INITIAL", "0.5"))  # secondi
+BULK_BACKOFF_MAX = float(os.getenv("BULK_BACKOFF_MAX", "30"))  # secondi
+
+# Letture in streaming (BaseRepository.iter_*): point-in-time + search_after
+SCAN_PAGE_SIZE = int(os.getenv("SCAN_PAGE_SIZE", "500"))
+SCAN_KEEP_ALIVE = os.getenv("SCAN_KEEP_ALIVE", "2m")
+
+# Paginazione a cursore degli endpoint di elenco
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+# Cache condivisa: "memory" (per processo) oppure "redis" (condivisa tra i worker)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "yookve")
+CACHE_MEMORY_MAXSIZE = int(os.getenv("CACHE_MEMORY_MAXSIZE", "10000"))  # voci del backend in memoria
+CACHE_VERSION_TTL = float(os.getenv("CACHE_VERSION_TTL", "1"))  # secondi tra due letture della versione di un namespace
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "10"))  # secondi, durata massima del lock di caricamento
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "5"))  # secondi di attesa del valore caricato da un altro worker
+
+# Cache delle letture dei pacchetti di viaggio
+TRAVEL_PACKAGE_CACHE_TTL = float(os.getenv("TRAVEL_PACKAGE_CACHE_TTL", "300"))  # secondi
+
 
 # Configurazione JWT
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "yookve_development_secret_key")
 JWT_ACCESS_TOKEN_EXPIRES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES", "60"))  # minuti
+# Token già verificati tenuti in memoria fino al loro exp (utils.auth.login_required)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+AUTH_TOKEN_CACHE_DEFAULT_TTL = float(os.getenv("AUTH_TOKEN_CACHE_DEFAULT_TTL", "300"))  # secondi, per token senza exp
+# Accetta i token con firma non valida usando il payload non verificato: solo
+# sviluppo, va abilitato esplicitamente ed è ignorato se DEBUG è disattivato
+AUTH_ALLOW_UNVERIFIED_TOKENS = DEBUG and os.getenv("AUTH_ALLOW_UNVERIFIED_TOKENS", "false").lower() == "true"
+
+# Hashing e verifica delle password in un pool dedicato (utils.password_pool)
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))  # calcoli in parallelo
+PASSWORD_POOL_QUEUE = int(os.getenv("PASSWORD_POOL_QUEUE", "32"))  # operazioni in attesa oltre le quali si risponde 503
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))  # costo bcrypt per hash nuovi e rehash
 
 # Configurazione Stripe
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
@@ -33,6 +90,61 @@ STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 TRAVEL_API_URL = os.getenv("TRAVEL_API_URL")
 TRAVEL_API_USERNAME = os.getenv("TRAVEL_API_USERNAME")
 TRAVEL_API_PASSWORD = os.getenv("TRAVEL_API_PASSWORD")
+TRAVEL_API_TOKEN_REFRESH_MARGIN = float(os.getenv("TRAVEL_API_TOKEN_REFRESH_MARGIN", "60"))  # secondi di anticipo sul rinnovo
+TRAVEL_API_TOKEN_DEFAULT_TTL = float(os.getenv("TRAVEL_API_TOKEN_DEFAULT_TTL", "300"))  # secondi, per token senza exp
+
+# Connessioni verso l'API esterna (requests.Session condivisa)
+TRAVEL_API_POOL_CONNECTIONS = int(os.getenv("TRAVEL_API_POOL_CONNECTIONS", "4"))  # host distinti tenuti in pool
+TRAVEL_API_POOL_MAXSIZE = int(os.getenv("TRAVEL_API_POOL_MAXSIZE", "20"))  # connessioni keep-alive per host
+TRAVEL_API_CONNECT_TIMEOUT = float(os.getenv("TRAVEL_API_CONNECT_TIMEOUT", "3.05"))  # secondi
+# Timeout di lettura per endpoint (secondi)
+TRAVEL_API_READ_TIMEOUTS = {
+    "token": float(os.getenv("TRAVEL_API_TOKEN_TIMEOUT", "5")),
+    "search": float(os.getenv("TRAVEL_API_SEARCH_TIMEOUT", "15")),
+    "status": float(os.getenv("TRAVEL_API_STATUS_TIMEOUT", "5")),
+    "result": float(os.getenv("TRAVEL_API_RESULT_TIMEOUT", "10")),
+    "itinerary": float(os.getenv("TRAVEL_API_ITINERARY_TIMEOUT", "10")),
+}
+TRAVEL_API_GET_RETRIES = int(os.getenv("TRAVEL_API_GET_RETRIES", "2"))  # nuovi tentativi delle GET
+TRAVEL_API_RETRY_BACKOFF = float(os.getenv("TRAVEL_API_RETRY_BACKOFF", "0.3"))  # secondi, fattore di backoff
+ITINERARY_STREAM_BATCH = int(os.getenv("ITINERARY_STREAM_BATCH", "256"))  # elementi per pezzo dell'itinerario in streaming
+
+# Circuit breaker per endpoint dell'API esterna (utils.circuit_breaker)
+TRAVEL_API_BREAKER_WINDOW = float(os.getenv("TRAVEL_API_BREAKER_WINDOW", "60"))  # secondi di finestra mobile
+TRAVEL_API_BREAKER_MIN_CALLS = int(os.getenv("TRAVEL_API_BREAKER_MIN_CALLS", "10"))  # chiamate minime prima di valutare
+TRAVEL_API_BREAKER_ERROR_RATE = float(os.getenv("TRAVEL_API_BREAKER_ERROR_RATE", "0.5"))  # quota di errori che apre il circuito
+TRAVEL_API_BREAKER_SLOW_CALL_RATIO = float(os.getenv("TRAVEL_API_BREAKER_SLOW_CALL_RATIO", "0.8"))  # chiamata lenta oltre questa quota del timeout dell'endpoint
+TRAVEL_API_BREAKER_SLOW_RATE = float(os.getenv("TRAVEL_API_BREAKER_SLOW_RATE", "0.5"))  # quota di chiamate lente che apre il circuito
+TRAVEL_API_BREAKER_OPEN_SECONDS = float(os.getenv("TRAVEL_API_BREAKER_OPEN_SECONDS", "30"))  # durata dello stato aperto
+TRAVEL_API_BREAKER_HALF_OPEN_CALLS = int(os.getenv("TRAVEL_API_BREAKER_HALF_OPEN_CALLS", "3"))  # chiamate di prova per richiudere
+# Timeout di lettura adattivo: p95 osservato * moltiplicatore, tra il minimo e TRAVEL_API_READ_TIMEOUTS
+TRAVEL_API_TIMEOUT_P95_MULTIPLIER = float(os.getenv("TRAVEL_API_TIMEOUT_P95_MULTIPLIER", "2"))
+TRAVEL_API_TIMEOUT_MIN = float(os.getenv("TRAVEL_API_TIMEOUT_MIN", "1"))  # secondi
+TRAVEL_API_TIMEOUT_MIN_SAMPLES = int(os.getenv("TRAVEL_API_TIMEOUT_MIN_SAMPLES", "20"))  # campioni prima di adattare
+
+# Job di ricerca in background sull'API esterna (utils.search_jobs)
+SEARCH_JOB_POLL_INITIAL = float(os.getenv("SEARCH_JOB_POLL_INITIAL", "0.5"))  # secondi prima del primo poll
+SEARCH_JOB_POLL_MAX = float(os.getenv("SEARCH_JOB_POLL_MAX", "5"))  # secondi, intervallo massimo tra due poll
+SEARCH_JOB_POLL_FACTOR = float(os.getenv("SEARCH_JOB_POLL_FACTOR", "1.5"))  # crescita dell'intervallo a ogni poll
+SEARCH_JOB_TIMEOUT = float(os.getenv("SEARCH_JOB_TIMEOUT", "300"))  # secondi prima di dichiarare fallita una ricerca
+SEARCH_JOB_MAX_CONCURRENT_POLLS = int(os.getenv("SEARCH_JOB_MAX_CONCURRENT_POLLS", "20"))  # richieste di poll in corso insieme
+SEARCH_JOB_MAX_ERRORS = int(os.getenv("SEARCH_JOB_MAX_ERRORS", "3"))  # errori consecutivi prima di abbandonare il job
+SEARCH_JOB_RETENTION = float(os.getenv("SEARCH_JOB_RETENTION", "3600"))  # secondi di conservazione dei job conclusi
+SEARCH_JOB_MAX_JOBS = int(os.getenv("SEARCH_JOB_MAX_JOBS", "1000"))  # job conservati in memoria per processo
+SEARCH_JOB_MAX_USERS = int(os.getenv("SEARCH_JOB_MAX_USERS", "100"))  # utenti che condividono un job (oltre, escono i meno recenti)
+SEARCH_JOB_OWNER_TTL = float(os.getenv("SEARCH_JOB_OWNER_TTL", "86400"))  # secondi, proprietari dei job per riprenderli dopo un riavvio
+SEARCH_JOB_SSE_HEARTBEAT = float(os.getenv("SEARCH_JOB_SSE_HEARTBEAT", "15"))  # secondi tra due keep-alive dello stream SSE
+SEARCH_JOB_SSE_REMOTE_POLL = float(os.getenv("SEARCH_JOB_SSE_REMOTE_POLL", "1"))  # secondi, rilettura dei job di altri worker
+
+# Cache dei risultati delle ricerche per impronta del payload
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "500"))  # risultati tenuti in memoria per processo
+SEARCH_RESULT_CACHE_TTL = float(os.getenv("SEARCH_RESULT_CACHE_TTL", "1800"))  # secondi
+SEARCH_RESULT_CACHE_PERSIST = os.getenv("SEARCH_RESULT_CACHE_PERSIST", "false").lower() == "true"  # salva anche su OpenSearch
+
+# Utenti: gli ID dei documenti derivano dallo username. Con USER_LEGACY_LOOKUP le
+# ricerche per username coprono anche gli utenti creati prima, con ID casuali: va
+# attivato solo finché non sono migrati (python -m python_server.tools.migrate_user_ids)
+USER_LEGACY_LOOKUP = os.getenv("USER_LEGACY_LOOKUP", "false").lower() == "true"
 
 # Nomi degli indici OpenSearch
 INDEX_USERS = "users"
@@ -40,12 +152,14 @@ INDEX_PREFERENCES = "preferences"
 INDEX_TRAVEL_PACKAGES = "travel_packages"
 INDEX_BOOKINGS = "bookings"
 INDEX_SAVED_PACKAGES = "saved_packages"
+INDEX_SEARCH_RESULTS = "search_results"
 
 # Mapping per gli indici
 MAPPINGS = {
     INDEX_USERS: {
         "mappings": {
             "properties": {
+                "id": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # copia di _id, tiebreaker della paginazione
                 "username": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                 "name": {"type": "text"},
                 "email": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
@@ -56,7 +170,8 @@ MAPPINGS = {
     INDEX_PREFERENCES: {
         "mappings": {
             "properties": {
-                "userId": {"type": "keyword"},
+                "id": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # copia di _id, tiebreaker della paginazione
+                "userId": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},
                 "destination": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                 "travelType": {"type": "keyword"},
                 "interests": {"type": "keyword"},
@@ -74,9 +189,10 @@ MAPPINGS = {
     INDEX_TRAVEL_PACKAGES: {
         "mappings": {
             "properties": {
+                "id": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # copia di _id, tiebreaker della paginazione
                 "title": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                 "description": {"type": "text"},
-                "destination": {"type": "text", "fields": {"keyword": {"type": {"type": "keyword"}}}},
+                "destination": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                 "imageUrl": {"type": "keyword"},
                 "rating": {"type": "keyword"},
                 "reviewCount": {"type": "integer"},
@@ -95,7 +211,8 @@ MAPPINGS = {
     INDEX_BOOKINGS: {
         "mappings": {
             "properties": {
-                "userId": {"type": "keyword"},
+                "id": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # copia di _id, tiebreaker della paginazione
+                "userId": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},
                 "packageId": {"type": "keyword"},
                 "travelDate": {"type": "date", "format": "strict_date_optional_time||epoch_millis"},
                 "returnDate": {"type": "date", "format": "strict_date_optional_time||epoch_millis"},
@@ -115,7 +232,8 @@ MAPPINGS = {
     INDEX_SAVED_PACKAGES: {
         "mappings": {
             "properties": {
-                "userId": {"type": "keyword"},  # To associate with user
+                "id": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # copia di _id, tiebreaker della paginazione
+                "userId": {"type": "keyword", "fields": {"keyword": {"type": "keyword"}}},  # To associate with user
                 "savedAt": {"type": "date", "format": "strict_date_optional_time||epoch_millis"},  # Timestamp
                 # Copy relevant fields from INDEX_TRAVEL_PACKAGES mapping here
                 "title": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
@@ -135,5 +253,15 @@ MAPPINGS = {
                 "categories": {"type": "keyword"}
             }
         }
+    },
+    INDEX_SEARCH_RESULTS: {
+        "mappings": {
+            "properties": {
+                "fingerprint": {"type": "keyword"},
+                "result": {"type": "object", "enabled": False},  # salvato ma non indicizzato
+                "createdAt": {"type": "double"},  # epoch in secondi
+                "expiresAt": {"type": "double"}
+            }
+        }
     }
 }
\ No newline at end of file
@@ -1,35 +1,71 @@
-
 import time
 import json
 import logging
 import asyncio
 from functools import wraps
 from flask import request, g
+from .config.settings import REQUEST_TIMING_ENABLED, REQUEST_TIMING_LOG
+from .utils import timing
+from .utils.async_loop import run_sync
 
 logger = logging.getLogger(__name__)
+# Righe di log strutturate (chiave=valore) con durata e span di ogni richiesta
+timing_logger = logging.getLogger("yookve.request")
+
+
+def init_request_timing(app):
+    """Strumentazione di tutte le richieste: span per backend, header Server-Timing e log strutturato.
+
+    Gli span (utils.timing) vengono raccolti dai punti di misura nei client
+    OpenSearch e dell'API esterna, nei repository, nel pool delle password e
+    nel provider JSON; qui si apre la raccolta e si emette il risultato.
+    """
+    if not REQUEST_TIMING_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timing():
+        g.request_started = time.perf_counter()
+        timing.start_request()
+
+    @app.after_request
+    def _emit_timing(response):
+        spans = timing.current_spans()
+        started = g.get("request_started")
+        if spans is None or started is None:
+            return response
+        total = time.perf_counter() - started
+        response.headers["Server-Timing"] = timing.server_timing(spans, total)
+        if REQUEST_TIMING_LOG and timing_logger.isEnabledFor(logging.INFO):
+            timing_logger.info(
+                f"method={request.method} path={request.path} endpoint={request.endpoint} "
+                f"status={response.status_code} dur_ms={total * 1000:.2f} {timing.log_fields(spans)}".rstrip()
+            )
+        return response
+
+    @app.teardown_request
+    def _end_timing(exc):
+        if exc is not None:
+            logger.error(f"Errore in richiesta a {request.path}: {str(exc)}")
+        timing.end_request()
+
 
 def log_request():
-    """Middleware per loggare le richieste API."""
+    """Decoratore delle route: esegue le view async sull'event loop condiviso.
+
+    Durata e span delle richieste sono registrati per tutte le route da
+    init_request_timing.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            start_time = time.time()
-            logger.info(f"Richiesta a {request.path} con metodo {request.method}")
-
-            try:
-                response = f(*args, **kwargs)
-                
-                # Gestione funzioni asincrone
-                if asyncio.iscoroutine(response):
-                    response = asyncio.run(response)
-                    
-                end_time = time.time()
-                execution_time = end_time - start_time
-                logger.info(f"Risposta da {request.path}: {getattr(response, 'status_code', 'N/A')}, tempo di esecuzione: {execution_time:.2f}s")
-                return response
-            except Exception as e:
-                logger.error(f"Errore in richiesta a {request.path}: {str(e)}")
-                raise
+            response = f(*args, **kwargs)
+
+            # Gestione funzioni asincrone: usa l'event loop condiviso
+            # (e il suo pool di connessioni) invece di un asyncio.run per richiesta
+            if asyncio.iscoroutine(response):
+                response = run_sync(response)
+            return response
 
         return decorated_function
     return decorator
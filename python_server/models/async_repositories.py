@@ -0,0 +1,319 @@
+import logging
+from typing import List, Optional, Dict, Any, TypeVar, Generic, Type
+
+from opensearchpy.exceptions import NotFoundError, ConflictError
+
+from ..config.opensearch_client import get_async_opensearch_client
+from ..utils.timing import span, SPAN_PYDANTIC
+from ..utils.auth import generate_id, user_id_for_username
+from ..models.models import (
+    User, UserInDB, UserCreate,
+    Preference, PreferenceCreate,
+    TravelPackage, TravelPackageCreate,
+    Booking, BookingCreate,
+    SavedPackage
+)
+from ..config.settings import (
+    INDEX_USERS, INDEX_PREFERENCES, INDEX_TRAVEL_PACKAGES, INDEX_BOOKINGS,
+    INDEX_SAVED_PACKAGES, USER_LEGACY_LOOKUP
+)
+from .repositories import (
+    WRITE_IMMEDIATE, _hits_to_models, _model_to_dict, _model_from_write, _refresh_param,
+    _term_query, _user_documents_query, _category_query, _recommended_packages_query,
+    _owned_document_query, _user_in_db, _user_document, UserAlreadyExistsError
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+CreateT = TypeVar('CreateT')
+
+
+class AsyncBaseRepository(Generic[T, CreateT]):
+    """Repository base asincrono per le operazioni CRUD su AsyncOpenSearch.
+
+    I metodi vanno eseguiti sull'event loop condiviso (utils.async_loop), che
+    è quello su cui gira il client AsyncOpenSearch del processo.
+    """
+    def __init__(self, model_cls: Type[T], index_name: str):
+        self.client = get_async_opensearch_client()
+        self.model_cls = model_cls
+        self.index_name = index_name
+
+    def _to_dict(self, obj: Any) -> Dict[str, Any]:
+        """Converts a Pydantic model or object to a dictionary."""
+        return _model_to_dict(obj)
+
+    async def get_by_id(self, id: str) -> Optional[T]:
+        """Ottiene un elemento per ID."""
+        if not id:
+            logger.warning(f"Attempted to get document with empty ID from index '{self.index_name}'.")
+            return None
+
+        try:
+            response = await self.client.get(index=self.index_name, id=id)
+            if response["found"]:
+                data = response["_source"]
+                data["id"] = response["_id"]
+                with span(SPAN_PYDANTIC):
+                    return self.model_cls(**data)
+            logger.info(f"Document with ID '{id}' not found in index '{self.index_name}'.")
+            return None
+        except NotFoundError:
+            logger.info(f"Document with ID '{id}' not found in index '{self.index_name}'.")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching document ID '{id}' from index '{self.index_name}': {e}", exc_info=True)
+            return None
+
+    async def get_all(self, size: int = 1000) -> List[T]:
+        """Ottiene tutti gli elementi."""
+        try:
+            response = await self.client.search(
+                index=self.index_name,
+                body={"query": {"match_all": {}}},
+                size=size
+            )
+            return _hits_to_models(self.model_cls, self.index_name, response["hits"]["hits"])
+        except Exception as e:
+            logger.error(f"Error fetching all documents from index '{self.index_name}': {e}", exc_info=True)
+            return []
+
+    async def create(self, obj_in: CreateT, consistency: str = WRITE_IMMEDIATE) -> T:
+        """Crea un nuovo elemento senza rileggerlo (vedi BaseRepository.create)."""
+        obj_dict = self._to_dict(obj_in)
+
+        doc_id = obj_dict.pop("id", None) or generate_id()
+        obj_dict["id"] = doc_id
+
+        try:
+            response = await self.client.index(
+                index=self.index_name,
+                id=doc_id,
+                body=obj_dict,
+                refresh=_refresh_param(consistency)
+            )
+            logger.info(f"Document created/updated with ID '{response['_id']}' in index '{self.index_name}'. Result: {response['result']}")
+            return _model_from_write(self.model_cls, obj_dict, response)
+        except Exception as e:
+            logger.error(f"Error creating document in index '{self.index_name}': {e}. Data: {obj_dict}", exc_info=True)
+            raise
+
+    async def update(self, id: str, obj_in: Dict[str, Any], consistency: str = WRITE_IMMEDIATE) -> Optional[T]:
+        """Aggiorna un elemento e restituisce il documento aggiornato in un solo round-trip."""
+        if not id:
+            logger.warning(f"Attempted to update document with empty ID in index '{self.index_name}'.")
+            return None
+
+        try:
+            response = await self.client.update(
+                index=self.index_name,
+                id=id,
+                body={"doc": obj_in},
+                refresh=_refresh_param(consistency),
+                _source=True
+            )
+            logger.info(f"Document updated with ID '{response['_id']}' in index '{self.index_name}'. Result: {response['result']}")
+
+            updated = response.get("get", {}).get("_source")
+            if updated is None:
+                return await self.get_by_id(id)
+            return _model_from_write(self.model_cls, updated, response)
+        except NotFoundError:
+            logger.warning(f"Attempted to update non-existent document ID '{id}' in index '{self.index_name}'.")
+            return None
+        except Exception as e:
+            logger.error(f"Error updating document ID '{id}' in index '{self.index_name}': {e}. Update data: {obj_in}", exc_info=True)
+            return None
+
+    async def delete(self, id: str, consistency: str = WRITE_IMMEDIATE) -> bool:
+        """Elimina un elemento."""
+        if not id:
+            logger.warning(f"Attempted to delete document with empty ID from index '{self.index_name}'.")
+            return False
+        try:
+            response = await self.client.delete(
+                index=self.index_name,
+                id=id,
+                refresh=_refresh_param(consistency)
+            )
+            deleted = response.get("result") == "deleted"
+            if deleted:
+                logger.info(f"Document deleted with ID '{id}' from index '{self.index_name}'.")
+            else:
+                logger.warning(f"Delete operation for ID '{id}' in index '{self.index_name}' did not return 'deleted'. Response: {response}")
+            return deleted
+        except NotFoundError:
+            logger.warning(f"Attempted to delete non-existent document ID '{id}' from index '{self.index_name}'.")
+            return False
+        except Exception as e:
+            logger.error(f"Error deleting document ID '{id}' from index '{self.index_name}': {e}", exc_info=True)
+            return False
+
+    async def search(self, query: Dict[str, Any], size: int = 100, source: Any = None) -> List[T]:
+        """Cerca elementi con un query OpenSearch (source: filtro _source opzionale)."""
+        if source is not None:
+            query = {**query, "_source": source}
+        try:
+            response = await self.client.search(
+                index=self.index_name,
+                body=query,
+                size=size
+            )
+            return _hits_to_models(self.model_cls, self.index_name, response["hits"]["hits"], partial=source is not None)
+        except Exception as e:
+            logger.error(f"Error searching index '{self.index_name}': {e}. Query: {query}", exc_info=True)
+            return []
+
+
+class AsyncUserRepository(AsyncBaseRepository[User, UserCreate]):
+    """Repository asincrono per gli utenti."""
+    def __init__(self):
+        super().__init__(User, INDEX_USERS)
+
+    async def _get_user_in_db(self, field: str, value: str) -> Optional[UserInDB]:
+        """Cerca un utente per campo esatto e restituisce UserInDB (con l'hash della password)."""
+        try:
+            response = await self.client.search(index=self.index_name, body=_term_query(field, value), size=1)
+            hits = response["hits"]["hits"]
+            if hits:
+                return _user_in_db(hits[0])
+        except Exception as e:
+            logger.error(f"Error fetching user by {field} for UserInDB: {e}", exc_info=True)
+        return None
+
+    async def get_by_username(self, username: str) -> Optional[UserInDB]:
+        """Ottiene un utente per username (vedi UserRepository.get_by_username)."""
+        if not username:
+            return None
+        try:
+            response = await self.client.get(index=self.index_name, id=user_id_for_username(username))
+            if response["_source"].get("username") == username:
+                return _user_in_db(response)
+        except NotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error getting user {username} by derived ID: {e}")
+        if not USER_LEGACY_LOOKUP:
+            return None
+        return await self._get_user_in_db("username.keyword", username)
+
+    async def get_by_email(self, email: str) -> Optional[UserInDB]:
+        """Ottiene un utente per email."""
+        if not email:
+            return None
+        return await self._get_user_in_db("email.keyword", email)
+
+    async def create_user(self, user_create: UserCreate, hashed_password: str, consistency: str = WRITE_IMMEDIATE) -> User:
+        """Crea un nuovo utente con password hashata (vedi UserRepository.create_user)."""
+        user_dict = self._to_dict(user_create)
+        user_dict["password"] = hashed_password
+        doc_id = _user_document(user_dict, user_create.username)
+
+        if USER_LEGACY_LOOKUP and await self._get_user_in_db("username.keyword", user_create.username):
+            raise UserAlreadyExistsError(user_create.username)
+
+        try:
+            response = await self.client.index(
+                index=self.index_name,
+                id=doc_id,
+                body=user_dict,
+                op_type="create",
+                refresh=_refresh_param(consistency)
+            )
+            user_dict.pop('password', None)
+            return _model_from_write(User, user_dict, response)
+        except ConflictError:
+            raise UserAlreadyExistsError(user_create.username)
+        except Exception as e:
+            logger.error(f"Error creating user: {e}", exc_info=True)
+            raise
+
+
+class AsyncPreferenceRepository(AsyncBaseRepository[Preference, PreferenceCreate]):
+    """Repository asincrono per le preferenze."""
+    def __init__(self):
+        super().__init__(Preference, INDEX_PREFERENCES)
+
+    async def get_by_user_id(self, user_id: str) -> List[Preference]:
+        """Ottiene le preferenze di un utente."""
+        if not user_id:
+            return []
+        return await self.search(_user_documents_query(user_id, "createdAt"))
+
+
+class AsyncTravelPackageRepository(AsyncBaseRepository[TravelPackage, TravelPackageCreate]):
+    """Repository asincrono per i pacchetti di viaggio."""
+    def __init__(self):
+        super().__init__(TravelPackage, INDEX_TRAVEL_PACKAGES)
+
+    async def get_by_category(self, category: str) -> List[TravelPackage]:
+        """Ottiene i pacchetti di viaggio per categoria."""
+        return await self.search(_category_query(category))
+
+    async def get_recommended_packages(self, preferences: Preference) -> List[TravelPackage]:
+        """Ottiene i pacchetti di viaggio raccomandati in base alle preferenze."""
+        return await self.search(_recommended_packages_query(preferences), size=3)
+
+
+class AsyncBookingRepository(AsyncBaseRepository[Booking, BookingCreate]):
+    """Repository asincrono per le prenotazioni."""
+    def __init__(self):
+        super().__init__(Booking, INDEX_BOOKINGS)
+
+    async def get_by_user_id(self, user_id: str) -> List[Booking]:
+        """Ottiene le prenotazioni di un utente."""
+        if not user_id:
+            return []
+        return await self.search(_user_documents_query(user_id, "bookingDate"))
+
+    async def update_status(self, id: str, status: str, consistency: str = WRITE_IMMEDIATE) -> Optional[Booking]:
+        """Aggiorna lo stato di una prenotazione."""
+        return await self.update(id, {"status": status}, consistency=consistency)
+
+    async def update_payment_status(self, id: str, payment_status: str, consistency: str = WRITE_IMMEDIATE) -> Optional[Booking]:
+        """Aggiorna lo stato di pagamento di una prenotazione."""
+        return await self.update(id, {"paymentStatus": payment_status}, consistency=consistency)
+
+
+class AsyncSavedPackageRepository(AsyncBaseRepository[SavedPackage, SavedPackage]):
+    """Repository asincrono per i pacchetti salvati."""
+    def __init__(self):
+        super().__init__(SavedPackage, INDEX_SAVED_PACKAGES)
+
+    async def find_by_user(self, user_id: str, size: int = 100, source: Any = None) -> List[SavedPackage]:
+        """Finds saved packages by user ID (source: optional _source projection)."""
+        if not user_id:
+            return []
+        return await self.search(_user_documents_query(user_id, "savedAt"), size=size, source=source)
+
+    async def get_by_user_id(self, user_id: str, source: Any = None) -> List[SavedPackage]:
+        """Ottiene i pacchetti salvati di un utente (alias di find_by_user)."""
+        return await self.find_by_user(user_id, source=source)
+
+    async def delete_for_user(self, package_id: str, user_id: str) -> bool:
+        """Deletes a package only if it belongs to the specified user."""
+        if not package_id or not user_id:
+            return False
+        try:
+            response = await self.client.delete_by_query(
+                index=self.index_name,
+                body=_owned_document_query(package_id, user_id),
+                refresh=True  # delete_by_query non accetta refresh=wait_for
+            )
+            if response.get("deleted", 0) > 0:
+                logger.info(f"Successfully deleted saved package {package_id} for user {user_id}.")
+                return True
+            logger.warning(f"Saved package {package_id} not found or does not belong to user {user_id}. No documents deleted.")
+            return False
+        except Exception as e:
+            logger.error(f"Error deleting saved package {package_id} for user {user_id}: {e}", exc_info=True)
+            return False
+
+    async def create(self, data: Any, consistency: str = WRITE_IMMEDIATE) -> SavedPackage:
+        """Crea un nuovo pacchetto salvato (da modello o dizionario)."""
+        data = self._to_dict(data)
+        # Gestisci campi user_id e userId
+        if "user_id" in data and "userId" not in data:
+            data["userId"] = data["user_id"]
+        return await super().create(data, consistency=consistency)
@@ -0,0 +1,133 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from opensearchpy.exceptions import TransportError
+
+from ..config.settings import (
+    BULK_CHUNK_DOCS, BULK_CHUNK_BYTES, BULK_MAX_IN_FLIGHT, BULK_MAX_RETRIES,
+    BULK_BACKOFF_INITIAL, BULK_BACKOFF_MAX
+)
+from .models import BulkItemResult
+
+logger = logging.getLogger(__name__)
+
+# Stati per cui OpenSearch chiede di riprovare più tardi
+RETRYABLE_STATUSES = (429, 503)
+
+# Operazione bulk in ingresso: (azione, id documento, corpo)
+BulkAction = Tuple[str, Optional[str], Optional[Dict[str, Any]]]
+
+
+class _BulkOp(NamedTuple):
+    """Operazione già serializzata in NDJSON, con la sua posizione nell'input."""
+    seq: int
+    action: str
+    doc_id: Optional[str]
+    payload: str
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Backoff esponenziale con full jitter."""
+    return random.uniform(0, min(BULK_BACKOFF_MAX, BULK_BACKOFF_INITIAL * 2 ** (attempt - 1)))
+
+
+def _encode(serializer, index_name: str, seq: int, action: BulkAction) -> _BulkOp:
+    op, doc_id, source = action
+    meta = {"_index": index_name}
+    if doc_id:
+        meta["_id"] = doc_id
+    payload = serializer.dumps({op: meta}) + "\n"
+    if op != "delete":
+        payload += serializer.dumps(source) + "\n"
+    return _BulkOp(seq, op, doc_id, payload)
+
+
+def _chunks(ops: Iterable[_BulkOp], chunk_docs: int, chunk_bytes: int) -> Iterator[List[_BulkOp]]:
+    """Raggruppa le operazioni per numero di documenti e dimensione in byte."""
+    chunk: List[_BulkOp] = []
+    size = 0
+    for op in ops:
+        op_size = len(op.payload.encode("utf-8"))
+        if chunk and (len(chunk) >= chunk_docs or size + op_size > chunk_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(op)
+        size += op_size
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(client, ops: List[_BulkOp], refresh: Any, max_retries: int) -> Dict[int, BulkItemResult]:
+    """Invia un blocco, riprovando con backoff gli elementi rifiutati con 429/503."""
+    results: Dict[int, BulkItemResult] = {}
+    pending = ops
+    attempt = 0
+    while pending:
+        attempt += 1
+        try:
+            response = client.bulk(body="".join(op.payload for op in pending), refresh=refresh)
+        except TransportError as e:
+            status = e.status_code if isinstance(e.status_code, int) else 500
+            if status in RETRYABLE_STATUSES and attempt <= max_retries:
+                logger.warning(f"Richiesta bulk rifiutata ({status}), nuovo tentativo {attempt}/{max_retries}")
+                time.sleep(_backoff_delay(attempt))
+                continue
+            logger.error(f"Richiesta bulk fallita per {len(pending)} elementi: {e}")
+            for op in pending:
+                results[op.seq] = BulkItemResult(id=op.doc_id, action=op.action, status=status,
+                                                 success=False, error=str(e), attempts=attempt)
+            break
+
+        retry = []
+        for op, item in zip(pending, response["items"]):
+            info = item.get(op.action) or next(iter(item.values()))
+            status = info.get("status", 500)
+            if status in RETRYABLE_STATUSES and attempt <= max_retries:
+                retry.append(op)
+                continue
+            results[op.seq] = BulkItemResult(id=info.get("_id", op.doc_id), action=op.action, status=status,
+                                             success=status < 300, error=info.get("error"), attempts=attempt)
+        pending = retry
+        if pending:
+            logger.warning(f"{len(pending)} elementi bulk rifiutati con 429/503, nuovo tentativo {attempt}/{max_retries}")
+            time.sleep(_backoff_delay(attempt))
+    return results
+
+
+def run_bulk(
+    client,
+    index_name: str,
+    actions: Iterable[BulkAction],
+    refresh: Any = False,
+    chunk_docs: int = BULK_CHUNK_DOCS,
+    chunk_bytes: int = BULK_CHUNK_BYTES,
+    max_in_flight: int = BULK_MAX_IN_FLIGHT,
+    max_retries: int = BULK_MAX_RETRIES,
+) -> List[BulkItemResult]:
+    """Esegue una scrittura bulk e restituisce l'esito di ogni elemento, nell'ordine dell'input.
+
+    L'input (anche un generatore) viene consumato solo quando c'è posto per un
+    nuovo blocco: al massimo max_in_flight richieste bulk sono in corso insieme.
+    """
+    serializer = client.transport.serializer
+    ops = (_encode(serializer, index_name, seq, action) for seq, action in enumerate(actions))
+    results: Dict[int, BulkItemResult] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="bulk") as executor:
+        in_flight = set()
+        for chunk in _chunks(ops, chunk_docs, chunk_bytes):
+            # Backpressure: non leggere altro input finché un blocco non è terminato
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.update(future.result())
+            in_flight.add(executor.submit(_send_chunk, client, chunk, refresh, max_retries))
+        for future in in_flight:
+            results.update(future.result())
+
+    failed = sum(1 for r in results.values() if not r.success)
+    logger.info(f"Bulk su '{index_name}' completato: {len(results)} elementi, {failed} falliti")
+    return [results[seq] for seq in sorted(results)]
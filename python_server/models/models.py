@@ -1,11 +1,16 @@
 from datetime import datetime
 from typing import Optional, List, Union, Dict, Any
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, PrivateAttr
 
 # Classe di base per tutti i modelli
 class YookveBaseModel(BaseModel):
     """Classe base per tutti i modelli dell'app."""
     id: Optional[str] = None
+    # Metadati di versione OpenSearch (per il controllo di concorrenza ottimistico)
+    _seq_no: Optional[int] = PrivateAttr(default=None)
+    _primary_term: Optional[int] = PrivateAttr(default=None)
+    # True se costruito da un _source filtrato (proiezione): contiene solo alcuni campi
+    _partial: bool = PrivateAttr(default=False)
 
     class Config:
         populate_by_name = True
@@ -79,6 +84,36 @@ class TravelPackageBase(YookveBaseModel):
     isRecommended: bool = False
     categories: Optional[List[str]] = None
 
+# Proiezioni dei pacchetti di viaggio (parametro fields= degli endpoint di elenco)
+TRAVEL_PACKAGE_PROJECTIONS: Dict[str, Dict[str, List[str]]] = {
+    # Campi mostrati nelle card degli elenchi
+    "card": {"includes": [
+        "title", "destination", "imageUrl", "rating", "reviewCount", "price",
+        "durationDays", "durationNights", "isRecommended", "categories",
+        "userId", "savedAt"  # presenti solo nei pacchetti salvati
+    ]},
+    # Pagina di dettaglio: tutto tranne i campi interni
+    "detail": {"includes": [], "excludes": ["user_id"]},
+}
+
+def resolve_projection(fields: Optional[str], projections: Dict[str, Dict[str, List[str]]] = TRAVEL_PACKAGE_PROJECTIONS) -> Optional[Dict[str, List[str]]]:
+    """Converte il parametro fields= in un filtro _source.
+
+    Accetta il nome di una proiezione (es. "card") oppure un elenco di campi
+    separati da virgola; i campi preceduti da "-" vengono esclusi.
+    """
+    if not fields:
+        return None
+    if fields in projections:
+        return projections[fields]
+    includes, excludes = [], []
+    for field in (f.strip() for f in fields.split(",")):
+        if field.startswith("-") and len(field) > 1:
+            excludes.append(field[1:])
+        elif field:
+            includes.append(field)
+    return {"includes": includes, "excludes": excludes}
+
 class TravelPackageCreate(TravelPackageBase):
     """Dati necessari per creare un nuovo pacchetto di viaggio."""
     pass
@@ -96,15 +131,14 @@ class SavedPackage(YookveBaseModel):
 
     def model_post_init(self, __context):
         # Se user_id è presente ma userId no, usare user_id per userId
-        if not self.userId and self.user_id:
+        # (con una proiezione userId può non essere stato letto)
+        if not getattr(self, "userId", None) and self.user_id:
             self.userId = self.user_id
 
     def dict(self):
         """Converte il modello in dizionario per serializzazione JSON."""
-        return {
-            key: value for key, value in self.__dict__.items() 
-            if not key.startswith('_')
-        }
+        # model_dump include anche i campi extra del pacchetto (title, price, ...)
+        return self.model_dump()
 
 
 # Modelli per le prenotazioni
@@ -137,6 +171,16 @@ class Booking(BookingBase):
     status: str = "pending"  # pending, confirmed, cancelled
     paymentStatus: str = "unpaid"  # unpaid, paid
 
+# Esito delle scritture bulk
+class BulkItemResult(BaseModel):
+    """Esito di una singola operazione di una scrittura bulk."""
+    id: Optional[str] = None
+    action: str  # index, update, delete
+    status: int
+    success: bool
+    error: Optional[Any] = None
+    attempts: int = 1
+
 # Modelli per i pagamenti
 class PaymentIntent(BaseModel):
     """Modello per creare un intento di pagamento."""
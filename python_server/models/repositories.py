@@ -1,21 +1,31 @@
-from typing import List, Optional, Dict, Any, TypeVar, Generic, Type
+from typing import List, Optional, Dict, Any, TypeVar, Generic, Type, Iterable, Iterator, Tuple, NamedTuple
+import base64
+import binascii
+import copy
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from ..config.opensearch_client import get_opensearch_client
-from ..utils.auth import generate_id
+from ..utils.auth import generate_id, user_id_for_username
 from ..models.models import (
     User, UserInDB, UserCreate,
     Preference, PreferenceCreate,
     TravelPackage, TravelPackageCreate,
     Booking, BookingCreate, BookingUpdate,
-    SavedPackage # Import SavedPackage model
+    SavedPackage, # Import SavedPackage model
+    BulkItemResult
 )
+from .bulk import run_bulk, BulkAction
+from ..utils.cache import VersionedCache
+from ..utils.timing import span, SPAN_PYDANTIC
 from ..config.settings import (
     INDEX_USERS, INDEX_PREFERENCES, INDEX_TRAVEL_PACKAGES, INDEX_BOOKINGS,
-    INDEX_SAVED_PACKAGES # Import index name
+    INDEX_SAVED_PACKAGES, # Import index name
+    SCAN_PAGE_SIZE, SCAN_KEEP_ALIVE, TRAVEL_PACKAGE_CACHE_TTL, USER_LEGACY_LOOKUP
 )
-from opensearchpy.exceptions import NotFoundError
+from opensearchpy.exceptions import NotFoundError, ConflictError
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,35 +33,242 @@ logger = logging.getLogger(__name__)
 T = TypeVar('T')
 CreateT = TypeVar('CreateT')
 
+# Modalità di consistenza delle scritture
+WRITE_IMMEDIATE = "immediate"  # refresh=wait_for: il documento è subito visibile alle ricerche
+WRITE_ASYNC = "async"  # nessuna attesa del refresh: visibile alle ricerche al prossimo refresh (le GET per ID sono realtime)
+
+
+# Tiebreaker della paginazione con search_after: il campo id (copia di _id nel
+# _source) ha doc values, _id richiede fielddata e nelle versioni recenti non è
+# ordinabile. id.keyword esiste sia col mapping di MAPPINGS sia negli indici
+# esistenti, dove id è stato mappato dinamicamente come text con sottocampo keyword
+_ID_TIEBREAKER = {"id.keyword": "asc"}
+
+
+class SearchPage(NamedTuple):
+    """Pagina di risultati con il cursore opaco per la pagina successiva."""
+    items: List[Any]
+    next_cursor: Optional[str]
+    total: Optional[int]  # solo con track_total_hits
+
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    """Codifica i valori di sort dell'ultimo hit in un cursore opaco."""
+    raw = json.dumps(sort_values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decodifica un cursore prodotto da encode_cursor (ValueError se non valido)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, binascii.Error, UnicodeEncodeError) as e:
+        raise ValueError("Cursore non valido") from e
+    if not isinstance(values, list):
+        raise ValueError("Cursore non valido")
+    return values
+
+
+_repositories: Dict[type, Any] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(repo_cls: Type[Any]) -> Any:
+    """Restituisce l'istanza condivisa di un repository (una per processo)."""
+    repo = _repositories.get(repo_cls)
+    if repo is None:
+        with _repositories_lock:
+            repo = _repositories.get(repo_cls)
+            if repo is None:
+                repo = repo_cls()
+                _repositories[repo_cls] = repo
+    return repo
+
+
+def _hits_to_models(model_cls: Type[Any], index_name: str, hits: List[Dict[str, Any]], partial: bool = False) -> List[Any]:
+    """Converte gli hit di una ricerca nei modelli del repository.
+
+    Con partial=True (_source filtrato) i modelli vengono costruiti senza
+    validazione, perché i campi obbligatori possono mancare.
+    """
+    results = []
+    with span(SPAN_PYDANTIC):
+        for hit in hits:
+            data = hit["_source"]
+            data["id"] = hit["_id"]
+            try:
+                if partial:
+                    obj = model_cls.model_construct(**data)
+                    obj._partial = True
+                else:
+                    obj = model_cls(**data)
+                results.append(obj)
+            except Exception as e:
+                logger.error(f"Error parsing document {hit['_id']} from index '{index_name}': {e}. Data: {data}", exc_info=True)
+                # Optionally skip problematic documents
+            # continue
+    return results
+
+
+def _sort_clauses(sort: Any) -> List[Any]:
+    """Clausole di sort come lista (OpenSearch accetta anche un singolo campo o dizionario)."""
+    if sort is None:
+        return []
+    if isinstance(sort, (dict, str)):
+        return [sort]
+    return list(sort)
+
+
+def _term_query(field: str, value: Any) -> Dict[str, Any]:
+    """Query term su un singolo campo (es. username.keyword)."""
+    return {
+        "query": {
+            "term": {
+                field: value
+            }
+        }
+    }
+
+
+def _user_documents_query(user_id: str, sort_field: str) -> Dict[str, Any]:
+    """Documenti di un utente, dal più recente."""
+    return {
+        "query": {
+            "term": {
+                "userId.keyword": user_id # Assuming userId is keyword for exact match
+            }
+        },
+        "sort": [
+            {sort_field: {"order": "desc"}}
+        ]
+    }
+
+
+def _category_query(category: str) -> Dict[str, Any]:
+    """Pacchetti di viaggio di una categoria."""
+    return {
+        "query": {
+            "match": {
+                "categories": category
+            }
+        }
+    }
+
+
+def _recommended_packages_query(preferences: Optional[Preference]) -> Dict[str, Any]:
+    """Query dei pacchetti raccomandati in base alle preferenze."""
+    # Criterio di raccomandazione basato sugli interessi dell'utente
+    if not preferences or not preferences.interests:
+        # Se non ci sono preferenze, restituisci pacchetti consigliati generali
+        return {
+            "query": {
+                "term": {
+                    "isRecommended": True
+                }
+            }
+        }
+    # Altrimenti, usa gli interessi dell'utente per consigliare pacchetti
+    return {
+        "query": {
+            "bool": {
+                "should": [
+                    {"terms": {"categories": preferences.interests}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+
+def _owned_document_query(doc_id: str, user_id: str) -> Dict[str, Any]:
+    """Documento con l'ID indicato, solo se appartiene all'utente."""
+    return {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"_id": doc_id}},
+                    {"term": {"userId.keyword": user_id}}
+                ]
+            }
+        }
+    }
+
+
+def _refresh_param(consistency: str) -> Any:
+    """Parametro refresh di OpenSearch per la modalità di consistenza richiesta."""
+    if consistency == WRITE_IMMEDIATE:
+        return "wait_for"
+    if consistency == WRITE_ASYNC:
+        return False
+    raise ValueError(f"Modalità di consistenza non valida: {consistency}")
+
+
+class UserAlreadyExistsError(Exception):
+    """Username già registrato."""
+
+
+def _user_in_db(hit: Dict[str, Any]) -> UserInDB:
+    """UserInDB (con l'hash della password) da un hit di ricerca o da una GET."""
+    db_data = dict(hit["_source"])
+    db_data["id"] = hit["_id"]
+    with span(SPAN_PYDANTIC):
+        return UserInDB(**db_data)
+
+
+def _user_document(user_dict: Dict[str, Any], username: str) -> str:
+    """ID del nuovo documento utente: quello indicato o quello derivato dallo username."""
+    doc_id = user_dict.pop("id", None) or user_id_for_username(username)
+    user_dict["id"] = doc_id
+    return doc_id
+
+
+def _model_from_write(model_cls: Type[Any], source: Dict[str, Any], response: Dict[str, Any]) -> Any:
+    """Costruisce il modello dal corpo scritto e dai metadati della risposta, senza rileggere il documento."""
+    data = dict(source)
+    data["id"] = response["_id"]
+    with span(SPAN_PYDANTIC):
+        obj = model_cls(**data)
+    obj._seq_no = response.get("_seq_no")
+    obj._primary_term = response.get("_primary_term")
+    return obj
+
+
+def _model_to_dict(obj: Any) -> Dict[str, Any]:
+    """Converts a Pydantic model or object to a dictionary."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(exclude_none=True)
+    elif hasattr(obj, "dict"):
+        return obj.dict(exclude_none=True)
+    return dict(obj)
+
+
 class BaseRepository(Generic[T, CreateT]):
     """Repository base per le operazioni CRUD."""
     def __init__(self, model_cls: Type[T], index_name: str):
         self.client = get_opensearch_client()
         self.model_cls = model_cls
         self.index_name = index_name
-        self._ensure_index_exists()
-
-    def _ensure_index_exists(self):
-        """Ensures the OpenSearch index exists."""
-        # This is a basic check, you might need more complex logic for mappings
-        if not self.client.indices.exists(index=self.index_name):
-            try:
-                logger.info(f"Index '{self.index_name}' not found. Creating index...")
-                # You might want to add specific mappings here if needed
-                self.client.indices.create(index=self.index_name)
-                logger.info(f"Index '{self.index_name}' created successfully.")
-            except Exception as e:
-                logger.error(f"Failed to create index '{self.index_name}': {e}", exc_info=True)
-                # Decide how to handle this error, maybe raise it
-                # raise
+        # L'esistenza degli indici viene verificata una sola volta all'avvio (init_indices)
 
     def _to_dict(self, obj: Any) -> Dict[str, Any]:
         """Converts a Pydantic model or object to a dictionary."""
-        if hasattr(obj, "model_dump"):
-            return obj.model_dump(exclude_none=True)
-        elif hasattr(obj, "dict"):
-            return obj.dict(exclude_none=True)
-        return dict(obj)
+        return _model_to_dict(obj)
+
+    def _fetch_by_id(self, id: str) -> Optional[T]:
+        """Legge un documento per ID: None se non esiste, eccezione in caso di errore."""
+        try:
+            response = self.client.get(index=self.index_name, id=id)
+        except NotFoundError:
+            response = {"found": False}
+        if response["found"]:
+            data = response["_source"]
+            data["id"] = response["_id"]
+            with span(SPAN_PYDANTIC):
+                return self.model_cls(**data)
+        # This case might not be reached if get throws NotFoundError
+        logger.info(f"Document with ID '{id}' not found in index '{self.index_name}'.")
+        return None
 
     def get_by_id(self, id: str) -> Optional[T]:
         """Ottiene un elemento per ID."""
@@ -60,18 +277,7 @@ class BaseRepository(Generic[T, CreateT]):
             return None
 
         try:
-            response = self.client.get(index=self.index_name, id=id)
-            if response["found"]:
-                data = response["_source"]
-                data["id"] = response["_id"]
-                return self.model_cls(**data)
-            else:
-                # This case might not be reached if get throws NotFoundError
-                logger.info(f"Document with ID '{id}' not found in index '{self.index_name}'.")
-                return None
-        except NotFoundError:
-            logger.info(f"Document with ID '{id}' not found in index '{self.index_name}'.")
-            return None
+            return self._fetch_by_id(id)
         except Exception as e:
             logger.error(f"Error fetching document ID '{id}' from index '{self.index_name}': {e}", exc_info=True)
             return None
@@ -79,29 +285,17 @@ class BaseRepository(Generic[T, CreateT]):
     def get_all(self, size: int = 1000) -> List[T]:
         """Ottiene tutti gli elementi."""
         try:
-            response = self.client.search(
-                index=self.index_name,
-                body={"query": {"match_all": {}}},
-                size=size
-            )
-
-            results = []
-            for hit in response["hits"]["hits"]:
-                data = hit["_source"]
-                data["id"] = hit["_id"]
-                try:
-                    results.append(self.model_cls(**data))
-                except Exception as e:
-                    logger.error(f"Error parsing document {hit['_id']} from index '{self.index_name}': {e}. Data: {data}", exc_info=True)
-                    # Optionally skip problematic documents
-                    # continue
-            return results
+            return self._search({"query": {"match_all": {}}}, size)
         except Exception as e:
             logger.error(f"Error fetching all documents from index '{self.index_name}': {e}", exc_info=True)
             return []
 
-    def create(self, obj_in: CreateT) -> T:
-        """Crea un nuovo elemento."""
+    def create(self, obj_in: CreateT, consistency: str = WRITE_IMMEDIATE) -> T:
+        """Crea un nuovo elemento.
+
+        Il modello restituito è costruito dal corpo indicizzato e dai metadati
+        della risposta (_id, _seq_no, _primary_term), senza una seconda lettura.
+        """
         obj_dict = self._to_dict(obj_in)
 
         # Ensure ID is generated and handled correctly
@@ -113,42 +307,35 @@ class BaseRepository(Generic[T, CreateT]):
                 index=self.index_name,
                 id=doc_id,
                 body=obj_dict,
-                refresh="wait_for" # Use wait_for for better consistency
+                refresh=_refresh_param(consistency)
             )
             logger.info(f"Document created/updated with ID '{response['_id']}' in index '{self.index_name}'. Result: {response['result']}")
-
-            # Retrieve the created/updated document to return the full model
-            created_obj = self.get_by_id(doc_id)
-            if created_obj:
-                return created_obj
-            else:
-                # This should ideally not happen if refresh='wait_for' is used
-                logger.error(f"Failed to retrieve document immediately after creation/update. ID: {doc_id}, Index: {self.index_name}")
-                # Fallback: Try to return based on input + generated ID
-                obj_dict['id'] = doc_id # Ensure ID is present
-                return self.model_cls(**obj_dict)
+            return _model_from_write(self.model_cls, obj_dict, response)
         except Exception as e:
             logger.error(f"Error creating document in index '{self.index_name}': {e}. Data: {obj_dict}", exc_info=True)
             raise # Re-raise the exception to be handled by the caller
 
-    def update(self, id: str, obj_in: Dict[str, Any]) -> Optional[T]:
-        """Aggiorna un elemento."""
+    def update(self, id: str, obj_in: Dict[str, Any], consistency: str = WRITE_IMMEDIATE) -> Optional[T]:
+        """Aggiorna un elemento e restituisce il documento aggiornato in un solo round-trip."""
         if not id:
             logger.warning(f"Attempted to update document with empty ID in index '{self.index_name}'.")
             return None
 
         try:
-            # Update the document
+            # _source=True fa restituire a OpenSearch il documento aggiornato
             response = self.client.update(
                 index=self.index_name,
                 id=id,
                 body={"doc": obj_in},
-                refresh="wait_for"
+                refresh=_refresh_param(consistency),
+                _source=True
             )
             logger.info(f"Document updated with ID '{response['_id']}' in index '{self.index_name}'. Result: {response['result']}")
 
-            # Retrieve and return the updated document
-            return self.get_by_id(id)
+            updated = response.get("get", {}).get("_source")
+            if updated is None:
+                return self.get_by_id(id)
+            return _model_from_write(self.model_cls, updated, response)
         except NotFoundError:
             logger.warning(f"Attempted to update non-existent document ID '{id}' in index '{self.index_name}'.")
             return None
@@ -156,7 +343,7 @@ class BaseRepository(Generic[T, CreateT]):
             logger.error(f"Error updating document ID '{id}' in index '{self.index_name}': {e}. Update data: {obj_in}", exc_info=True)
             return None
 
-    def delete(self, id: str) -> bool:
+    def delete(self, id: str, consistency: str = WRITE_IMMEDIATE) -> bool:
         """Elimina un elemento."""
         if not id:
              logger.warning(f"Attempted to delete document with empty ID from index '{self.index_name}'.")
@@ -165,7 +352,7 @@ class BaseRepository(Generic[T, CreateT]):
             response = self.client.delete(
                 index=self.index_name,
                 id=id,
-                refresh="wait_for"
+                refresh=_refresh_param(consistency)
             )
             deleted = response.get("result") == "deleted"
             if deleted:
@@ -180,26 +367,168 @@ class BaseRepository(Generic[T, CreateT]):
             logger.error(f"Error deleting document ID '{id}' from index '{self.index_name}': {e}", exc_info=True)
             return False
 
-    def search(self, query: Dict[str, Any], size: int = 100) -> List[T]:
-        """Cerca elementi con un query OpenSearch."""
-        try:
-            response = self.client.search(
-                index=self.index_name,
-                body=query,
-                size=size
-            )
-
-            results = []
-            for hit in response["hits"]["hits"]:
+    def search_page(
+        self,
+        query: Optional[Dict[str, Any]] = None,
+        size: int = 100,
+        cursor: Optional[str] = None,
+        raw: bool = False,
+        track_total_hits: bool = False,
+        source: Any = None,
+    ) -> SearchPage:
+        """Una pagina di risultati con paginazione a cursore (search_after + tiebreaker su id).
+
+        Ogni pagina costa come la prima, anche in profondità. Il conteggio totale
+        è disattivato di default; cursori non validi sollevano ValueError.
+        source filtra _source come in search.
+        """
+        body = copy.deepcopy(query) if query else {"query": {"match_all": {}}}
+        if source is not None:
+            body["_source"] = source
+        # Le query a punteggio vanno ordinate per rilevanza prima del tiebreaker
+        default_sort = [{"_score": "desc"}] if "match_all" not in body.get("query", {}) else []
+        body["sort"] = _sort_clauses(body.get("sort", default_sort)) + [_ID_TIEBREAKER]
+        # Un elemento in più dice se esiste una pagina successiva
+        body["size"] = size + 1
+        body["track_total_hits"] = track_total_hits
+        if cursor:
+            body["search_after"] = decode_cursor(cursor)
+
+        response = self.client.search(index=self.index_name, body=body)
+        hits = response["hits"]["hits"]
+        next_cursor = encode_cursor(hits[size - 1]["sort"]) if len(hits) > size else None
+        hits = hits[:size]
+
+        if raw:
+            items = []
+            for hit in hits:
                 data = hit["_source"]
                 data["id"] = hit["_id"]
+                items.append(data)
+        else:
+            items = _hits_to_models(self.model_cls, self.index_name, hits, partial=source is not None)
+
+        total = response["hits"].get("total", {}).get("value") if track_total_hits else None
+        return SearchPage(items, next_cursor, total)
+
+    def iter_search(
+        self,
+        query: Optional[Dict[str, Any]] = None,
+        page_size: int = SCAN_PAGE_SIZE,
+        source: Any = None,
+        raw: bool = False,
+        keep_alive: str = SCAN_KEEP_ALIVE,
+    ) -> Iterator[Any]:
+        """Scorre tutti i risultati di una query, pagina per pagina, senza limiti di dimensione.
+
+        Usa un point-in-time con search_after (tiebreaker su _shard_doc, o su id
+        se il cluster non supporta i PIT) e scarica la
+        pagina successiva mentre il chiamante elabora quella corrente: in memoria
+        ci sono al massimo due pagine. source filtra _source (lista di campi o
+        includes/excludes); con raw=True restituisce dizionari invece dei modelli.
+        """
+        body = copy.deepcopy(query) if query else {"query": {"match_all": {}}}
+        body["size"] = page_size
+        if source is not None:
+            body["_source"] = source
+
+        pit_id = None
+        try:
+            pit_id = self.client.create_pit(index=self.index_name, keep_alive=keep_alive)["pit_id"]
+        except Exception as e:
+            # Cluster senza supporto PIT: search_after semplice sull'indice
+            logger.warning(f"Point-in-time non disponibile per l'indice '{self.index_name}', uso search_after semplice: {e}")
+        # Con il PIT _shard_doc è un tiebreaker univoco senza campi aggiuntivi
+        tiebreaker = {"_shard_doc": "asc"} if pit_id else _ID_TIEBREAKER
+        body["sort"] = _sort_clauses(body.get("sort")) + [tiebreaker]
+
+        def fetch_page(search_after):
+            page_body = dict(body)
+            if search_after is not None:
+                page_body["search_after"] = search_after
+            if pit_id:
+                page_body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+                return self.client.search(body=page_body)
+            return self.client.search(index=self.index_name, body=page_body)
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-prefetch")
+        try:
+            next_page = executor.submit(fetch_page, None)
+            while True:
+                response = next_page.result()
+                hits = response["hits"]["hits"]
+                if not hits:
+                    break
+                pit_id = response.get("pit_id", pit_id)
+                if len(hits) == page_size:
+                    # Prefetch della pagina successiva mentre si restituisce la corrente
+                    next_page = executor.submit(fetch_page, hits[-1]["sort"])
+                else:
+                    next_page = None
+
+                if raw:
+                    for hit in hits:
+                        data = hit["_source"]
+                        data["id"] = hit["_id"]
+                        yield data
+                else:
+                    yield from _hits_to_models(self.model_cls, self.index_name, hits, partial=source is not None)
+
+                if next_page is None:
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if pit_id:
                 try:
-                    results.append(self.model_cls(**data))
+                    self.client.delete_pit(body={"pit_id": [pit_id]})
                 except Exception as e:
-                    logger.error(f"Error parsing document {hit['_id']} from index '{self.index_name}': {e}. Data: {data}", exc_info=True)
-                    # Optionally skip problematic documents
-                    # continue
-            return results
+                    logger.warning(f"Impossibile chiudere il point-in-time sull'indice '{self.index_name}': {e}")
+
+    def iter_all(self, page_size: int = SCAN_PAGE_SIZE, source: Any = None, raw: bool = False) -> Iterator[Any]:
+        """Scorre tutti i documenti dell'indice (vedi iter_search)."""
+        return self.iter_search(None, page_size=page_size, source=source, raw=raw)
+
+    def _bulk(self, actions: Iterable[BulkAction], consistency: str) -> List[BulkItemResult]:
+        """Punto unico per le scritture bulk del repository."""
+        return run_bulk(self.client, self.index_name, actions, refresh=_refresh_param(consistency))
+
+    def bulk_create(self, objs: Iterable[Any], consistency: str = WRITE_ASYNC) -> List[BulkItemResult]:
+        """Indicizza molti elementi (anche da un generatore) con richieste bulk a blocchi."""
+        def actions():
+            for obj in objs:
+                obj_dict = self._to_dict(obj)
+                doc_id = obj_dict.pop("id", None) or generate_id()
+                obj_dict["id"] = doc_id
+                yield ("index", doc_id, obj_dict)
+        return self._bulk(actions(), consistency)
+
+    def bulk_update(self, updates: Iterable[Tuple[str, Dict[str, Any]]], consistency: str = WRITE_ASYNC) -> List[BulkItemResult]:
+        """Aggiornamenti parziali in blocco da coppie (id, campi da aggiornare)."""
+        return self._bulk((("update", id, {"doc": doc}) for id, doc in updates), consistency)
+
+    def bulk_delete(self, ids: Iterable[str], consistency: str = WRITE_ASYNC) -> List[BulkItemResult]:
+        """Elimina molti elementi per ID."""
+        return self._bulk((("delete", id, None) for id in ids), consistency)
+
+    def _search(self, query: Dict[str, Any], size: int, source: Any = None) -> List[T]:
+        """Esegue la ricerca senza gestire gli errori (vedi search)."""
+        if source is not None:
+            query = {**query, "_source": source}
+        response = self.client.search(
+            index=self.index_name,
+            body=query,
+            size=size
+        )
+        return _hits_to_models(self.model_cls, self.index_name, response["hits"]["hits"], partial=source is not None)
+
+    def search(self, query: Dict[str, Any], size: int = 100, source: Any = None) -> List[T]:
+        """Cerca elementi con un query OpenSearch.
+
+        source filtra _source (lista di campi o includes/excludes, vedi
+        models.resolve_projection): i modelli restituiti contengono solo quei campi.
+        """
+        try:
+            return self._search(query, size, source)
         except Exception as e:
             logger.error(f"Error searching index '{self.index_name}': {e}. Query: {query}", exc_info=True)
             return []
@@ -210,83 +539,71 @@ class UserRepository(BaseRepository[User, UserCreate]):
     def __init__(self):
         super().__init__(User, INDEX_USERS)
 
+    def _get_user_in_db(self, field: str, value: str) -> Optional[UserInDB]:
+        """Cerca un utente per campo esatto: UserInDB dal _source del primo hit (una sola richiesta)."""
+        try:
+            response = self.client.search(index=self.index_name, body=_term_query(field, value), size=1)
+            hits = response["hits"]["hits"]
+            if hits:
+                return _user_in_db(hits[0])
+        except Exception as e:
+            logger.error(f"Error fetching user by {field} for UserInDB: {e}", exc_info=True)
+        return None
+
     def get_by_username(self, username: str) -> Optional[UserInDB]:
-        """Ottiene un utente per username."""
+        """Ottiene un utente per username.
+
+        GET realtime sull'ID derivato dallo username; la ricerca serve solo per
+        gli utenti creati con ID casuali (USER_LEGACY_LOOKUP).
+        """
         if not username:
             return None
-
-        query = {
-            "query": {
-                "term": {
-                    "username.keyword": username
-                }
-            }
-        }
-        results = self.search(query, size=1)
-        if results:
-             # We need UserInDB which includes password hash
-             user_data = self.get_by_id(results[0].id)
-             if user_data:
-                 # Re-fetch including potentially excluded fields like password
-                  try:
-                      response = self.client.get(index=self.index_name, id=results[0].id)
-                      if response["found"]:
-                           db_data = response["_source"]
-                           db_data["id"] = response["_id"]
-                           return UserInDB(**db_data)
-                  except Exception as e:
-                      logger.error(f"Error re-fetching user {results[0].id} for UserInDB: {e}")
-        return None
+        try:
+            response = self.client.get(index=self.index_name, id=user_id_for_username(username))
+            if response["_source"].get("username") == username:
+                return _user_in_db(response)
+        except NotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error getting user {username} by derived ID: {e}")
+        if not USER_LEGACY_LOOKUP:
+            return None
+        return self._get_user_in_db("username.keyword", username)
 
     def get_by_email(self, email: str) -> Optional[UserInDB]:
         """Ottiene un utente per email."""
         if not email:
             return None
+        return self._get_user_in_db("email.keyword", email)
 
-        query = {
-            "query": {
-                "term": {
-                    "email.keyword": email
-                }
-            }
-        }
-        results = self.search(query, size=1)
-        if results:
-            # Re-fetch like in get_by_username to get UserInDB
-            try:
-                response = self.client.get(index=self.index_name, id=results[0].id)
-                if response["found"]:
-                    db_data = response["_source"]
-                    db_data["id"] = response["_id"]
-                    return UserInDB(**db_data)
-            except Exception as e:
-                logger.error(f"Error re-fetching user {results[0].id} by email for UserInDB: {e}")
-        return None
+    def create_user(self, user_create: UserCreate, hashed_password: str, consistency: str = WRITE_IMMEDIATE) -> User:
+        """Crea un nuovo utente con password hashata.
 
-    def create_user(self, user_create: UserCreate, hashed_password: str) -> User:
-        """Crea un nuovo utente con password hashata."""
+        L'ID deriva dallo username e la scrittura usa op_type=create: due
+        registrazioni concorrenti con lo stesso username non possono riuscire
+        entrambe. Solleva UserAlreadyExistsError se lo username è già registrato.
+        """
         user_dict = self._to_dict(user_create)
         user_dict["password"] = hashed_password
+        doc_id = _user_document(user_dict, user_create.username)
 
-        # Use base create method
-        # The base `create` method returns the model type T (User), which doesn't have password
-        # We need to handle the dict conversion and ID generation within this method
-        # if we want to ensure the `password` field is indexed.
-
-        doc_id = user_dict.pop("id", None) or generate_id()
-        user_dict['id'] = doc_id # Put ID back for model creation if needed
+        # Gli utenti creati con ID casuali non collidono sull'ID: controllo per username
+        if USER_LEGACY_LOOKUP and self._get_user_in_db("username.keyword", user_create.username):
+            raise UserAlreadyExistsError(user_create.username)
 
         try:
-            self.client.index(
+            response = self.client.index(
                 index=self.index_name,
                 id=doc_id,
                 body=user_dict,
-                refresh="wait_for"
+                op_type="create",
+                refresh=_refresh_param(consistency)
             )
             # Return User model (without password) based on input
-            # Exclude password before creating the User model
             user_dict.pop('password', None)
-            return User(**user_dict)
+            return _model_from_write(User, user_dict, response)
+        except ConflictError:
+            raise UserAlreadyExistsError(user_create.username)
         except Exception as e:
             logger.error(f"Error creating user: {e}", exc_info=True)
             raise
@@ -301,59 +618,82 @@ class PreferenceRepository(BaseRepository[Preference, PreferenceCreate]):
         """Ottiene le preferenze di un utente."""
         if not user_id:
             return []
-        query = {
-            "query": {
-                "term": {
-                    "userId.keyword": user_id # Assuming userId is keyword for exact match
-                }
-            },
-            "sort": [
-                {"createdAt": {"order": "desc"}}
-            ]
-        }
-        return self.search(query)
+        return self.search(_user_documents_query(user_id, "createdAt"))
+
+
+def _cache_key(*parts: Any) -> str:
+    """Chiave di cache normalizzata (JSON con chiavi ordinate)."""
+    return json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
 
 
 class TravelPackageRepository(BaseRepository[TravelPackage, TravelPackageCreate]):
-    """Repository per i pacchetti di viaggio."""
+    """Repository per i pacchetti di viaggio.
+
+    Le letture (per ID, get_all, search, search_page) passano dalla cache
+    condivisa (utils.cache, backend in memoria o Redis); ogni scrittura fatta
+    tramite il repository invalida i namespace per tutti i worker.
+    I risultati in cache sono condivisi: non vanno modificati dai chiamanti.
+    """
     def __init__(self):
         super().__init__(TravelPackage, INDEX_TRAVEL_PACKAGES)
+        self._id_cache = VersionedCache("travel_packages:id", TRAVEL_PACKAGE_CACHE_TTL)
+        self._query_cache = VersionedCache("travel_packages:query", TRAVEL_PACKAGE_CACHE_TTL)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Contatori delle cache del repository."""
+        return {"by_id": self._id_cache.stats(), "by_query": self._query_cache.stats()}
+
+    def invalidate(self) -> None:
+        """Invalida tutte le letture in cache dei pacchetti."""
+        self._id_cache.invalidate()
+        self._query_cache.invalidate()
+
+    def _fetch_by_id(self, id: str) -> Optional[TravelPackage]:
+        return self._id_cache.get_or_load(id, lambda: super(TravelPackageRepository, self)._fetch_by_id(id))
+
+    def _search(self, query: Dict[str, Any], size: int, source: Any = None) -> List[TravelPackage]:
+        key = _cache_key("search", query, size, source)
+        return self._query_cache.get_or_load(key, lambda: super(TravelPackageRepository, self)._search(query, size, source))
+
+    def search_page(self, query: Optional[Dict[str, Any]] = None, size: int = 100, cursor: Optional[str] = None,
+                    raw: bool = False, track_total_hits: bool = False, source: Any = None) -> SearchPage:
+        key = _cache_key("page", query, size, cursor, raw, track_total_hits, source)
+        return self._query_cache.get_or_load(key, lambda: super(TravelPackageRepository, self).search_page(
+            query, size=size, cursor=cursor, raw=raw, track_total_hits=track_total_hits, source=source))
+
+    # Le scritture invalidano entrambi i namespace: cambiare versione (invece di
+    # cancellare la singola chiave) scarta anche i caricamenti già in corso
+    def create(self, obj_in: TravelPackageCreate, consistency: str = WRITE_IMMEDIATE) -> TravelPackage:
+        try:
+            return super().create(obj_in, consistency=consistency)
+        finally:
+            self.invalidate()
+
+    def update(self, id: str, obj_in: Dict[str, Any], consistency: str = WRITE_IMMEDIATE) -> Optional[TravelPackage]:
+        try:
+            return super().update(id, obj_in, consistency=consistency)
+        finally:
+            self.invalidate()
+
+    def delete(self, id: str, consistency: str = WRITE_IMMEDIATE) -> bool:
+        try:
+            return super().delete(id, consistency=consistency)
+        finally:
+            self.invalidate()
+
+    def _bulk(self, actions: Iterable[BulkAction], consistency: str) -> List[BulkItemResult]:
+        try:
+            return super()._bulk(actions, consistency)
+        finally:
+            self.invalidate()
 
     def get_by_category(self, category: str) -> List[TravelPackage]:
         """Ottiene i pacchetti di viaggio per categoria."""
-        query = {
-            "query": {
-                "match": {
-                    "categories": category
-                }
-            }
-        }
-        return self.search(query)
+        return self.search(_category_query(category))
 
     def get_recommended_packages(self, preferences: Preference) -> List[TravelPackage]:
         """Ottiene i pacchetti di viaggio raccomandati in base alle preferenze."""
-        # Criterio di raccomandazione basato sugli interessi dell'utente
-        if not preferences or not preferences.interests:
-            # Se non ci sono preferenze, restituisci pacchetti consigliati generali
-            query = {
-                "query": {
-                    "term": {
-                        "isRecommended": True
-                    }
-                }
-            }
-        else:
-            # Altrimenti, usa gli interessi dell'utente per consigliare pacchetti
-            query = {
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"terms": {"categories": preferences.interests}}
-                        ],
-                        "minimum_should_match": 1
-                    }
-                }
-            }
+        query = _recommended_packages_query(preferences)
         return self.search(query, size=3)
 
 
@@ -366,25 +706,23 @@ class BookingRepository(BaseRepository[Booking, BookingCreate]):
         """Ottiene le prenotazioni di un utente."""
         if not user_id:
             return []
-        query = {
-            "query": {
-                "term": {
-                    "userId.keyword": user_id # Assuming userId is keyword
-                }
-            },
-            "sort": [
-                {"bookingDate": {"order": "desc"}}
-            ]
-        }
-        return self.search(query)
+        return self.search(_user_documents_query(user_id, "bookingDate"))
 
-    def update_status(self, id: str, status: str) -> Optional[Booking]:
+    def update_status(self, id: str, status: str, consistency: str = WRITE_IMMEDIATE) -> Optional[Booking]:
         """Aggiorna lo stato di una prenotazione."""
-        return self.update(id, {"status": status})
+        return self.update(id, {"status": status}, consistency=consistency)
 
-    def update_payment_status(self, id: str, payment_status: str) -> Optional[Booking]:
+    def update_payment_status(self, id: str, payment_status: str, consistency: str = WRITE_IMMEDIATE) -> Optional[Booking]:
         """Aggiorna lo stato di pagamento di una prenotazione."""
-        return self.update(id, {"paymentStatus": payment_status})
+        return self.update(id, {"paymentStatus": payment_status}, consistency=consistency)
+
+    def bulk_update_status(self, changes: Iterable[Tuple[str, Dict[str, Any]]], consistency: str = WRITE_ASYNC) -> List[BulkItemResult]:
+        """Aggiorna in blocco status/paymentStatus (es. riconciliazione dei pagamenti Stripe)."""
+        allowed = {"status", "paymentStatus"}
+        return self.bulk_update(
+            ((id, {k: v for k, v in fields.items() if k in allowed}) for id, fields in changes),
+            consistency=consistency
+        )
 
 
 # NEW: Repository for Saved Packages
@@ -393,26 +731,16 @@ class SavedPackageRepository(BaseRepository[SavedPackage, SavedPackage]): # Use
     def __init__(self):
         super().__init__(SavedPackage, INDEX_SAVED_PACKAGES)
 
-    def find_by_user(self, user_id: str, size: int = 100) -> List[SavedPackage]:
-        """Finds saved packages by user ID."""
+    def find_by_user(self, user_id: str, size: int = 100, source: Any = None) -> List[SavedPackage]:
+        """Finds saved packages by user ID (source: optional _source projection)."""
         if not user_id:
             return []
-        query = {
-            "query": {
-                "term": {
-                    "userId.keyword": user_id # Ensure userId field is mapped as keyword for exact match
-                }
-            },
-            "sort": [
-                 # Sort by savedAt descending to show newest first
-                {"savedAt": {"order": "desc"}} 
-            ]
-        }
-        return self.search(query, size=size)
+        # Sort by savedAt descending to show newest first
+        return self.search(_user_documents_query(user_id, "savedAt"), size=size, source=source)
         
-    def get_by_user_id(self, user_id: str) -> List[SavedPackage]:
+    def get_by_user_id(self, user_id: str, source: Any = None) -> List[SavedPackage]:
         """Ottiene i pacchetti salvati di un utente (alias di find_by_user)."""
-        return self.find_by_user(user_id)
+        return self.find_by_user(user_id, source=source)
 
     def delete_for_user(self, package_id: str, user_id: str) -> bool:
         """Deletes a package only if it belongs to the specified user."""
@@ -422,17 +750,8 @@ class SavedPackageRepository(BaseRepository[SavedPackage, SavedPackage]): # Use
             # Use delete_by_query to ensure we only delete if userId matches
             response = self.client.delete_by_query(
                 index=self.index_name,
-                body={
-                    "query": {
-                        "bool": {
-                            "filter": [
-                                {"term": {"_id": package_id}},
-                                {"term": {"userId.keyword": user_id}}
-                            ]
-                        }
-                    }
-                },
-                refresh="wait_for"
+                body=_owned_document_query(package_id, user_id),
+                refresh=True  # delete_by_query non accetta refresh=wait_for
             )
             deleted_count = response.get("deleted", 0)
             if deleted_count > 0:
@@ -445,47 +764,15 @@ class SavedPackageRepository(BaseRepository[SavedPackage, SavedPackage]): # Use
             logger.error(f"Error deleting saved package {package_id} for user {user_id}: {e}", exc_info=True)
             return False
 
-    def create(self, data: Dict) -> Any:
-        """Crea un nuovo documento."""
-        try:
-            # Genera un ID se non è presente
-            if "id" not in data:
-                data["id"] = generate_id()
-
-            doc_id = data["id"]
-
-            # Gestisci campi user_id e userId
-            if "user_id" in data and "userId" not in data:
-                data["userId"] = data["user_id"]
+    def create(self, data: Any, consistency: str = WRITE_IMMEDIATE) -> SavedPackage:
+        """Crea un nuovo pacchetto salvato (da modello o dizionario)."""
+        data = self._to_dict(data)
 
-            # Invia documento a OpenSearch
-            result = self.client.index(
-                index=self.index_name,
-                id=doc_id,
-                body=data,
-                refresh="wait_for"  # Aspetta che il documento sia indicizzato
-            )
+        # Gestisci campi user_id e userId
+        if "user_id" in data and "userId" not in data:
+            data["userId"] = data["user_id"]
 
-            logger.info(f"Document created/updated with ID '{doc_id}' in index '{self.index_name}'. Result: {result['result']}")
-
-            # Rileggi il documento per verifica
-            try:
-                obj_dict = self.get_by_id(doc_id)
-                if obj_dict:
-                    return self.model_cls(**obj_dict)
-                else:
-                    logger.error(f"Failed to retrieve document immediately after creation/update. ID: {doc_id}, Index: {self.index_name}")
-                    return self.model_cls(**data)
-
-            except Exception as e:
-                logger.error(f"Failed to retrieve document immediately after creation/update. ID: {doc_id}, Index: {self.index_name}")
-                logger.error(str(e))
-                # Continuiamo comunque, forse è solo un problema di timing con l'indicizzazione
-                return self.model_cls(**data)
-
-        except Exception as e:
-            logger.error(f"Error creating document in index '{self.index_name}': {str(e)}. Data: {data}")
-            raise
+        return super().create(data, consistency=consistency)
 
 def get_saved_package_by_id(index_name: str, doc_id: str, client) -> Optional[Dict]:
     """Recupera un documento dal suo ID."""
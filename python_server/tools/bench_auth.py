@@ -0,0 +1,84 @@
+"""Microbenchmark del costo di autenticazione per richiesta di login_required.
+
+Confronta la verifica precedente (decodifica non verificata, header, verifica
+PyJWT e stampe su stdout a ogni richiesta) con decode_token: prima richiesta
+con un token (verifica) e richieste successive (servite dalla cache dei token
+verificati). Le stampe della versione precedente vanno in un buffer in memoria,
+quindi il suo costo reale su un terminale o su un log è più alto.
+
+Uso:
+    python -m python_server.tools.bench_auth --requests 20000
+"""
+import argparse
+import contextlib
+import io
+import time
+from datetime import timedelta
+
+import jwt
+from flask import Flask
+
+from ..utils import auth
+
+
+def legacy_decode(token):
+    """Percorso di verifica precedente di login_required, tenuto qui come riferimento."""
+    print(f"Received token: {token[:10]}...")
+    unverified_payload = jwt.decode(token, options={"verify_signature": False}, algorithms=[auth.ALGORITHM])
+    print(f"Unverified payload: {unverified_payload}")
+    print(f"Token header: {jwt.get_unverified_header(token)}")
+    print(f"Attempting to decode token with SECRET_KEY: {auth.SECRET_KEY[:3]}...")
+    payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    print("PyJWT decode successful")
+    user_id = payload.get("user_id") or payload.get("sub") or payload.get("id")
+    print(f"Token processed, user_id: {user_id}, payload keys: {list(payload.keys())}")
+    return payload
+
+
+def _per_request(fn, tokens):
+    started = time.perf_counter()
+    for token in tokens:
+        fn(token)
+    return (time.perf_counter() - started) / len(tokens) * 1e6
+
+
+def _view(current_user=None):
+    return current_user
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo di autenticazione per richiesta")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100, help="token distinti (uno per utente)")
+    args = parser.parse_args()
+
+    tokens = [
+        auth.create_access_token({"sub": f"user{n}", "user_id": f"id-{n}"}, expires_delta=timedelta(hours=1))
+        for n in range(args.users)
+    ]
+    stream = [tokens[n % len(tokens)] for n in range(args.requests)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = _per_request(legacy_decode, stream)
+    auth._verified_tokens.clear()
+    first = _per_request(auth.decode_token, tokens)
+    cached = _per_request(auth.decode_token, stream)
+
+    # Decoratore completo dentro una richiesta Flask (header, sessione, risposta)
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "bench"
+    protected = auth.login_required(_view)
+    headers = {"Authorization": f"Bearer {tokens[0]}"}
+    with app.test_request_context("/", headers=headers):
+        decorated = _per_request(lambda _: protected(), stream)
+
+    print(f"{'percorso':<46} {'µs/richiesta':>14}")
+    print(f"{'prima: verifica precedente (+ print)':<46} {legacy:>14.1f}")
+    print(f"{'dopo: decode_token, primo uso del token':<46} {first:>14.1f}")
+    print(f"{'dopo: decode_token, token già verificato':<46} {cached:>14.1f}")
+    print(f"{'dopo: login_required completo (cache calda)':<46} {decorated:>14.1f}")
+    print(f"cache: {auth.get_token_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark di TravelApiClient.format_results_as_itinerary su risultati sintetici.
+
+Confronta la versione precedente (tre passaggi sui pacchetti), quella a un solo
+passaggio e lo streaming JSON (iter_itinerary_json), riportando throughput
+(pacchetti/s) e picco di memoria allocata (tracemalloc) per ogni dimensione.
+
+Uso:
+    python -m python_server.tools.bench_itinerary --sizes 1000 10000 50000 --repeat 3
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from ..utils.travel_api_client import TravelApiClient
+
+
+def synthetic_results(size):
+    """Risultati finti con la forma di /api/search/<job_id>/result."""
+    cities = ["Roma", "Firenze", "Venezia", "Napoli", "Milano", "Palermo", "Torino", "Bologna"]
+    return {
+        "packages": [
+            {
+                "id": f"pkg-{n}",
+                "title": f"Pacchetto {n}",
+                "destination": cities[n % len(cities)],
+                "imageUrl": f"https://example.com/{n}.jpg",
+                "price": 500 + n % 1000,
+                "rating": str(3 + n % 3),
+                "durationNights": 2 + n % 6,
+                "accommodationName": f"Hotel {n}",
+                "accommodationType": "Hotel",
+                "experiences": [f"Esperienza {n}-{k}" for k in range(3)],
+            }
+            for n in range(size)
+        ]
+    }
+
+
+def legacy_format(results_data):
+    """Implementazione precedente, tenuta qui come riferimento per il confronto."""
+    destinations = []
+    accommodations = []
+    experiences = []
+    if "packages" in results_data:
+        destinations_set = set()
+        for pkg in results_data["packages"]:
+            if "destination" in pkg and pkg["destination"]:
+                destinations_set.add(pkg["destination"])
+        destinations = list(destinations_set)
+        for pkg in results_data["packages"]:
+            if pkg.get("accommodationName") and pkg.get("accommodationType"):
+                accommodations.append({
+                    "name": pkg.get("accommodationName", ""),
+                    "type": pkg.get("accommodationType", ""),
+                    "location": pkg.get("destination", ""),
+                    "description": f"Sistemazione prevista nel pacchetto {pkg.get('title', '')}",
+                    "rating": pkg.get("rating", ""),
+                    "price": pkg.get("price", 0),
+                    "nights": pkg.get("durationNights", 0),
+                    "imageUrl": pkg.get("imageUrl", "")
+                })
+        for pkg in results_data["packages"]:
+            if pkg.get("experiences"):
+                for exp in pkg.get("experiences", []):
+                    experiences.append({
+                        "name": exp,
+                        "location": pkg.get("destination", ""),
+                        "description": f"Esperienza inclusa nel pacchetto {pkg.get('title', '')}",
+                        "duration": "Variabile",
+                        "price": "Incluso nel pacchetto"
+                    })
+    return {"destinations": destinations, "accommodations": accommodations, "experiences": experiences}
+
+
+def _serialize(itinerary):
+    return len(json.dumps(itinerary))
+
+
+def _stream(results_data):
+    return sum(len(chunk) for chunk in TravelApiClient.iter_itinerary_json(results_data))
+
+
+# Ogni variante produce il JSON completo, come farebbe una risposta HTTP
+VARIANTS = {
+    "legacy (3 passaggi) + json.dumps": lambda data: _serialize(legacy_format(data)),
+    "un passaggio + json.dumps": lambda data: _serialize(TravelApiClient.format_results_as_itinerary(data)),
+    "streaming iter_itinerary_json": _stream,
+}
+
+
+def measure(fn, data, repeat):
+    """Miglior tempo su repeat esecuzioni e picco di memoria di un'esecuzione."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della formattazione dell'itinerario")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pacchetti':>10}  {'variante':<36} {'tempo ms':>10} {'pacchetti/s':>13} {'picco MiB':>10}")
+    for size in args.sizes:
+        data = synthetic_results(size)
+        for name, fn in VARIANTS.items():
+            elapsed, peak = measure(fn, data, args.repeat)
+            print(f"{size:>10}  {name:<36} {elapsed * 1000:>10.1f} {size / elapsed:>13,.0f} {peak / 2 ** 20:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Migra gli utenti creati con ID casuali agli ID derivati dallo username.
+
+Per ogni utente il cui ID non è user_id_for_username(username):
+copia il documento sull'ID derivato (op_type=create), aggiorna userId (e
+user_id) di preferenze, prenotazioni e pacchetti salvati, poi elimina il
+documento vecchio. Un utente il cui ID derivato è già occupato viene solo
+segnalato. Lo script si può rilanciare: gli utenti già migrati vengono saltati.
+
+Finita la migrazione (nessun utente da migrare con --dry-run) si può
+impostare USER_LEGACY_LOOKUP=false. I token emessi prima della migrazione
+contengono ancora l'ID vecchio: gli utenti migrati devono rifare il login.
+
+Uso:
+    python -m python_server.tools.migrate_user_ids --dry-run
+    python -m python_server.tools.migrate_user_ids
+"""
+import argparse
+import logging
+
+from opensearchpy.exceptions import ConflictError
+
+from ..config.settings import INDEX_USERS, INDEX_PREFERENCES, INDEX_BOOKINGS, INDEX_SAVED_PACKAGES
+from ..models.repositories import UserRepository
+from ..utils.auth import user_id_for_username
+
+logger = logging.getLogger(__name__)
+
+# Indici con documenti che riferiscono l'utente per ID
+_USER_REFERENCES = (INDEX_PREFERENCES, INDEX_BOOKINGS, INDEX_SAVED_PACKAGES)
+
+_REASSIGN_SCRIPT = (
+    "ctx._source.userId = params.new_id;"
+    " if (ctx._source.containsKey('user_id')) { ctx._source.user_id = params.new_id; }"
+)
+
+
+def _reassign(client, old_id: str, new_id: str) -> int:
+    """Sposta i documenti collegati da old_id a new_id; restituisce quanti ne ha aggiornati."""
+    updated = 0
+    for index in _USER_REFERENCES:
+        response = client.update_by_query(
+            index=index,
+            body={
+                "query": {"bool": {"should": [
+                    {"term": {"userId.keyword": old_id}},
+                    {"term": {"user_id.keyword": old_id}},
+                ], "minimum_should_match": 1}},
+                "script": {"source": _REASSIGN_SCRIPT, "lang": "painless", "params": {"new_id": new_id}},
+            },
+            conflicts="proceed",
+            refresh=True,
+        )
+        updated += response.get("updated", 0)
+    return updated
+
+
+def migrate(dry_run: bool = False) -> dict:
+    repo = UserRepository()
+    client = repo.client
+    counts = {"scanned": 0, "migrated": 0, "conflicts": 0, "references": 0}
+    for user in repo.iter_all(raw=True):
+        counts["scanned"] += 1
+        old_id, username = user["id"], user.get("username")
+        if not username:
+            continue
+        new_id = user_id_for_username(username)
+        if old_id == new_id:
+            continue
+        if dry_run:
+            logger.info(f"Da migrare: {username} ({old_id} -> {new_id})")
+            counts["migrated"] += 1
+            continue
+        user["id"] = new_id
+        try:
+            client.index(index=INDEX_USERS, id=new_id, body=user, op_type="create", refresh=True)
+        except ConflictError:
+            logger.warning(f"ID derivato {new_id} già occupato: utente {username} ({old_id}) non migrato")
+            counts["conflicts"] += 1
+            continue
+        counts["references"] += _reassign(client, old_id, new_id)
+        client.delete(index=INDEX_USERS, id=old_id, refresh=True)
+        counts["migrated"] += 1
+        logger.info(f"Migrato {username}: {old_id} -> {new_id}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra gli utenti agli ID derivati dallo username")
+    parser.add_argument("--dry-run", action="store_true", help="elenca gli utenti da migrare senza modificarli")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    counts = migrate(dry_run=args.dry_run)
+    action = "da migrare" if args.dry_run else "migrati"
+    print(f"Utenti esaminati: {counts['scanned']}, {action}: {counts['migrated']}, "
+          f"conflitti: {counts['conflicts']}, documenti collegati aggiornati: {counts['references']}")
+    if not args.dry_run and counts["conflicts"] == 0:
+        print("Nessun utente con ID casuale rimasto: si può impostare USER_LEGACY_LOOKUP=false")
+
+
+if __name__ == "__main__":
+    main()
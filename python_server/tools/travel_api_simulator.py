@@ -0,0 +1,224 @@
+"""Simulatore locale dell'API di viaggio esterna, per benchmark end-to-end offline.
+
+Espone lo stesso protocollo usato da TravelApiClient:
+
+    POST /api/auth/token                 -> {"access_token": <JWT>}
+    POST /api/search                     -> {"job_id", "status": "PENDING"}
+    GET  /api/search/<job_id>            -> {"job_id", "status": "RUNNING" | "COMPLETED"}
+    GET  /api/search/<job_id>/result     -> {"packages": [...]}   (anche /results)
+    GET  /api/search/<job_id>/itinerary  -> {"destinations", "accommodations", "experiences"}
+
+Latenza e tasso di errore sono configurabili; con lo stesso --seed la sequenza
+di latenze ed errori e i pacchetti restituiti sono sempre gli stessi.
+
+Uso:
+    python -m python_server.tools.travel_api_simulator --port 8000 --latency 0.2 --failure-rate 0.05
+    TRAVEL_API_URL=http://localhost:8000 python python_server/run.py
+"""
+import argparse
+import hashlib
+import itertools
+import logging
+import random
+import threading
+import time
+
+import jwt
+from flask import Flask, jsonify, request
+
+from ..utils.travel_api_client import TravelApiClient
+
+logger = logging.getLogger(__name__)
+
+_CITIES = ["Roma", "Firenze", "Venezia", "Napoli", "Milano", "Palermo", "Torino", "Bologna"]
+_EXPERIENCES = ["Tour guidato", "Degustazione", "Corso di cucina", "Museo", "Escursione", "Giro in barca"]
+
+
+class Simulator:
+    """Stato del simulatore: token emessi, job di ricerca e generatore pseudo-casuale."""
+
+    def __init__(self, latency=0.1, jitter=0.05, failure_rate=0.0, polls=2, token_ttl=3600,
+                 seed=42, secret="yookve-travel-api-simulator-signing-key", packages=6):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.polls = polls
+        self.token_ttl = token_ttl
+        self.secret = secret
+        self.packages = packages
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self.requests = 0
+        self.failures = 0
+
+    def _draw(self):
+        """Latenza e fallimento della prossima richiesta (sequenza deterministica per seed)."""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            return delay, failed
+
+    def simulate(self):
+        """Attende la latenza simulata; restituisce una risposta 503 se la richiesta deve fallire."""
+        delay, failed = self._draw()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return jsonify({"detail": "Simulated upstream failure"}), 503
+        return None
+
+    def issue_token(self, username):
+        now = int(time.time())
+        return jwt.encode({"sub": username or "simulator", "iat": now, "exp": now + self.token_ttl},
+                          self.secret, algorithm="HS256")
+
+    def authorized(self):
+        token = request.headers.get("Authorization", "")[len("Bearer "):]
+        try:
+            jwt.decode(token, self.secret, algorithms=["HS256"])
+            return True
+        except jwt.PyJWTError:
+            return False
+
+    def create_job(self, search_input):
+        job_id = f"sim-{next(self._ids)}"
+        city = ((search_input or {}).get("luoghi_da_non_perdere") or {}).get("city") or ""
+        with self._lock:
+            self._jobs[job_id] = {"polls": 0, "city": city}
+        return job_id
+
+    def poll(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job["polls"] += 1
+            return "COMPLETED" if job["polls"] >= self.polls else "RUNNING"
+
+    def is_completed(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job is not None and job["polls"] >= self.polls
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "failures": self.failures, "jobs": len(self._jobs)}
+
+    def result(self, job_id):
+        """Pacchetti deterministici: dipendono solo dal job_id e dalla città cercata."""
+        with self._lock:
+            city = self._jobs[job_id]["city"]
+        rnd = random.Random(hashlib.sha256(f"{job_id}|{city}".encode()).hexdigest())
+        packages = []
+        for n in range(self.packages):
+            destination = city or rnd.choice(_CITIES)
+            nights = rnd.randint(2, 7)
+            packages.append({
+                "id": f"{job_id}-{n + 1}",
+                "title": f"{destination}: pacchetto {n + 1}",
+                "description": f"Pacchetto simulato a {destination}",
+                "destination": destination,
+                "imageUrl": f"https://source.unsplash.com/random/800x600/?{destination.lower()}",
+                "price": rnd.randrange(400, 3000, 10),
+                "rating": str(rnd.randint(3, 5)),
+                "durationDays": nights + 1,
+                "durationNights": nights,
+                "accommodationName": f"Hotel {destination} {n + 1}",
+                "accommodationType": rnd.choice(["Hotel", "B&B", "Resort"]),
+                "experiences": rnd.sample(_EXPERIENCES, 2),
+            })
+        return {"packages": packages}
+
+
+def create_simulator_app(simulator=None):
+    """App Flask del simulatore (anche per avviarla in un thread dagli script di benchmark)."""
+    simulator = simulator or Simulator()
+    app = Flask(__name__)
+    app.config["simulator"] = simulator
+
+    @app.route("/api/auth/token", methods=["POST"])
+    def token():
+        failure = simulator.simulate()
+        if failure:
+            return failure
+        return jsonify({"access_token": simulator.issue_token(request.form.get("username")),
+                        "token_type": "bearer"})
+
+    @app.route("/api/search", methods=["POST"])
+    def search():
+        if not simulator.authorized():
+            return jsonify({"detail": "Invalid token"}), 401
+        failure = simulator.simulate()
+        if failure:
+            return failure
+        return jsonify({"job_id": simulator.create_job(request.get_json(silent=True)), "status": "PENDING"})
+
+    @app.route("/api/search/<job_id>", methods=["GET"])
+    def status(job_id):
+        if not simulator.authorized():
+            return jsonify({"detail": "Invalid token"}), 401
+        failure = simulator.simulate()
+        if failure:
+            return failure
+        job_status = simulator.poll(job_id)
+        if job_status is None:
+            return jsonify({"detail": "Job not found"}), 404
+        return jsonify({"job_id": job_id, "status": job_status})
+
+    @app.route("/api/search/<job_id>/result", methods=["GET"])
+    @app.route("/api/search/<job_id>/results", methods=["GET"])
+    def result(job_id):
+        if not simulator.authorized():
+            return jsonify({"detail": "Invalid token"}), 401
+        failure = simulator.simulate()
+        if failure:
+            return failure
+        if not simulator.is_completed(job_id):
+            return jsonify({"detail": "Job not completed"}), 404
+        return jsonify(simulator.result(job_id))
+
+    @app.route("/api/search/<job_id>/itinerary", methods=["GET"])
+    def itinerary(job_id):
+        if not simulator.authorized():
+            return jsonify({"detail": "Invalid token"}), 401
+        failure = simulator.simulate()
+        if failure:
+            return failure
+        if not simulator.is_completed(job_id):
+            return jsonify({"detail": "Job not completed"}), 404
+        return jsonify(TravelApiClient.format_results_as_itinerary(simulator.result(job_id)))
+
+    @app.route("/_stats", methods=["GET"])
+    def stats():
+        return jsonify(simulator.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulatore locale dell'API di viaggio esterna")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.1, help="latenza media per richiesta (secondi)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="variazione massima della latenza (secondi)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="quota di richieste che rispondono 503")
+    parser.add_argument("--polls", type=int, default=2, help="poll di stato prima che un job sia COMPLETED")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="durata dei token emessi (secondi)")
+    parser.add_argument("--packages", type=int, default=6, help="pacchetti per risultato")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = Simulator(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                          polls=args.polls, token_ttl=args.token_ttl, seed=args.seed, packages=args.packages)
+    logger.info(f"Simulatore API di viaggio su http://{args.host}:{args.port}")
+    create_simulator_app(simulator).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
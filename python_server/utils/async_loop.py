@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Event loop condiviso dal processo: gira in un thread dedicato così che i client
+# asincroni (AsyncOpenSearch, aiohttp) mantengano un solo pool di connessioni
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_event_loop():
+    """Restituisce l'event loop condiviso, avviandolo alla prima chiamata."""
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=_run_loop, args=(loop,), name="yookve-async-loop", daemon=True)
+                thread.start()
+                _loop_thread = thread
+                _loop = loop
+                logger.info("Event loop condiviso avviato")
+    return _loop
+
+
+def run_sync(coro, timeout=None):
+    """Esegue una coroutine sull'event loop condiviso e ne attende il risultato.
+
+    Da usare nei thread delle richieste Flask al posto di asyncio.run, che
+    creerebbe (e chiuderebbe) un nuovo loop con nuove connessioni a ogni richiesta.
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync non può essere chiamata dall'event loop condiviso: usare await")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return future.result(timeout)
@@ -1,11 +1,23 @@
 import os
+import time
 import uuid
+import logging
 from datetime import datetime, timedelta
+from functools import wraps
 from typing import Optional, Dict, Any
-from jose import jwt
+import jwt
+from flask import session, jsonify, request
 from passlib.context import CryptContext
 import hashlib
 import binascii
+from ..config.settings import (
+    AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_DEFAULT_TTL, AUTH_ALLOW_UNVERIFIED_TOKENS, PASSWORD_BCRYPT_ROUNDS
+)
+from .cache import TTLCache, MISSING
+from .password_pool import get_password_pool
+from .timing import span, SPAN_PASSWORD
+
+logger = logging.getLogger(__name__)
 
 # Constants
 SECRET_KEY = os.getenv("SECRET_KEY", "yookve-travel-app-secret")
@@ -15,8 +27,15 @@ def generate_id():
     """Genera un ID univoco."""
     return str(uuid.uuid4())
 
+# Namespace degli ID utente derivati dallo username
+USER_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "yookve:users")
+
+def user_id_for_username(username: str) -> str:
+    """ID del documento utente derivato dallo username (UUID v5): lo stesso username dà sempre lo stesso ID."""
+    return str(uuid.uuid5(USER_ID_NAMESPACE, username))
+
 # Password context instance
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica la password. Supporta sia il formato bcrypt che il formato personalizzato JavaScript."""
@@ -45,16 +64,37 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
             return supplied_hex == hashed
         
         # Fallback: confronto diretto (solo per testing)
-        print("WARNING: Using direct password comparison. Update hash format.")
+        logger.warning("Confronto diretto della password: aggiornare il formato dell'hash")
         return plain_password == hashed_password
     except Exception as e:
-        print(f"Password verification error: {str(e)}")
+        logger.error(f"Password verification error: {str(e)}")
         return False
 
 def get_password_hash(password: str) -> str:
     """Genera un hash per la password utilizzando bcrypt."""
     return pwd_context.hash(password)
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True se l'hash va rigenerato: formato legacy (scrypt, testo in chiaro) o costo bcrypt diverso da quello corrente."""
+    if not hashed_password:
+        return False
+    if not pwd_context.identify(hashed_password):
+        return True
+    return pwd_context.needs_update(hashed_password)
+
+# Le stesse operazioni nel pool dedicato (utils.password_pool): sollevano
+# PasswordPoolFull se il pool è saturo, da trasformare in un 503
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password eseguita nel pool delle password, senza bloccare l'event loop."""
+    with span(SPAN_PASSWORD):
+        return await get_password_pool().run_async(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash eseguita nel pool delle password, senza bloccare l'event loop."""
+    with span(SPAN_PASSWORD):
+        return await get_password_pool().run_async(get_password_hash, password)
+
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """Crea un token JWT di accesso."""
     to_encode = data.copy()
@@ -69,10 +109,44 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     
     return encoded_jwt
 
-from functools import wraps
-from flask import session, jsonify, request
-import jwt
-from jwt import PyJWTError
+# Payload dei token con firma già verificata, fino al loro exp: le richieste
+# successive con lo stesso token non ripetono decodifica e verifica HMAC
+_verified_tokens = TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_DEFAULT_TTL, name="auth_tokens")
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Payload di un token JWT, verificandone firma e scadenza (una sola volta per token).
+
+    Solleva jwt.PyJWTError se il token non è valido. Solo con DEBUG e
+    AUTH_ALLOW_UNVERIFIED_TOKENS (disattivato di default) un token ben formato
+    che non supera la verifica viene accettato con il payload non verificato:
+    comportamento di sviluppo, registrato come errore e mai messo in cache.
+    """
+    payload = _verified_tokens.get(token)
+    if payload is not MISSING:
+        return payload
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError as e:
+        if not AUTH_ALLOW_UNVERIFIED_TOKENS:
+            raise
+        # Un token malformato solleva DecodeError anche senza verifica
+        payload = jwt.decode(token, options={"verify_signature": False}, algorithms=[ALGORITHM])
+        logger.error(f"Token non verificato ({e.__class__.__name__}): uso il payload non verificato "
+                     f"(AUTH_ALLOW_UNVERIFIED_TOKENS, solo sviluppo)")
+        return payload
+
+    exp = payload.get("exp")
+    ttl = exp - time.time() if exp else AUTH_TOKEN_CACHE_DEFAULT_TTL
+    if ttl > 0:
+        _verified_tokens.set(token, payload, ttl=ttl)
+    return payload
+
+
+def get_token_cache_stats() -> Dict[str, Any]:
+    """Hit e miss della cache dei token verificati."""
+    return _verified_tokens.stats()
+
 
 def login_required(f):
     """Decorator to protect routes that require authentication, passing user data."""
@@ -85,66 +159,33 @@ def login_required(f):
         # Try to verify the JWT token in the Authorization header
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            
-            # Print token for debugging
-            print(f"Received token: {token[:10]}...")
-            
+            token = auth_header[len("Bearer "):]
             try:
-                # Tenta di decodificare il token senza verifica della firma
-                options = {"verify_signature": False}
-                import jwt as pyjwt
-                unverified_payload = pyjwt.decode(token, options=options, algorithms=[ALGORITHM])
-                print(f"Unverified payload: {unverified_payload}")
-                print(f"Token header: {pyjwt.get_unverified_header(token)}")
-                
-                # Ora prova con la verifica
-                print(f"Attempting to decode token with SECRET_KEY: {SECRET_KEY[:3]}...")
-                try:
-                    # Try decoding with PyJWT
-                    payload = pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                    print("PyJWT decode successful")
-                except Exception as jwt_error:
-                    print(f"PyJWT decode failed: {str(jwt_error)}, trying with jose.jwt")
-                    try:
-                        # Fallback to jose.jwt if PyJWT fails
-                        from jose import jwt as jose_jwt
-                        payload = jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                        print("jose.jwt decode successful")
-                    except Exception as jose_error:
-                        print(f"Jose.jwt decode failed: {str(jose_error)}")
-                        # Per il funzionamento temporaneo, accetta il token senza verifica
-                        print(f"Both JWT libraries failed. Using unverified payload for debugging purposes ONLY.")
-                        payload = unverified_payload
-                
-                # Extract user_id from the payload - check both common fields
-                user_id = payload.get("user_id") or payload.get("sub") or payload.get("id")
-                print(f"Token processed, user_id: {user_id}, payload keys: {list(payload.keys())}")
-                
-                if user_id:
-                    # Create a user object (minimal) from the payload
-                    current_user = {"_id": user_id, "username": payload.get("sub") or payload.get("username")}
-                else:
-                    print("Invalid token structure: missing user identifier")
-                    return jsonify({
-                        "success": False,
-                        "message": "Invalid token structure: missing user identifier"
-                    }), 401
-            except Exception as e:
-                print(f"Token validation error: {str(e)}")
-                import traceback
-                print(traceback.format_exc())
+                payload = decode_token(token)
+            except jwt.PyJWTError as e:
+                logger.info(f"Token rifiutato: {e.__class__.__name__}: {str(e)}")
                 return jsonify({
                     "success": False,
                     "message": "Invalid token",
                     "error": str(e)
                 }), 401
+
+            # Extract user_id from the payload - check both common fields
+            user_id = payload.get("user_id") or payload.get("sub") or payload.get("id")
+            if user_id:
+                # Create a user object (minimal) from the payload
+                current_user = {"_id": user_id, "username": payload.get("sub") or payload.get("username")}
+            else:
+                logger.info(f"Token senza identificativo utente, chiavi: {list(payload.keys())}")
+                return jsonify({
+                    "success": False,
+                    "message": "Invalid token structure: missing user identifier"
+                }), 401
         elif user_id:
             # If user is only authenticated with session get the user_id
-            print(f"Using session-based authentication, user_id: {user_id}")
             current_user = {"_id": user_id, "username": "session_user"}
         else:
-            print("No authentication provided")
+            logger.debug("Richiesta senza autenticazione")
             return jsonify({
                 "success": False,
                 "message": "Unauthorized: No authentication provided"
@@ -152,7 +193,7 @@ def login_required(f):
 
         # If current_user is still None after all checks, reject the request
         if not current_user:
-            print("Authentication failed: current_user is None")
+            logger.debug("Autenticazione non riuscita: current_user assente")
             return jsonify({
                 "success": False,
                 "message": "Unauthorized: Authentication failed"
@@ -0,0 +1,439 @@
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+try:
+    import redis
+except ImportError:  # backend Redis opzionale
+    redis = None
+
+from ..config.settings import (
+    CACHE_BACKEND, REDIS_URL, CACHE_KEY_PREFIX, CACHE_MEMORY_MAXSIZE, CACHE_VERSION_TTL,
+    CACHE_LOCK_TTL, CACHE_LOCK_WAIT
+)
+from .metrics import cache_lookup_counters
+
+logger = logging.getLogger(__name__)
+
+# Valore restituito da get quando la chiave non è in cache
+MISSING = object()
+
+
+def _no_metric() -> None:
+    pass
+
+
+class TTLCache:
+    """Cache in memoria LRU con scadenza (TTL), sicura tra thread.
+
+    Ogni invalidazione incrementa una generazione: i caricamenti iniziati prima
+    dell'invalidazione non vengono salvati, così una lettura lenta non può
+    rimettere in cache un valore già superato da una scrittura.
+    I valori sono condivisi tra i chiamanti e vanno trattati in sola lettura.
+    Con metrics=True hit e miss sono esportati anche su /metrics (label cache=name).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = "cache", metrics: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._count_hit, self._count_miss = cache_lookup_counters(name) if metrics else (_no_metric, _no_metric)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Any:
+        """Restituisce il valore in cache o MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                self._count_miss()
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                self._count_miss()
+                return MISSING
+            self._data.move_to_end(key)
+            self._hits += 1
+            self._count_hit()
+            return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        """Salva un valore; con generation lo salva solo se nel frattempo non ci sono state invalidazioni."""
+        if self.maxsize <= 0:
+            return False
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+            return True
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Read-through: restituisce il valore in cache o lo carica con loader().
+
+        Le eccezioni di loader vengono propagate e nulla viene salvato.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        generation = self._generation
+        value = loader()
+        self.set(key, value, generation=generation)
+        return value
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """Salva il valore solo se la chiave non è presente (o è scaduta)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            return True
+
+    def incr(self, key: Hashable, amount: int = 1) -> int:
+        """Incrementa un contatore intero (creandolo da zero), senza scadenza."""
+        with self._lock:
+            entry = self._data.get(key)
+            value = (entry[0] if entry is not None and entry[1] > time.monotonic() else 0) + amount
+            self._data[key] = (value, float("inf"))
+            self._data.move_to_end(key)
+            return value
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+class CacheBackend:
+    """Interfaccia dei backend di cache (chiavi stringa, valori picklabili)."""
+    name = "base"
+
+    def get(self, key: str) -> Any:
+        """Restituisce il valore o MISSING."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def add(self, key: str, value: Any, ttl: float) -> Optional[bool]:
+        """Scrive solo se la chiave non esiste; True se la scrittura è avvenuta,
+        False se la chiave esiste già, None se il backend non è raggiungibile."""
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Incrementa un contatore senza scadenza (creandolo da zero)."""
+        raise NotImplementedError
+
+    def get_int(self, key: str) -> Optional[int]:
+        """Legge un contatore scritto con incr (None se assente)."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """Backend nel processo corrente (una copia per worker)."""
+    name = "memory"
+
+    def __init__(self, maxsize: int = 10000):
+        # Le letture sono già contate dalle VersionedCache che usano il backend
+        self._cache = TTLCache(maxsize, ttl=0, name="memory", metrics=False)
+
+    def get(self, key: str) -> Any:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        return self._cache.add(key, value, ttl=ttl)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return self._cache.incr(key, amount)
+
+    def get_int(self, key: str) -> Optional[int]:
+        value = self._cache.get(key)
+        return None if value is MISSING else value
+
+    def delete(self, key: str) -> None:
+        self._cache.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self._cache.stats()}
+
+
+class RedisBackend(CacheBackend):
+    """Backend condiviso tra i worker su un server con protocollo Redis.
+
+    Accetta un client già costruito (es. fakeredis.FakeRedis nei test locali)
+    oppure lo crea dall'URL; i valori sono serializzati con pickle.
+    """
+    name = "redis"
+
+    def __init__(self, client=None, url: Optional[str] = None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("Il pacchetto 'redis' non è installato: impossibile usare CACHE_BACKEND=redis")
+            client = redis.Redis.from_url(url or REDIS_URL)
+        self.client = client
+        self._errors = 0
+
+    @staticmethod
+    def _px(ttl: float) -> Optional[int]:
+        """TTL in millisecondi per SET (None = nessuna scadenza)."""
+        return None if ttl == float("inf") else max(1, int(ttl * 1000))
+
+    def get(self, key: str) -> Any:
+        try:
+            data = self.client.get(key)
+        except Exception as e:
+            # Redis non raggiungibile: si comporta come un miss
+            self._errors += 1
+            logger.warning(f"Lettura dalla cache Redis fallita per '{key}': {e}")
+            return MISSING
+        return MISSING if data is None else pickle.loads(data)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), px=self._px(ttl))
+        except Exception as e:
+            self._errors += 1
+            logger.warning(f"Scrittura nella cache Redis fallita per '{key}': {e}")
+
+    def add(self, key: str, value: Any, ttl: float) -> Optional[bool]:
+        try:
+            return bool(self.client.set(key, pickle.dumps(value), px=self._px(ttl), nx=True))
+        except Exception as e:
+            # Errore distinto dalla chiave già presente (NX): None, non False
+            self._errors += 1
+            logger.warning(f"Scrittura nella cache Redis fallita per '{key}': {e}")
+            return None
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return int(self.client.incr(key, amount))
+
+    def get_int(self, key: str) -> Optional[int]:
+        data = self.client.get(key)
+        return None if data is None else int(data)
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(key)
+        except Exception as e:
+            self._errors += 1
+            logger.warning(f"Cancellazione dalla cache Redis fallita per '{key}': {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "errors": self._errors}
+
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend() -> CacheBackend:
+    """Backend di cache del processo, scelto con CACHE_BACKEND (memory o redis)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if CACHE_BACKEND == "redis":
+                    _backend = RedisBackend(url=REDIS_URL)
+                else:
+                    _backend = MemoryBackend(CACHE_MEMORY_MAXSIZE)
+                logger.info(f"Backend di cache: {_backend.name}")
+    return _backend
+
+
+def set_cache_backend(backend: Optional[CacheBackend]) -> None:
+    """Sostituisce il backend del processo (es. un RedisBackend su fakeredis)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+class VersionedCache:
+    """Cache read-through con namespace versionato e protezione dagli stampede.
+
+    Le chiavi includono la versione del namespace: invalidate() incrementa la
+    versione sul backend e così svuota il namespace per tutti i worker, senza
+    cancellare chiavi una per una (le vecchie scadono per TTL). Ogni worker
+    rilegge la versione al più ogni CACHE_VERSION_TTL secondi.
+
+    Su un miss un solo chiamante alla volta (anche tra worker diversi) esegue
+    il caricamento, tenendo un lock sul backend; gli altri attendono il valore
+    fino a CACHE_LOCK_WAIT secondi e poi caricano da soli.
+    """
+
+    def __init__(self, namespace: str, ttl: float, backend: Optional[CacheBackend] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._backend = backend
+        self._version_key = f"{CACHE_KEY_PREFIX}:{namespace}:version"
+        self._version: Optional[int] = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._loads = 0
+        self._lock_waits = 0
+        self._count_hit, self._count_miss = cache_lookup_counters(namespace)
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache_backend()
+
+    def _current_version(self) -> int:
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked < CACHE_VERSION_TTL:
+            return self._version
+        try:
+            version = self.backend.get_int(self._version_key)
+            if version is None:
+                # Versione assente (primo avvio o chiave espulsa): si parte da un valore mai usato prima
+                version = self.backend.incr(self._version_key, time.time_ns())
+        except Exception as e:
+            logger.warning(f"Lettura della versione della cache '{self.namespace}' fallita: {e}")
+            return self._version or 0
+        with self._lock:
+            self._version, self._version_checked = int(version), now
+        return self._version
+
+    def _key(self, key: str) -> str:
+        return f"{CACHE_KEY_PREFIX}:{self.namespace}:v{self._current_version()}:{key}"
+
+    def get(self, key: str) -> Any:
+        value = self.backend.get(self._key(key))
+        if value is MISSING:
+            with self._lock:
+                self._misses += 1
+            self._count_miss()
+        else:
+            with self._lock:
+                self._hits += 1
+            self._count_hit()
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.backend.set(self._key(key), value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(self._key(key))
+
+    def invalidate(self) -> None:
+        """Svuota il namespace per tutti i worker."""
+        try:
+            if self.backend.get_int(self._version_key) is None:
+                self.backend.incr(self._version_key, time.time_ns())
+            version = self.backend.incr(self._version_key)
+        except Exception as e:
+            logger.error(f"Invalidazione della cache '{self.namespace}' fallita: {e}")
+            return
+        with self._lock:
+            self._version, self._version_checked = int(version), time.monotonic()
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Read-through con un solo caricamento concorrente per chiave."""
+        full_key = self._key(key)
+        backend = self.backend
+        value = backend.get(full_key)
+        if value is not MISSING:
+            with self._lock:
+                self._hits += 1
+            self._count_hit()
+            return value
+        with self._lock:
+            self._misses += 1
+        self._count_miss()
+
+        lock_key = f"{full_key}:lock"
+        acquired = backend.add(lock_key, 1, CACHE_LOCK_TTL)
+        if acquired is None:
+            # Backend non raggiungibile: nessun altro può tenere il lock, carica subito
+            lock_key = None
+        elif not acquired:
+            # Un altro chiamante sta già caricando: attende il suo risultato
+            with self._lock:
+                self._lock_waits += 1
+            deadline = time.monotonic() + CACHE_LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                value = backend.get(full_key)
+                if value is not MISSING:
+                    return value
+            logger.warning(f"Attesa del caricamento di '{full_key}' scaduta, carico senza lock")
+            lock_key = None
+
+        try:
+            with self._lock:
+                self._loads += 1
+            value = loader()
+            backend.set(full_key, value, self.ttl if ttl is None else ttl)
+            return value
+        finally:
+            if lock_key:
+                backend.delete(lock_key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "namespace": self.namespace,
+                "version": self._version,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "loads": self._loads,
+                "lock_waits": self._lock_waits,
+                "backend": self.backend.stats(),
+            }
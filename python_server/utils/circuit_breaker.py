@@ -0,0 +1,179 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from ..config.settings import (
+    TRAVEL_API_BREAKER_WINDOW, TRAVEL_API_BREAKER_MIN_CALLS, TRAVEL_API_BREAKER_ERROR_RATE,
+    TRAVEL_API_BREAKER_SLOW_CALL_RATIO, TRAVEL_API_BREAKER_SLOW_RATE, TRAVEL_API_BREAKER_OPEN_SECONDS,
+    TRAVEL_API_BREAKER_HALF_OPEN_CALLS, TRAVEL_API_TIMEOUT_P95_MULTIPLIER, TRAVEL_API_TIMEOUT_MIN,
+    TRAVEL_API_TIMEOUT_MIN_SAMPLES
+)
+
+logger = logging.getLogger(__name__)
+
+# Stati del circuito
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Chiamata rifiutata subito perché il circuito è aperto."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' aperto, nuovo tentativo tra {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker con soglie su tasso di errore e di chiamate lente, e timeout adattivo.
+
+    closed: le chiamate passano e vengono registrate in una finestra mobile di
+    window secondi; con almeno min_calls chiamate, se la quota di errori o di
+    chiamate più lente di slow_call supera la soglia il circuito si apre
+    (di default slow_call è TRAVEL_API_BREAKER_SLOW_CALL_RATIO * max_timeout,
+    così ogni endpoint ha la soglia adatta al proprio timeout).
+    open: le chiamate falliscono subito con CircuitOpenError per open_seconds.
+    half_open: passano al più half_open_calls chiamate di prova; se riescono
+    tutte il circuito si richiude, al primo errore si riapre.
+
+    timeout() restituisce il timeout di lettura da usare: p95 delle latenze
+    recenti per un moltiplicatore, tra TRAVEL_API_TIMEOUT_MIN e max_timeout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_timeout: float,
+        window: float = TRAVEL_API_BREAKER_WINDOW,
+        min_calls: int = TRAVEL_API_BREAKER_MIN_CALLS,
+        error_rate: float = TRAVEL_API_BREAKER_ERROR_RATE,
+        slow_call: Optional[float] = None,
+        slow_rate: float = TRAVEL_API_BREAKER_SLOW_RATE,
+        open_seconds: float = TRAVEL_API_BREAKER_OPEN_SECONDS,
+        half_open_calls: int = TRAVEL_API_BREAKER_HALF_OPEN_CALLS,
+    ):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = max_timeout * TRAVEL_API_BREAKER_SLOW_CALL_RATIO if slow_call is None else slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # (istante, errore, latenza) delle chiamate nella finestra
+        self._calls: deque = deque()
+        self._trial_in_flight = 0
+        self._trial_successes = 0
+        self._rejected = 0
+        self._opened = 0
+
+    def _trim(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _open(self, now: float, reason: str) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._opened += 1
+        self._trial_in_flight = self._trial_successes = 0
+        logger.warning(f"Circuito '{self.name}' aperto: {reason}")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """Da chiamare prima di ogni richiesta: solleva CircuitOpenError se va rifiutata."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                remaining = self.open_seconds - (now - self._opened_at)
+                if remaining > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self._state = HALF_OPEN
+                self._trial_in_flight = self._trial_successes = 0
+                logger.info(f"Circuito '{self.name}' semi-aperto: chiamate di prova")
+            if self._state == HALF_OPEN:
+                if self._trial_in_flight + self._trial_successes >= self.half_open_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._trial_in_flight += 1
+
+    def release(self) -> None:
+        """Libera il posto di una chiamata ammessa ma annullata, senza registrarne l'esito."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = max(0, self._trial_in_flight - 1)
+
+    def record(self, success: bool, latency: float) -> None:
+        """Registra l'esito di una chiamata ammessa da before_call."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = max(0, self._trial_in_flight - 1)
+                if not success:
+                    self._open(now, "chiamata di prova fallita")
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"Circuito '{self.name}' richiuso")
+            self._calls.append((now, not success, latency))
+            self._trim(now)
+            if self._state != CLOSED or len(self._calls) < self.min_calls:
+                return
+            total = len(self._calls)
+            errors = sum(1 for _, failed, _ in self._calls if failed)
+            slow = sum(1 for _, _, lat in self._calls if lat >= self.slow_call)
+            if errors / total >= self.error_rate:
+                self._open(now, f"{errors}/{total} errori negli ultimi {self.window:.0f}s")
+            elif slow / total >= self.slow_rate:
+                self._open(now, f"{slow}/{total} chiamate oltre {self.slow_call}s negli ultimi {self.window:.0f}s")
+
+    def _p95(self) -> Optional[float]:
+        latencies = sorted(lat for _, failed, lat in self._calls if not failed)
+        if len(latencies) < TRAVEL_API_TIMEOUT_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    def timeout(self) -> float:
+        """Timeout di lettura adattivo (max_timeout finché non ci sono abbastanza campioni)."""
+        with self._lock:
+            self._trim(time.monotonic())
+            p95 = self._p95()
+        if p95 is None:
+            return self.max_timeout
+        return max(TRAVEL_API_TIMEOUT_MIN, min(self.max_timeout, p95 * TRAVEL_API_TIMEOUT_P95_MULTIPLIER))
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        timeout = self.timeout()
+        with self._lock:
+            total = len(self._calls)
+            errors = sum(1 for _, failed, _ in self._calls if failed)
+            p95 = self._p95()
+            return {
+                "state": state,
+                "calls_in_window": total,
+                "error_rate": round(errors / total, 4) if total else None,
+                "p95_latency": round(p95, 4) if p95 is not None else None,
+                "timeout": round(timeout, 3),
+                "slow_call": self.slow_call,
+                "rejected": self._rejected,
+                "opened": self._opened,
+            }
@@ -0,0 +1,137 @@
+"""Metriche Prometheus del server (endpoint /metrics).
+
+Con PROMETHEUS_MULTIPROC_DIR impostata (una directory vuota e scrivibile,
+condivisa dai worker gunicorn) prometheus_client scrive i valori su file mmap
+e /metrics aggrega tutti i processi. In gunicorn va aggiunto al config:
+
+    def child_exit(server, worker):
+        from python_server.utils.metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+
+Se prometheus_client non è installato le funzioni di questo modulo non fanno
+nulla e /metrics risponde 503.
+"""
+import logging
+import os
+import re
+import time
+from typing import Callable, Optional, Tuple
+
+from ..config.settings import METRICS_ENABLED
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, multiprocess
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# Bucket (secondi) per latenze da pochi millisecondi a decine di secondi
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ENABLED = METRICS_ENABLED and prometheus_client is not None
+
+if ENABLED:
+    HTTP_REQUESTS = Counter(
+        "yookve_http_requests_total", "Richieste HTTP servite", ["method", "endpoint", "status"])
+    HTTP_LATENCY = Histogram(
+        "yookve_http_request_duration_seconds", "Durata delle richieste HTTP per route",
+        ["method", "endpoint"], buckets=LATENCY_BUCKETS)
+    HTTP_IN_FLIGHT = Gauge(
+        "yookve_http_requests_in_flight", "Richieste HTTP in corso", multiprocess_mode="livesum")
+    OPENSEARCH_LATENCY = Histogram(
+        "yookve_opensearch_request_duration_seconds", "Durata delle chiamate a OpenSearch per indice e operazione",
+        ["index", "operation"], buckets=LATENCY_BUCKETS)
+    TRAVEL_API_LATENCY = Histogram(
+        "yookve_travel_api_request_duration_seconds", "Durata delle chiamate all'API di viaggio esterna per endpoint",
+        ["endpoint"], buckets=LATENCY_BUCKETS)
+    TRAVEL_API_REQUESTS = Counter(
+        "yookve_travel_api_requests_total", "Chiamate all'API di viaggio esterna per endpoint ed esito",
+        ["endpoint", "outcome"])
+    CACHE_LOOKUPS = Counter(
+        "yookve_cache_lookups_total", "Letture delle cache per esito (hit ratio = hit / totale)",
+        ["cache", "result"])
+
+
+# Segmenti del path OpenSearch che identificano l'operazione (il resto sono indici e ID)
+_OPENSEARCH_OPERATION = re.compile(r"^_[a-z_]+$")
+
+
+def _opensearch_labels(method: str, url: str) -> Tuple[str, str]:
+    """Indice e operazione di una chiamata OpenSearch, senza ID di documento nelle label."""
+    segments = [s for s in url.split("?", 1)[0].split("/") if s]
+    index = segments[0] if segments and not segments[0].startswith("_") else "_all"
+    operation = next((s for s in segments if _OPENSEARCH_OPERATION.match(s)), "_index" if index != "_all" else "_root")
+    return index, f"{method} {operation}"
+
+
+def observe_opensearch(method: str, url: str, seconds: float) -> None:
+    if ENABLED:
+        OPENSEARCH_LATENCY.labels(*_opensearch_labels(method, url)).observe(seconds)
+
+
+def observe_travel_api(endpoint: str, seconds: Optional[float], outcome: str) -> None:
+    """outcome: ok, http_error (status >= 400), error (eccezione), cancelled o
+    rejected (circuito aperto, nessuna chiamata: seconds è None)."""
+    if ENABLED:
+        if seconds is not None:
+            TRAVEL_API_LATENCY.labels(endpoint).observe(seconds)
+        TRAVEL_API_REQUESTS.labels(endpoint, outcome).inc()
+
+
+def _noop() -> None:
+    pass
+
+
+def cache_lookup_counters(cache: str) -> Tuple[Callable[[], None], Callable[[], None]]:
+    """Funzioni (hit, miss) che contano le letture di una cache; no-op senza prometheus_client."""
+    if not ENABLED:
+        return _noop, _noop
+    return CACHE_LOOKUPS.labels(cache, "hit").inc, CACHE_LOOKUPS.labels(cache, "miss").inc
+
+
+def init_metrics(app) -> None:
+    """Conta le richieste e ne misura la durata per route (endpoint Flask)."""
+    if not ENABLED:
+        if METRICS_ENABLED:
+            logger.warning("prometheus_client non installato: metriche disabilitate")
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _metrics_observe(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            endpoint = request.endpoint or "unmatched"
+            HTTP_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def _metrics_end(exc):
+        if g.get("metrics_started") is not None:
+            HTTP_IN_FLIGHT.dec()
+
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """Metriche nel formato di esposizione Prometheus (tutti i worker in multiprocesso), o None."""
+    if not ENABLED:
+        return None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Da chiamare quando un worker termina (hook child_exit di gunicorn)."""
+    if prometheus_client is not None and os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
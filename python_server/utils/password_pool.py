@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from ..config.settings import PASSWORD_POOL_WORKERS, PASSWORD_POOL_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordPoolFull(Exception):
+    """Pool di hashing saturo: la richiesta va rifiutata subito (503) invece di accodarla."""
+
+
+class PasswordPool:
+    """Pool di thread dedicato a hashing e verifica delle password (bcrypt, scrypt).
+
+    bcrypt e hashlib.scrypt rilasciano il GIL durante il calcolo, quindi bastano
+    i thread: il costo CPU resta limitato a max_workers calcoli in parallelo e
+    i thread delle richieste non restano occupati da un burst di login.
+    Oltre max_workers + max_queue operazioni in corso submit solleva subito
+    PasswordPoolFull.
+    """
+
+    def __init__(self, max_workers: int = PASSWORD_POOL_WORKERS, max_queue: int = PASSWORD_POOL_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yookve-password")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._submitted = 0
+        self._rejected = 0
+
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Accoda fn(*args) nel pool; solleva PasswordPoolFull se la coda è piena."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"Pool password saturo ({self.max_workers} worker, coda {self.max_queue}): richiesta rifiutata")
+            raise PasswordPoolFull("Troppe richieste di autenticazione in corso")
+        with self._lock:
+            self._in_flight += 1
+            self._submitted += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Esegue fn(*args) nel pool e ne attende il risultato (chiamanti sincroni)."""
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Come run, ma senza bloccare l'event loop (route async)."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_password_pool() -> PasswordPool:
+    """Restituisce il pool condiviso dal processo, creandolo alla prima chiamata."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PasswordPool()
+    return _pool
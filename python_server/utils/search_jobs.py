@@ -0,0 +1,484 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from opensearchpy.exceptions import NotFoundError
+
+from ..config.opensearch_client import get_async_opensearch_client
+from ..config.settings import (
+    INDEX_SEARCH_RESULTS, SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL, SEARCH_RESULT_CACHE_PERSIST,
+    SEARCH_JOB_POLL_INITIAL, SEARCH_JOB_POLL_MAX, SEARCH_JOB_POLL_FACTOR, SEARCH_JOB_TIMEOUT,
+    SEARCH_JOB_MAX_CONCURRENT_POLLS, SEARCH_JOB_MAX_ERRORS, SEARCH_JOB_RETENTION, SEARCH_JOB_MAX_JOBS,
+    SEARCH_JOB_OWNER_TTL, SEARCH_JOB_MAX_USERS
+)
+from .cache import TTLCache, VersionedCache, MISSING
+from .travel_api_client import AsyncTravelApiClient, TravelApiClient
+
+logger = logging.getLogger(__name__)
+
+# Stati di un job di ricerca
+JOB_PENDING = "PENDING"
+JOB_COMPLETED = "COMPLETED"
+JOB_FAILED = "FAILED"
+
+
+def search_fingerprint(preference: Any) -> str:
+    """Impronta canonica della ricerca: sha256 del payload inviato all'API esterna, a chiavi ordinate.
+
+    Preferenze diverse che producono lo stesso payload (stessi interessi, date,
+    viaggiatori, ...) hanno la stessa impronta.
+    """
+    search_input = TravelApiClient.map_preference_to_search_input(preference)
+    canonical = json.dumps(search_input, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SearchResultCache:
+    """Risultati delle ricerche completate, per impronta del payload.
+
+    Cache LRU+TTL nel processo; con SEARCH_RESULT_CACHE_PERSIST i risultati
+    vengono salvati anche nell'indice OpenSearch INDEX_SEARCH_RESULTS, così
+    sopravvivono ai riavvii e sono condivisi tra i worker.
+    """
+
+    def __init__(self, maxsize: int = SEARCH_RESULT_CACHE_SIZE, ttl: float = SEARCH_RESULT_CACHE_TTL,
+                 persist: bool = SEARCH_RESULT_CACHE_PERSIST):
+        self.ttl = ttl
+        self.persist = persist
+        self._local = TTLCache(maxsize, ttl, name="search_results")
+        self._persisted_hits = 0
+
+    async def get(self, fingerprint: str) -> Any:
+        """Risultato in cache o MISSING."""
+        result = self._local.get(fingerprint)
+        if result is not MISSING or not self.persist:
+            return result
+        try:
+            response = await get_async_opensearch_client().get(index=INDEX_SEARCH_RESULTS, id=fingerprint)
+        except NotFoundError:
+            return MISSING
+        except Exception as e:
+            logger.warning(f"Lettura del risultato {fingerprint} da OpenSearch fallita: {e}")
+            return MISSING
+        source = response["_source"]
+        remaining = source.get("expiresAt", 0) - time.time()
+        if remaining <= 0:
+            return MISSING
+        self._persisted_hits += 1
+        self._local.set(fingerprint, source["result"], ttl=remaining)
+        return source["result"]
+
+    async def set(self, fingerprint: str, result: Any) -> None:
+        self._local.set(fingerprint, result)
+        if not self.persist:
+            return
+        now = time.time()
+        try:
+            await get_async_opensearch_client().index(
+                index=INDEX_SEARCH_RESULTS,
+                id=fingerprint,
+                body={"fingerprint": fingerprint, "result": result, "createdAt": now, "expiresAt": now + self.ttl},
+                refresh=False
+            )
+        except Exception as e:
+            logger.warning(f"Salvataggio del risultato {fingerprint} su OpenSearch fallito: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._local.stats(), "persist": self.persist, "persisted_hits": self._persisted_hits}
+
+
+class SearchJob:
+    """Stato locale di una ricerca sull'API esterna (l'ID è quello del job remoto)."""
+
+    def __init__(self, job_id: str, user_id: str, status: str = JOB_PENDING, fingerprint: Optional[str] = None):
+        self.job_id = job_id
+        self.user_id = user_id
+        # Utenti che condividono il job (stessa impronta di ricerca), in ordine
+        # di ultimo accesso: un dict usato come insieme ordinato
+        self.user_ids: Dict[str, None] = {user_id: None}
+        self.fingerprint = fingerprint
+        self.status = status
+        self.upstream_status = status
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.polls = 0
+        # Incrementata a ogni cambio di stato (id degli eventi SSE)
+        self.version = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def allows(self, user_id: str) -> bool:
+        """True se l'utente ha avviato o condivide il job."""
+        return user_id in self.user_ids
+
+    def add_user(self, user_id: str) -> None:
+        """Aggiunge un utente al job; oltre SEARCH_JOB_MAX_USERS escono i meno recenti."""
+        self.user_ids.pop(user_id, None)
+        self.user_ids[user_id] = None
+        while len(self.user_ids) > SEARCH_JOB_MAX_USERS:
+            del self.user_ids[next(iter(self.user_ids))]
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "user_ids": list(self.user_ids),
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "upstream_status": self.upstream_status,
+            "result": self.result,
+            "error": self.error,
+            "polls": self.polls,
+            "version": self.version,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if not include_result:
+            del data["result"]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SearchJob":
+        job = cls(data["job_id"], data["user_id"], data["status"], data.get("fingerprint"))
+        job.user_ids = dict.fromkeys(data.get("user_ids") or [data["user_id"]])
+        for field in ("upstream_status", "result", "error", "polls", "version", "created_at", "updated_at"):
+            setattr(job, field, data.get(field))
+        return job
+
+
+class SearchJobManager:
+    """Esegue in background le ricerche sull'API esterna e ne conserva l'esito.
+
+    La ricerca viene avviata una sola volta; il polling del job remoto avviene
+    in task sull'event loop condiviso, con intervallo crescente (backoff
+    adattivo) e al più SEARCH_JOB_MAX_CONCURRENT_POLLS richieste in corso.
+    Gli endpoint leggono lo stato dalla memoria del processo o, per i job
+    avviati da un altro worker, dalla cache condivisa, senza chiamare l'API esterna.
+
+    Sulla cache condivisa (con Redis una chiamata di rete bloccante) lo stato
+    è salvato senza il risultato, che viene scritto una sola volta sotto una
+    chiave a parte quando il job si completa; dall'event loop le letture e le
+    scritture passano da asyncio.to_thread.
+    """
+
+    def __init__(self, client: Optional[AsyncTravelApiClient] = None):
+        self.client = client or AsyncTravelApiClient()
+        self._jobs: "OrderedDict[str, SearchJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Notifica i thread in attesa di un cambio di stato (stream SSE)
+        self._changed = threading.Condition(self._lock)
+        self._shared = VersionedCache("search_jobs", SEARCH_JOB_RETENTION)
+        # Utenti autorizzati per ogni job avviato da start(): sopravvive allo stato
+        # del job, così track può riprendere solo job realmente avviati
+        self._owners = VersionedCache("search_job_owners", SEARCH_JOB_OWNER_TTL)
+        self._tasks = set()
+        self._poll_semaphore = None
+        self._upstream_polls = 0
+        self._started = 0
+        self.results = SearchResultCache()
+        # Impronta -> job in corso, per condividere le ricerche identiche
+        self._inflight: Dict[str, SearchJob] = {}
+        # Impronta -> avvio in corso (cache dei risultati e start_search): chi
+        # arriva con la stessa impronta lo attende invece di avviarne un altro
+        self._launching: Dict[str, asyncio.Task] = {}
+        self._shared_searches = 0
+        self._cached_searches = 0
+
+    # --- stato dei job ---
+
+    def get(self, job_id: str) -> Optional[SearchJob]:
+        """Stato del job: dalla memoria locale o dalla cache condivisa tra i worker.
+
+        Bloccante con il backend Redis: dall'event loop usare aget.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return self._load_shared(job_id)
+
+    async def aget(self, job_id: str) -> Optional[SearchJob]:
+        """Come get, senza bloccare l'event loop."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return await asyncio.to_thread(self._load_shared, job_id)
+
+    def _load_shared(self, job_id: str) -> Optional[SearchJob]:
+        data = self._shared.get(job_id)
+        if data is MISSING:
+            return None
+        job = SearchJob.from_dict(data)
+        if job.status == JOB_COMPLETED:
+            result = self._shared.get(f"{job_id}:result")
+            job.result = None if result is MISSING else result
+        return job
+
+    async def _store(self, job: SearchJob, with_result: bool = False) -> None:
+        """Aggiorna il job in memoria e sulla cache condivisa (il risultato solo con with_result)."""
+        job.updated_at = time.time()
+        with self._lock:
+            job.version += 1
+            self._jobs[job.job_id] = job
+            self._jobs.move_to_end(job.job_id)
+            self._prune()
+            self._changed.notify_all()
+        await asyncio.to_thread(self._publish, job.job_id, job.to_dict(include_result=False),
+                                job.result if with_result else MISSING)
+
+    def _publish(self, job_id: str, data: Dict[str, Any], result: Any) -> None:
+        if result is not MISSING:
+            # Prima del job: chi legge un job COMPLETED trova già il risultato
+            self._shared.set(f"{job_id}:result", result)
+        self._shared.set(job_id, data)
+
+    async def _save_owners(self, job: SearchJob) -> None:
+        await asyncio.to_thread(self._merge_owners, job.job_id, list(job.user_ids))
+
+    def _merge_owners(self, job_id: str, user_ids: List[str]) -> None:
+        """Aggiorna i proprietari del job, unendoli a quelli salvati da altri worker."""
+        saved = self._owners.get(job_id)
+        owners = dict.fromkeys([] if saved is MISSING else saved)
+        for user_id in user_ids:
+            owners.pop(user_id, None)
+            owners[user_id] = None
+        self._owners.set(job_id, list(owners)[-SEARCH_JOB_MAX_USERS:])
+
+    def is_local(self, job_id: str) -> bool:
+        """True se il job è seguito da questo processo."""
+        with self._lock:
+            return job_id in self._jobs
+
+    def wait_for_change(self, job_id: str, version: int, timeout: float) -> Optional[SearchJob]:
+        """Attende (al più timeout secondi) che il job superi la versione indicata.
+
+        Per i job seguiti da un altro worker non arriva alcuna notifica: allo
+        scadere del timeout si rilegge lo stato dalla cache condivisa.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: (job := self._jobs.get(job_id)) is not None and job.version > version,
+                timeout=timeout
+            )
+        return self.get(job_id)
+
+    def _prune(self) -> None:
+        """Scarta i job conclusi più vecchi di SEARCH_JOB_RETENTION e oltre SEARCH_JOB_MAX_JOBS."""
+        expired_before = time.time() - SEARCH_JOB_RETENTION
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if len(self._jobs) <= SEARCH_JOB_MAX_JOBS and job.updated_at >= expired_before:
+                break
+            if job.done:
+                del self._jobs[job_id]
+
+    # --- avvio e polling ---
+
+    async def start(self, user_id: str, preference: Any) -> SearchJob:
+        """Avvia una ricerca e il suo polling in background (da chiamare sull'event loop condiviso).
+
+        Se la stessa ricerca (stessa impronta) è già in corso o in avvio,
+        l'utente si aggiunge a quel job; se è già stata completata di recente,
+        il job restituito è subito COMPLETED con il risultato in cache.
+        """
+        fingerprint = search_fingerprint(preference)
+        job = self._inflight.get(fingerprint)
+        if job is not None and not job.done:
+            self._shared_searches += 1
+            await self._join(job, user_id)
+            return job
+
+        # Registrato prima di qualsiasi await: le chiamate concorrenti con la
+        # stessa impronta attendono questo avvio. Il task è indipendente dal
+        # chiamante, che può essere annullato senza annullarlo per gli altri.
+        launch = self._launching.get(fingerprint)
+        if launch is None:
+            launch = asyncio.ensure_future(self._launch(user_id, preference, fingerprint))
+            self._launching[fingerprint] = launch
+            launch.add_done_callback(lambda task: self._launched(fingerprint, task))
+        else:
+            self._shared_searches += 1
+        job = await asyncio.shield(launch)
+        if not job.allows(user_id):
+            await self._join(job, user_id)
+        return job
+
+    def _launched(self, fingerprint: str, task: asyncio.Task) -> None:
+        if self._launching.get(fingerprint) is task:
+            del self._launching[fingerprint]
+        if not task.cancelled():
+            task.exception()
+
+    async def _join(self, job: SearchJob, user_id: str) -> None:
+        job.add_user(user_id)
+        await self._save_owners(job)
+        await self._store(job)
+
+    async def _launch(self, user_id: str, preference: Any, fingerprint: str) -> SearchJob:
+        result = await self.results.get(fingerprint)
+        if result is not MISSING:
+            self._cached_searches += 1
+            job = await self.aget(f"fp-{fingerprint}")
+            # Risultato da pubblicare solo per un job nuovo o che non lo aveva più
+            publish = job is None or job.result is None
+            job = job or SearchJob(f"fp-{fingerprint}", user_id, JOB_COMPLETED, fingerprint)
+            job.add_user(user_id)
+            job.status = job.upstream_status = JOB_COMPLETED
+            job.result = result
+            await self._save_owners(job)
+            await self._store(job, with_result=publish)
+            return job
+
+        response = await self.client.start_search(preference)
+        if not isinstance(response, dict) or "error" in response or not response.get("job_id"):
+            error = response.get("error") if isinstance(response, dict) else "Risposta non valida dal server esterno"
+            raise RuntimeError(error or "Risposta non valida dal server esterno")
+        job_id = str(response["job_id"])
+        existing = await self.aget(job_id)
+        if existing is not None:
+            # Stesso job remoto già seguito (da questo o da un altro worker): si condivide
+            self._shared_searches += 1
+            await self._join(existing, user_id)
+            return existing
+
+        self._started += 1
+        job = SearchJob(job_id, user_id, fingerprint=fingerprint)
+        await self._save_owners(job)
+        if response.get("status") == JOB_COMPLETED and "packages" in response:
+            # Ricerca già conclusa nella risposta iniziale
+            job.status = job.upstream_status = JOB_COMPLETED
+            job.result = response
+            await self.results.set(fingerprint, response)
+            await self._store(job, with_result=True)
+            return job
+        job.upstream_status = response.get("status", JOB_PENDING)
+        self._inflight[fingerprint] = job
+        await self._store(job)
+        self._spawn(job)
+        return job
+
+    async def track(self, job_id: str, user_id: str) -> Optional[SearchJob]:
+        """Stato del job, riprendendone il polling se lo stato è scaduto (es. dopo un riavvio).
+
+        Riprende solo i job avviati da start() per questo utente: per ID
+        sconosciuti o di altri utenti restituisce None, senza chiamare l'API esterna.
+        """
+        job = await self.aget(job_id)
+        if job is not None:
+            return job
+        owners = await asyncio.to_thread(self._owners.get, job_id)
+        if owners is MISSING or user_id not in owners:
+            return None
+        job = SearchJob(job_id, owners[0])
+        job.user_ids = dict.fromkeys(owners)
+        await self._store(job)
+        self._spawn(job)
+        return job
+
+    def _spawn(self, job: SearchJob) -> None:
+        # Contesto vuoto: i poll in background non vanno negli span della richiesta che ha avviato il job
+        task = asyncio.create_task(self._run(job), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: SearchJob) -> None:
+        """Segue il job fino alla fine e ne salva il risultato nella cache per impronta."""
+        try:
+            await self._poll(job)
+            # Solo risultati veri: i dati fittizi di fallback (liste) non vanno riutilizzati
+            if job.fingerprint and job.status == JOB_COMPLETED and isinstance(job.result, dict) and "error" not in job.result:
+                await self.results.set(job.fingerprint, job.result)
+        finally:
+            if job.fingerprint and self._inflight.get(job.fingerprint) is job:
+                del self._inflight[job.fingerprint]
+
+    async def _poll(self, job: SearchJob) -> None:
+        if self._poll_semaphore is None:
+            self._poll_semaphore = asyncio.Semaphore(SEARCH_JOB_MAX_CONCURRENT_POLLS)
+        delay = SEARCH_JOB_POLL_INITIAL
+        deadline = job.created_at + SEARCH_JOB_TIMEOUT
+        errors = 0
+        try:
+            while time.time() < deadline:
+                await asyncio.sleep(delay)
+                async with self._poll_semaphore:
+                    self._upstream_polls += 1
+                    job.polls += 1
+                    try:
+                        status_data = await self.client.get_search_status(job.job_id)
+                    except Exception as e:
+                        status_data = {"error": str(e)}
+                    if "error" in status_data:
+                        errors += 1
+                        logger.warning(f"Polling del job {job.job_id} fallito ({errors}/{SEARCH_JOB_MAX_ERRORS}): {status_data['error']}")
+                        if errors >= SEARCH_JOB_MAX_ERRORS:
+                            job.status, job.error = JOB_FAILED, status_data["error"]
+                            await self._store(job)
+                            return
+                    else:
+                        errors = 0
+                        upstream_status = status_data.get("status", JOB_PENDING)
+                        if upstream_status == JOB_COMPLETED:
+                            job.result = await self.client.get_search_result(job.job_id)
+                            job.status = job.upstream_status = JOB_COMPLETED
+                            await self._store(job, with_result=True)
+                            logger.info(f"Job di ricerca {job.job_id} completato dopo {job.polls} poll")
+                            return
+                        if upstream_status in (JOB_FAILED, "ERROR", "CANCELLED"):
+                            job.status, job.upstream_status = JOB_FAILED, upstream_status
+                            job.error = status_data.get("message", f"Ricerca terminata con stato {upstream_status}")
+                            await self._store(job)
+                            return
+                        if upstream_status != job.upstream_status:
+                            job.upstream_status = upstream_status
+                            await self._store(job)
+                # Backoff adattivo: più il job resta aperto, meno spesso lo si interroga
+                delay = min(SEARCH_JOB_POLL_MAX, delay * SEARCH_JOB_POLL_FACTOR)
+            job.status = JOB_FAILED
+            job.error = "Tempo massimo di attesa della ricerca superato"
+            await self._store(job)
+        except Exception as e:
+            logger.error(f"Errore nel polling del job {job.job_id}: {e}", exc_info=True)
+            job.status, job.error = JOB_FAILED, str(e)
+            await self._store(job)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "pending": sum(1 for j in jobs if not j.done),
+            "completed": sum(1 for j in jobs if j.status == JOB_COMPLETED),
+            "failed": sum(1 for j in jobs if j.status == JOB_FAILED),
+            "started": self._started,
+            "upstream_polls": self._upstream_polls,
+            "polling_tasks": len(self._tasks),
+            "shared_searches": self._shared_searches,
+            "cached_searches": self._cached_searches,
+            "result_cache": self.results.stats(),
+        }
+
+
+_manager: Optional[SearchJobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_search_job_manager() -> SearchJobManager:
+    """Gestore dei job di ricerca del processo."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = SearchJobManager()
+    return _manager
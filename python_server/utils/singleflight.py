@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Chiamata in corso: i chiamanti duplicati attendono il suo esito."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.merged = 0
+
+    def count(self, merged: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            if merged:
+                self.merged += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "merged": self.merged,
+                # Quota di chiamate servite da una richiesta già in corso
+                "merge_rate": round(self.merged / self.calls, 4) if self.calls else None,
+            }
+
+
+class SingleFlight(_Counters):
+    """Unisce le chiamate concorrenti con la stessa chiave in un'unica esecuzione (thread).
+
+    Il primo chiamante esegue fn; chi arriva con la stessa chiave mentre la
+    chiamata è in corso ne riceve lo stesso risultato (o la stessa eccezione).
+    Il risultato è condiviso tra tutti i chiamanti e va trattato in sola lettura.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._calls_lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._calls_lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self.count(merged=not leader)
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._calls_lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight(_Counters):
+    """Come SingleFlight, per coroutine sullo stesso event loop.
+
+    La chiamata condivisa gira in un task proprio e ogni chiamante, il primo
+    compreso, la attende con asyncio.shield: l'annullamento di un chiamante
+    non annulla la chiamata né arriva agli altri chiamanti.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Evita il warning "exception was never retrieved" se nessuno attendeva più
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        self.count(merged=task is not None)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Span della richiesta in corso: nome -> [secondi totali, chiamate]. None fuori
+# da una richiesta (thread in background, job di ricerca): record non fa nulla.
+# Le coroutine eseguite con run_sync ereditano il contesto della richiesta e
+# scrivono nello stesso dizionario.
+_spans: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_spans", default=None)
+
+# Span misurati: OpenSearch, API di viaggio esterna, validazione pydantic,
+# hashing delle password, serializzazione JSON
+SPAN_OPENSEARCH = "opensearch"
+SPAN_TRAVEL_API = "travel_api"
+SPAN_PYDANTIC = "pydantic"
+SPAN_PASSWORD = "password"
+SPAN_JSON = "json"
+
+
+def start_request() -> Dict[str, List[float]]:
+    """Apre la raccolta degli span per la richiesta corrente."""
+    spans: Dict[str, List[float]] = {}
+    _spans.set(spans)
+    return spans
+
+
+def end_request() -> None:
+    """Chiude la raccolta: il thread può servire la richiesta successiva."""
+    _spans.set(None)
+
+
+def current_spans() -> Optional[Dict[str, List[float]]]:
+    return _spans.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Aggiunge una durata allo span name della richiesta corrente (se presente)."""
+    spans = _spans.get()
+    if spans is None:
+        return
+    entry = spans.get(name)
+    if entry is None:
+        spans[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    """Misura il blocco with come span name della richiesta corrente."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def server_timing(spans: Dict[str, List[float]], total: float) -> str:
+    """Valore dell'header Server-Timing (durate in millisecondi)."""
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="{int(count)}x"' for name, (seconds, count) in spans.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def log_fields(spans: Dict[str, List[float]]) -> str:
+    """Span come coppie chiave=valore per le righe di log strutturate."""
+    return " ".join(f"{name}_ms={seconds * 1000:.2f} {name}_n={int(count)}" for name, (seconds, count) in spans.items())
@@ -0,0 +1,149 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Payload di fallback quando l'API esterna non risponde. Vengono costruiti una
+# sola volta all'import e condivisi tra tutte le richieste: vanno solo letti.
+
+MOCK_ITINERARY = {
+    "destinations": ["Roma", "Firenze", "Venezia"],
+    "accommodations": [
+        {
+            "name": "Hotel Test Roma",
+            "type": "Hotel",
+            "location": "Roma",
+            "description": "Hotel fittizio per test",
+            "rating": "4",
+            "price": 150,
+            "nights": 3,
+            "imageUrl": "https://source.unsplash.com/random/800x600/?hotel,rome"
+        },
+        {
+            "name": "Hotel Test Firenze",
+            "type": "Hotel",
+            "location": "Firenze",
+            "description": "Hotel fittizio per test",
+            "rating": "4",
+            "price": 160,
+            "nights": 2,
+            "imageUrl": "https://source.unsplash.com/random/800x600/?hotel,florence"
+        }
+    ],
+    "experiences": [
+        {
+            "name": "Visita Colosseo",
+            "location": "Roma",
+            "description": "Visita guidata del Colosseo",
+            "duration": "3 ore",
+            "price": "Incluso nel pacchetto"
+        },
+        {
+            "name": "Tour Galleria degli Uffizi",
+            "location": "Firenze",
+            "description": "Visita guidata della Galleria degli Uffizi",
+            "duration": "2 ore",
+            "price": "Incluso nel pacchetto"
+        }
+    ]
+}
+
+MOCK_PACKAGES = [
+    {
+        "id_pacchetto": "mock-package-1",
+        "titolo": "Tour Roma e Firenze",
+        "descrizione": "Un viaggio alla scoperta delle città d'arte italiane",
+        "master": {
+            "citta_coinvolte": ["Roma", "Firenze"],
+            "temi_viaggio": ["arte", "cultura", "storia"],
+            "prezzo_totale": 1200
+        },
+        "detail": {
+            "hotels": [
+                {
+                    "nome": "Hotel Roma Centro",
+                    "stelle": 4,
+                    "prezzo_giornaliero": 150,
+                    "id_hotel": "hotel-roma-1"
+                },
+                {
+                    "nome": "Hotel Firenze Centro",
+                    "stelle": 4,
+                    "prezzo_giornaliero": 160,
+                    "id_hotel": "hotel-firenze-1"
+                }
+            ],
+            "tours": [
+                {
+                    "nome": "Visita Colosseo",
+                    "durata": "3 ore",
+                    "prezzo": 50,
+                    "id_tour": "tour-roma-1"
+                },
+                {
+                    "nome": "Tour Galleria degli Uffizi",
+                    "durata": "2 ore",
+                    "prezzo": 40,
+                    "id_tour": "tour-firenze-1"
+                }
+            ]
+        }
+    },
+    {
+        "id_pacchetto": "mock-package-2",
+        "titolo": "Vacanza a Venezia",
+        "descrizione": "Un soggiorno nella città più romantica d'Italia",
+        "master": {
+            "citta_coinvolte": ["Venezia"],
+            "temi_viaggio": ["romantico", "arte", "relax"],
+            "prezzo_totale": 800
+        },
+        "detail": {
+            "hotels": [
+                {
+                    "nome": "Hotel Venezia Laguna",
+                    "stelle": 4,
+                    "prezzo_giornaliero": 180,
+                    "id_hotel": "hotel-venezia-1"
+                }
+            ],
+            "tours": [
+                {
+                    "nome": "Tour Piazza San Marco",
+                    "durata": "2 ore",
+                    "prezzo": 40,
+                    "id_tour": "tour-venezia-1"
+                },
+                {
+                    "nome": "Giro in gondola",
+                    "durata": "1 ora",
+                    "prezzo": 80,
+                    "id_tour": "tour-venezia-2"
+                }
+            ]
+        }
+    }
+]
+
+# Stessi payload già serializzati, per le risposte che li restituiscono tali e quali
+_MOCK_JSON = tuple(
+    (payload, json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    for payload in (MOCK_ITINERARY, MOCK_PACKAGES)
+)
+
+
+def mock_payload(itinerary=False):
+    """Payload di fallback (itinerario o pacchetti), condiviso e in sola lettura."""
+    return MOCK_ITINERARY if itinerary else MOCK_PACKAGES
+
+
+def mock_payload_json(payload):
+    """JSON (bytes) già pronto se payload è uguale a uno dei payload di fallback, altrimenti None.
+
+    Confronta per valore, non per identità: il risultato di un job può arrivare
+    dalla cache condivisa come copia deserializzata del payload di fallback.
+    """
+    for mock, encoded in _MOCK_JSON:
+        if payload is mock or (type(payload) is type(mock) and payload == mock):
+            return encoded
+    return None